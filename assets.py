@@ -0,0 +1,69 @@
+import gzip
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text assets worth compressing; images and fonts are compressed formats already
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+# Content-Encoding -> (file suffix, compressor), preferred first. Brotli only if the optional
+# brotli package is installed.
+ENCODINGS = {'br': ('.br', lambda data: brotli.compress(data, quality=11)),
+             'gzip': ('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))}
+if brotli is None:
+    del ENCODINGS['br']
+
+
+def _fresh(source, compressed):
+    try:
+        return os.path.getmtime(compressed) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def precompress(source, target):
+    # Mirrors every compressible file under `source` into `target` as <name>.br / <name>.gz, at
+    # the highest levels: too slow to do per request, free when done once at startup. Copies
+    # already newer than their file are kept.
+    for root, _, names in os.walk(source):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            compressed = os.path.join(target, os.path.relpath(path, source))
+            data = None
+            for suffix, compress in ENCODINGS.values():
+                if _fresh(path, compressed + suffix):
+                    continue
+                if data is None:
+                    os.makedirs(os.path.dirname(compressed), exist_ok=True)
+                    with open(path, 'rb') as file:
+                        data = file.read()
+                with open(compressed + suffix + '.tmp', 'wb') as file:
+                    file.write(compress(data))
+                os.replace(compressed + suffix + '.tmp', compressed + suffix)
+
+
+def send_precompressed(source, target, filename, **kwargs):
+    # send_from_directory(source, filename), answered from the copy precompress() left in
+    # `target` when the client accepts its encoding and it is not older than the file
+    path = safe_join(source, filename)
+    if path is not None and filename.endswith(COMPRESSIBLE):
+        for encoding, (suffix, _) in ENCODINGS.items():
+            if request.accept_encodings[encoding] and _fresh(path, safe_join(target, filename) + suffix):
+                response = send_from_directory(target, filename + suffix, **kwargs,
+                                               mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(source, filename, **kwargs)
+    else:
+        response = send_from_directory(source, filename, **kwargs)
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,91 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Cost of one upload notification as the number of connected Socket.IO clients grows: the
+# broadcast the wait page used to filter by event name, against notify() to the uploader's
+# room. Every client is a signed in user with their own test connection, so sends are counted
+# and encoded as the server does for real ones, minus the network.
+#   python benchmarks/fanout.py --clients 10 100 1000 --events 200
+# exits with status 1 if a room notification reaches anyone but its user.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import main
+
+
+def connect(users):
+    # (login, socket test client) for `users` new users, each connected as themselves
+    with db.connect() as conn:
+        first = conn.execute('SELECT COALESCE(MAX(id), 1) + 1 FROM users').fetchone()[0]
+        conn.executemany('INSERT INTO users (id, login, email, password) VALUES (?, ?, ?, NULL)',
+                         [(first + i, f'fan{first + i}', f'fan{first + i}@example.com') for i in range(users)])
+    clients = []
+    for user_id in range(first, first + users):
+        http = main.app.test_client()
+        with http.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        clients.append((f'fan{user_id}', main.socketio.test_client(main.app, flask_test_client=http)))
+    return clients
+
+
+def delivered(clients):
+    return sum(len(client.get_received()) for _, client in clients)
+
+
+def measure(clients, events, send):
+    # (median seconds per event, sends per event)
+    delivered(clients)
+    timings = []
+    for i in range(events):
+        login = clients[i % len(clients)][0]
+        started = time.perf_counter()
+        send(login, i)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), delivered(clients) / events
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Measure Socket.IO notification fan-out')
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--events', type=int, default=200)
+    args = parser.parse_args()
+
+    def broadcast(login, job_id):
+        main.socketio.emit(f'job_{login}', {'job': job_id, 'state': 'done', 'result': None})
+
+    def room(login, job_id):
+        main.job_event(job_id, login, 'done')
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('database')
+        db.migrate()
+        clients = []
+        print(f'{"clients":>8} {"broadcast":>12} {"sends":>7} {"room":>12} {"sends":>7}')
+        for target in sorted(args.clients):
+            clients += connect(target - len(clients))
+            broadcast_time, broadcast_sends = measure(clients, args.events, broadcast)
+            room_time, room_sends = measure(clients, args.events, room)
+            print(f'{len(clients):>8} {broadcast_time * 1e6:>10.1f}us {broadcast_sends:>7.0f} '
+                  f'{room_time * 1e6:>10.1f}us {room_sends:>7.0f}')
+            login = clients[-1][0]
+            main.job_event(0, login, 'done')
+            if room_sends != 1 or [name for name, client in clients if client.get_received()] != [login]:
+                print(f'room notification did not reach exactly its user at {len(clients)} clients')
+                failed = True
+        for _, client in clients:
+            client.disconnect()
+        os.chdir(ROOT)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
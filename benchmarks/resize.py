@@ -0,0 +1,116 @@
+import argparse
+import io
+import math
+import os
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import imaging
+
+# Upload conversion, from encoded bytes to the final image, for every target ('ava', 'banner',
+# 'post'): the current imaging.decode + imaging.convert against the full decode + LANCZOS +
+# crop img_conversion it replaced. Outputs must match the old ones in size, and stay close
+# (PSNR, in dB) to a full-resolution LANCZOS resample of exactly the same source box: that
+# isolates what draft decoding, reduce() and the filter choice cost in quality. (The old
+# code's rounded crop can sit half a pixel off the centre, so it is no exact reference.)
+#   python benchmarks/resize.py --runs 5 --min-psnr 30
+# exits with status 1 if any output fails those checks.
+
+FORMATS = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+def legacy_conversion(image, what="ava"):
+    # img_conversion as it was before imaging.py
+    image = Image.open(image)
+    image = image.convert('RGB')
+    width, height = image.size
+    if what=='post':
+        if width==height:
+            new_size=(768,768)
+        else:
+            new_size = (500 if width<height else round((500*width)/height), 500 if width>height else round((500*height)/width))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+        return image
+
+    new_size = (768 if what == "banner" else 500, 500)
+    if what == "banner":
+        if round((768 * height) / width) < 500:
+            new_size = (round((500 * width) / height), 500)
+        elif round((768 * height) / width) > 500:
+            new_size = (768, round((768 * height) / width))
+    else:
+        if width < height:
+            new_size = (500, round((500 * height) / width))
+        elif width > height:
+            new_size = (round((500 * width) / height), 500)
+    image = image.resize(new_size, Image.Resampling.LANCZOS)
+    width, height = image.size
+
+    if what == "banner":
+        left = (width - 768) / 2
+        right = (width + 768) / 2
+    else:
+        left = (width - 500) / 2
+        right = (width + 500) / 2
+    top = (height - 500) / 2
+    bottom = (height + 500) / 2
+    image = image.crop((left, top, right, bottom))
+    return image
+
+
+def sample(size, format):
+    # Photo-like content: smooth gradients, mid-frequency texture and sharp fractal edges
+    width, height = size
+    gradient = Image.linear_gradient('L').resize(size)
+    texture = Image.effect_noise((max(width // 16, 1), max(height // 16, 1)), 64).resize(size, Image.Resampling.BICUBIC)
+    edges = Image.effect_mandelbrot(size, (-2.2, -1.2, 0.8, 1.2), 60)
+    image = Image.merge('RGB', (gradient, texture, edges))
+    data = io.BytesIO()
+    image.save(data, format, **({'quality': 90} if format == 'JPEG' else {}))
+    return data.getvalue()
+
+
+def psnr(a, b):
+    mse = sum(ImageStat.Stat(ImageChops.difference(a, b)).sum2) / (a.width * a.height * 3)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def timed(function, runs):
+    best = math.inf
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare upload conversion against the old img_conversion')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--min-psnr', type=float, default=30.0)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"source":>22} {"target":>7} {"old":>8} {"new":>8} {"speedup":>8} {"psnr":>7}')
+    for size, format in (((6000, 4000), 'JPEG'), ((3024, 4032), 'JPEG'), ((1200, 800), 'PNG'), ((400, 300), 'JPEG')):
+        data = sample(size, format)
+        for what in ('ava', 'banner', 'post'):
+            old_time, old = timed(lambda: legacy_conversion(io.BytesIO(data), what), args.runs)
+            new_time, new = timed(lambda: imaging.convert(imaging.decode(data, what, FORMATS), what), args.runs)
+            full = Image.open(io.BytesIO(data)).convert('RGB')
+            out_size, box = imaging.geometry(full.width, full.height, what)
+            reference = full.resize(out_size, Image.Resampling.LANCZOS, box)
+            quality = psnr(reference, new) if old.size == new.size else -math.inf
+            ok = old.size == new.size and quality >= args.min_psnr
+            failed = failed or not ok
+            print(f'{format + " %dx%d" % size:>22} {what:>7} {old_time * 1000:7.1f}ms {new_time * 1000:7.1f}ms'
+                  f' {old_time / new_time:7.1f}x {quality:6.1f}{"" if ok else "  FAIL " + str((old.size, new.size))}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
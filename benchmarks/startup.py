@@ -0,0 +1,51 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Cold start of the web app: a fresh interpreter importing main.py, then create_app() on an
+# empty database. Each run is a separate process, so nothing is warm from the previous one.
+#   python benchmarks/startup.py --runs 10 --max 2.5
+# exits with status 1 when the median total time is above --max seconds.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = '''import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+print(imported - start, time.perf_counter() - imported)'''
+
+
+def run_once():
+    with tempfile.TemporaryDirectory() as workdir:
+        # create_app() only checks that the model exists, it is not loaded at startup
+        os.makedirs(os.path.join(workdir, 'model'))
+        open(os.path.join(workdir, 'model', 'saved_model.h5'), 'w').close()
+        env = dict(os.environ, PYTHONPATH=ROOT, MODERATION_PRELOAD='0')
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=workdir, env=env,
+                                capture_output=True, text=True, check=True)
+        return [float(value) for value in result.stdout.split()[-2:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure main.py cold start time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max', type=float, default=None, help='fail if the median total exceeds this many seconds')
+    args = parser.parse_args()
+
+    timings = [run_once() for _ in range(args.runs)]
+    totals = [imported + created for imported, created in timings]
+    for name, values in (('import main', [t[0] for t in timings]),
+                         ('create_app()', [t[1] for t in timings]),
+                         ('total', totals)):
+        print(f'{name:>13}: median {statistics.median(values):.3f}s  min {min(values):.3f}s  max {max(values):.3f}s')
+    if args.max is not None and statistics.median(totals) > args.max:
+        print(f'startup regression: median {statistics.median(totals):.3f}s > {args.max:.3f}s')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
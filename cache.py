@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import OrderedDict
+
+from cachetools import TTLCache
+from flask import g, has_request_context
+
+import db
+
+_missing = object()
+
+
+class SharedVersion:
+    # A cache's invalidation count in the cache_versions table, which every process bumps
+    # when it invalidates. changed() tells whether another process invalidated since it was
+    # last called; bump() counts one of our own, which changed() then does not report.
+    def __init__(self, name):
+        self.name = name
+        self.seen = None  # last count seen
+        self.lock = threading.Lock()
+
+    def changed(self):
+        version = db.cache_version(self.name)
+        with self.lock:
+            if version == self.seen:
+                return False
+            self.seen = version
+            return True
+
+    def bump(self):
+        version = db.bump_cache_version(self.name)
+        with self.lock:
+            # Nothing else changed if no other process invalidated in between
+            if self.seen == version - 1:
+                self.seen = version
+
+
+class Cache:
+    # Process-wide TTL cache with a per-request memo in front of it. Writers must invalidate
+    # the keys they change, after their commit. A `shared` cache also counts its invalidations
+    # in the database (cache_versions) and checks the count once per request, dropping
+    # everything it holds when another process invalidated since: worker processes then see a
+    # change from their next request on instead of once the TTL runs out.
+    def __init__(self, name, maxsize, ttl, shared=False):
+        self.name = name
+        self.data = TTLCache(maxsize, ttl)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.shared = SharedVersion(name) if shared else None
+
+    def _memo(self):
+        if not has_request_context():
+            return None
+        if 'cache_memo' not in g:
+            g.cache_memo = {}
+        if self.name not in g.cache_memo:
+            g.cache_memo[self.name] = {}
+            self._sync()
+        return g.cache_memo[self.name]
+
+    def _sync(self):
+        if self.shared is not None and self.shared.changed():
+            with self.lock:
+                self.data.clear()
+                self.generation += 1
+
+    def get(self, key, load):
+        memo = self._memo()
+        if memo is None:
+            self._sync()
+        elif key in memo:
+            return memo[key]
+        with self.lock:
+            value = self.data.get(key, _missing)
+            generation = self.generation
+        if value is _missing:
+            value = load(key)
+            with self.lock:
+                # An invalidation while loading means the value may already be outdated
+                if generation == self.generation:
+                    self.data[key] = value
+        if memo is not None:
+            memo[key] = value
+        return value
+
+    def invalidate(self, *keys):
+        if self.shared is not None:
+            self.shared.bump()
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.data.pop(key, None)
+        memo = self._memo()
+        if memo is not None:
+            for key in keys:
+                memo.pop(key, None)
+
+
+class FragmentCache:
+    # Rendered HTML per item, least recently used dropped first once the cached text exceeds
+    # max_bytes. Each entry is stored with the version it was rendered from, a tuple of
+    # everything that went into it, and is re-rendered when asked for another one, so worker
+    # processes never serve an outdated fragment; invalidate() only frees the memory early.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()  # key -> (version, html), least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version, render):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and entry[0] == version:
+                self.data.move_to_end(key)
+                return entry[1]
+        html = render()
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.data[key] = (version, html)
+            self.size += len(html)
+            while self.size > self.max_bytes and self.data:
+                self.size -= len(self.data.popitem(last=False)[1][1])
+        return html
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                entry = self.data.pop(key, None)
+                if entry is not None:
+                    self.size -= len(entry[1])
+
+
+class PageCache:
+    # Whole rendered pages, shared by every viewer who gets the same output. A page is fresh
+    # for `fresh` seconds, then served stale for up to `stale` more while one refresh renders
+    # it again (stale-while-revalidate); past that it is rendered in the request. expire()
+    # turns every page stale at once, for changes pages may show a little late (ratings).
+    # invalidate() drops them all instead, in every process, for the ones they must not
+    # (deletions, new content): like a shared Cache it counts invalidations in cache_versions,
+    # and sync() checks the count before pages are served. Least recently used pages go first
+    # past maxsize.
+    def __init__(self, name, maxsize, fresh, stale):
+        self.name = name
+        self.maxsize = maxsize
+        self.fresh = fresh
+        self.stale = stale
+        self.data = OrderedDict()  # key -> (page, stored at, generation)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.dropped = 0  # generation of the last time every page was dropped
+        self.shared = SharedVersion(name)
+        self.refreshing = set()
+
+    def get(self, key):
+        # (page, 'fresh' | 'stale'), or (None, None) when it has to be rendered now
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None, None
+            page, stored, generation = entry
+            age = time.monotonic() - stored
+            if age < self.fresh and generation == self.generation:
+                self.data.move_to_end(key)
+                return page, 'fresh'
+            if age < self.fresh + self.stale:
+                self.data.move_to_end(key)
+                return page, 'stale'
+            del self.data[key]
+            return None, None
+
+    def put(self, key, page, generation):
+        # `generation` is the one current when rendering started: a page rendered across an
+        # expire() is stored already stale, and one rendered across a drop is not stored
+        with self.lock:
+            if generation < self.dropped:
+                return
+            self.data[key] = (page, time.monotonic(), generation)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def claim_refresh(self, key):
+        # True for the one caller that should refresh a stale page, until refreshed() is called
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            return True
+
+    def refreshed(self, key):
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def _drop(self):
+        self.data.clear()
+        self.generation += 1
+        self.dropped = self.generation
+
+    def sync(self):
+        # Drops every page if another process invalidated since the last call
+        if self.shared.changed():
+            with self.lock:
+                self._drop()
+
+    def expire(self):
+        with self.lock:
+            self.generation += 1
+
+    def invalidate(self):
+        # Writers call it after their commit
+        self.shared.bump()
+        with self.lock:
+            self._drop()
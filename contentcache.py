@@ -0,0 +1,117 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_file(target, data):
+    # Writes `data` as `target` with one rename, from a temporary file of its own so that
+    # processes writing the same file at once never mix their bytes
+    fd, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(target) + '.', dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp, 0o644)  # mkstemp makes it readable by its owner only
+        os.replace(temp, target)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+class ContentCache:
+    # Content-addressed store for uploads, keyed by the SHA-256 of the uploaded bytes. An entry
+    # is a directory holding the NSFW verdict and, per target ('ava', 'banner', 'post'), the
+    # files published for it (see imaging.encode), so the same file uploaded again needs
+    # neither the model nor a resize.
+    # Entries are evicted least recently used first once they take up more than max_bytes.
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None  # key -> size in bytes, least recently used first
+        self.size = 0
+
+    def _path(self, key, name=''):
+        return os.path.join(self.root, key[:2], key, name)
+
+    def _load(self):
+        # Rebuilds the index from disk on first use; entry mtimes carry the LRU order
+        if self.entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for prefix in os.listdir(self.root):
+                for key in os.listdir(os.path.join(self.root, prefix)):
+                    path = self._path(key)
+                    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                    found.append((os.path.getmtime(path), key, size))
+        found.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.size = sum(self.entries.values())
+
+    def _forget(self, key):
+        self.size -= self.entries.pop(key, 0)
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def get(self, key, what):
+        # (nsfw, whether files for `what` are cached), or None for content never seen before
+        with self.lock:
+            self._load()
+            if key not in self.entries:
+                return None
+            try:
+                with open(self._path(key, 'verdict'), encoding='utf-8') as verdict:
+                    nsfw = verdict.read() == 'nsfw'
+            except OSError:
+                self._forget(key)
+                return None
+            self.entries.move_to_end(key)
+            try:
+                os.utime(self._path(key))
+            except OSError:
+                pass
+            return nsfw, os.path.exists(self._path(key, what + '.jpg'))
+
+    def put(self, key, nsfw, what=None, files=None):
+        with self.lock:
+            self._load()
+            os.makedirs(self._path(key), exist_ok=True)
+            for suffix, data in (files or {}).items():
+                self._write(key, what + suffix, data)
+            self._write(key, 'verdict', b'nsfw' if nsfw else b'ok')
+            self.entries.move_to_end(key)
+            while self.size > self.max_bytes and self.entries:
+                self._forget(next(iter(self.entries)))
+
+    def _write(self, key, name, data):
+        target = self._path(key, name)
+        old_size = os.path.getsize(target) if os.path.exists(target) else 0
+        write_file(target, data)
+        change = len(data) - old_size
+        self.entries[key] = self.entries.get(key, 0) + change
+        self.size += change
+
+    def copy_to(self, key, what, target):
+        # Publishes the cached files for `what` as `target` + suffix, each with one rename and
+        # the JPEG last; returns the published suffixes, or None if the files are gone
+        try:
+            names = [name for name in os.listdir(self._path(key))
+                     if name.startswith((what + '.', what + '-')) and not name.endswith('.tmp')]
+            for name in sorted(names, key=lambda name: name == what + '.jpg'):
+                with open(self._path(key, name), 'rb') as file:
+                    write_file(target + name[len(what):], file.read())
+        except OSError:
+            return None
+        if what + '.jpg' not in names:
+            return None
+        return [name[len(what):] for name in names]
@@ -0,0 +1,367 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = os.path.join('database', 'db.db')
+STATEMENT_CACHE = 256
+# Open connections kept for reuse between requests; any more are closed when released
+POOL_SIZE = 16
+PRAGMAS = ('PRAGMA journal_mode = WAL',
+           'PRAGMA synchronous = NORMAL',
+           'PRAGMA busy_timeout = 30000',
+           'PRAGMA cache_size = -16000',
+           'PRAGMA mmap_size = 268435456',
+           'PRAGMA temp_store = MEMORY')
+
+# Connections are pooled: a thread (or greenlet when eventlet/gevent patch threading) checks
+# one out on its first query and keeps it for every query after, until release() hands it
+# back. Requests release theirs when their app context ends (see main.release_db), so the
+# threaded server's thread-per-request still reuses open connections, PRAGMAs applied and
+# statement cache warm; long-running background threads simply keep theirs.
+_local = threading.local()
+_pool = queue.LifoQueue(POOL_SIZE)
+
+
+def _open():
+    # Used by one thread at a time, though not always the one that opened it
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = _open()
+        _local.conn = conn
+    return conn
+
+
+def release():
+    # Returns this thread's connection to the pool, if it has one
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def close():
+    # Closes this thread's connection and the pooled ones, e.g. before DB_PATH changes
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+@contextmanager
+def transaction():
+    # One IMMEDIATE transaction on this thread's connection, committed when the block ends
+    # and rolled back if it raises. IMMEDIATE takes the write lock up front, so a transaction
+    # that reads before it writes never fails halfway on a busy database. The block may also
+    # commit itself, to do so at a moment of its choosing (see votes.VoteBuffer.flush).
+    conn = connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# Rating decayed by age in days. {rating} is the rating expression to use, so an UPDATE
+# can score the value it is about to write rather than the old column value.
+POPULARITY = "(({rating}) * 1.0) / (julianday('now') - julianday(upload_date, 'unixepoch') + 1)"
+DECAY_BATCH = 5000
+
+# Ordered schema migrations. Each entry runs once, inside its own transaction,
+# and is recorded in schema_version. Append new steps, never edit applied ones.
+MIGRATIONS = (
+    (1, ('''CREATE TABLE IF NOT EXISTS users(
+                id INTEGER PRIMARY KEY,
+                login VARCHAR(30) UNIQUE COLLATE NOCASE NOT NULL,
+                email VARCHAR(89) UNIQUE COLLATE NOCASE NOT NULL,
+                password VARCHAR(36))''',
+         '''CREATE TABLE IF NOT EXISTS groups(
+                id INTEGER PRIMARY KEY,
+                group_name VARCHAR(20) UNIQUE COLLATE NOCASE NOT NULL)''',
+         '''CREATE TABLE IF NOT EXISTS subscriptions(
+                user_id INTEGER,
+                group_id INTEGER,
+                role VARCHAR(5) COLLATE NOCASE NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY(group_id) REFERENCES groups(id),
+                PRIMARY KEY(user_id,group_id))''',
+         '''CREATE TABLE IF NOT EXISTS posts(
+                id INTEGER PRIMARY KEY,
+                uploader_group_id INTEGER NOT NULL,
+                uploader_user_id INTEGER NOT NULL,
+                upload_date VARCHAR(50) NOT NULL,
+                title VARCHAR(100) NOT NULL,
+                desc VARCHAR(4096),
+                attach_img VARCHAR(250),
+                rating INTEGER,
+                FOREIGN KEY(uploader_group_id) REFERENCES groups(id),
+                FOREIGN KEY(uploader_user_id) REFERENCES users(id))''',
+         '''CREATE TABLE IF NOT EXISTS likes_dislikes_posts(
+                user_id INTEGER,
+                post_id INTEGER,
+                likeorno BOOLEAN NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(post_id) REFERENCES posts(id),
+                PRIMARY KEY(user_id,post_id))''',
+         '''CREATE TABLE IF NOT EXISTS comments(
+                id INTEGER PRIMARY KEY,
+                desc VARCHAR(4096),
+                upload_date VARCHAR(50) NOT NULL,
+                user_id INTEGER,
+                post_id INTEGER,
+                rating INTEGER,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(post_id) REFERENCES posts(id))''',
+         '''CREATE TABLE IF NOT EXISTS likes_dislikes_comments(
+                user_id INTEGER,
+                comment_id INTEGER,
+                likeorno BOOLEAN NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(comment_id) REFERENCES comments(id),
+                PRIMARY KEY(user_id,comment_id))''',
+         '''INSERT OR IGNORE INTO users (login, email, password) VALUES ('Anonymous', '', '')''')),
+    # upload_date 'yy.mm.dd' strings -> unix timestamps, so dates sort and compare natively. The
+    # dates were written in local time, so each becomes local midnight ('utc' converts from it),
+    # which main.date_format renders back as the same day.
+    (2, ('''CREATE TABLE posts_new(
+                id INTEGER PRIMARY KEY,
+                uploader_group_id INTEGER NOT NULL,
+                uploader_user_id INTEGER NOT NULL,
+                upload_date INTEGER NOT NULL,
+                title VARCHAR(100) NOT NULL,
+                desc VARCHAR(4096),
+                attach_img VARCHAR(250),
+                rating INTEGER,
+                FOREIGN KEY(uploader_group_id) REFERENCES groups(id),
+                FOREIGN KEY(uploader_user_id) REFERENCES users(id))''',
+         '''INSERT INTO posts_new (id, uploader_group_id, uploader_user_id, upload_date, title, desc, attach_img, rating)
+            SELECT id, uploader_group_id, uploader_user_id,
+                   CAST(strftime('%s', '20' || REPLACE(upload_date, '.', '-'), 'utc') AS INTEGER),
+                   title, desc, attach_img, rating
+            FROM posts''',
+         'DROP TABLE posts',
+         'ALTER TABLE posts_new RENAME TO posts',
+         '''CREATE TABLE comments_new(
+                id INTEGER PRIMARY KEY,
+                desc VARCHAR(4096),
+                upload_date INTEGER NOT NULL,
+                user_id INTEGER,
+                post_id INTEGER,
+                rating INTEGER,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(post_id) REFERENCES posts(id))''',
+         '''INSERT INTO comments_new (id, desc, upload_date, user_id, post_id, rating)
+            SELECT id, desc, CAST(strftime('%s', '20' || REPLACE(upload_date, '.', '-'), 'utc') AS INTEGER),
+                   user_id, post_id, rating
+            FROM comments''',
+         'DROP TABLE comments',
+         'ALTER TABLE comments_new RENAME TO comments')),
+    (3, ('CREATE INDEX IF NOT EXISTS posts_group_idx ON posts(uploader_group_id, upload_date)',
+         'CREATE INDEX IF NOT EXISTS posts_user_idx ON posts(uploader_user_id, upload_date)',
+         'CREATE INDEX IF NOT EXISTS posts_date_idx ON posts(upload_date, rating)',
+         'CREATE INDEX IF NOT EXISTS comments_post_idx ON comments(post_id, user_id)',
+         'CREATE INDEX IF NOT EXISTS likes_dislikes_posts_post_idx ON likes_dislikes_posts(post_id, likeorno, user_id)',
+         'CREATE INDEX IF NOT EXISTS likes_dislikes_comments_comment_idx ON likes_dislikes_comments(comment_id, likeorno, user_id)',
+         'CREATE INDEX IF NOT EXISTS subscriptions_group_idx ON subscriptions(group_id, role)')),
+    # Stored popularity, so "popular" listings are index range scans instead of full sorts
+    (4, ('ALTER TABLE posts ADD COLUMN popularity_score REAL NOT NULL DEFAULT 0',
+         'ALTER TABLE comments ADD COLUMN popularity_score REAL NOT NULL DEFAULT 0',
+         f"UPDATE posts SET popularity_score = {POPULARITY.format(rating='rating')} WHERE rating <> 0",
+         f"UPDATE comments SET popularity_score = {POPULARITY.format(rating='rating')} WHERE rating <> 0",
+         'CREATE INDEX IF NOT EXISTS posts_popularity_idx ON posts(popularity_score, id)',
+         'CREATE INDEX IF NOT EXISTS posts_group_popularity_idx ON posts(uploader_group_id, popularity_score, id)',
+         'CREATE INDEX IF NOT EXISTS posts_user_popularity_idx ON posts(uploader_user_id, popularity_score, id)',
+         'CREATE INDEX IF NOT EXISTS comments_popularity_idx ON comments(post_id, popularity_score, id)')),
+    # Keyset pagination of the latest feed orders by (upload_date, id)
+    (5, ('DROP INDEX IF EXISTS posts_date_idx',
+         'CREATE INDEX IF NOT EXISTS posts_latest_idx ON posts(upload_date, id)')),
+    # Per-row vote counters, so listings no longer aggregate every voter's login
+    (6, ('ALTER TABLE posts ADD COLUMN likes INTEGER NOT NULL DEFAULT 0',
+         'ALTER TABLE posts ADD COLUMN dislikes INTEGER NOT NULL DEFAULT 0',
+         'ALTER TABLE comments ADD COLUMN likes INTEGER NOT NULL DEFAULT 0',
+         'ALTER TABLE comments ADD COLUMN dislikes INTEGER NOT NULL DEFAULT 0',
+         '''UPDATE posts
+            SET likes = (SELECT COUNT(*) FROM likes_dislikes_posts WHERE post_id = posts.id AND likeorno = TRUE),
+                dislikes = (SELECT COUNT(*) FROM likes_dislikes_posts WHERE post_id = posts.id AND likeorno = FALSE)''',
+         '''UPDATE comments
+            SET likes = (SELECT COUNT(*) FROM likes_dislikes_comments WHERE comment_id = comments.id AND likeorno = TRUE),
+                dislikes = (SELECT COUNT(*) FROM likes_dislikes_comments WHERE comment_id = comments.id AND likeorno = FALSE)''')),
+    # Full-text indexes for search (see search.py), kept in step with their tables by triggers.
+    # Post triggers fire only on text changes, not on the vote counter updates.
+    (7, ("""CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                title, desc, attach_img, content='posts', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+         '''CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                INSERT INTO posts_fts (rowid, title, desc, attach_img) VALUES (new.id, new.title, new.desc, new.attach_img);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, title, desc, attach_img) VALUES ('delete', old.id, old.title, old.desc, old.attach_img);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, desc, attach_img ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, title, desc, attach_img) VALUES ('delete', old.id, old.title, old.desc, old.attach_img);
+                INSERT INTO posts_fts (rowid, title, desc, attach_img) VALUES (new.id, new.title, new.desc, new.attach_img);
+            END''',
+         """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                login, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""",
+         '''CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+                INSERT INTO users_fts (rowid, login) VALUES (new.id, new.login);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, login) VALUES ('delete', old.id, old.login);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF login ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, login) VALUES ('delete', old.id, old.login);
+                INSERT INTO users_fts (rowid, login) VALUES (new.id, new.login);
+            END''',
+         """CREATE VIRTUAL TABLE IF NOT EXISTS groups_fts USING fts5(
+                group_name, content='groups', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""",
+         '''CREATE TRIGGER IF NOT EXISTS groups_fts_insert AFTER INSERT ON groups BEGIN
+                INSERT INTO groups_fts (rowid, group_name) VALUES (new.id, new.group_name);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS groups_fts_delete AFTER DELETE ON groups BEGIN
+                INSERT INTO groups_fts (groups_fts, rowid, group_name) VALUES ('delete', old.id, old.group_name);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS groups_fts_update AFTER UPDATE OF group_name ON groups BEGIN
+                INSERT INTO groups_fts (groups_fts, rowid, group_name) VALUES ('delete', old.id, old.group_name);
+                INSERT INTO groups_fts (rowid, group_name) VALUES (new.id, new.group_name);
+            END''',
+         "INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')",
+         "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+         "INSERT INTO groups_fts (groups_fts) VALUES ('rebuild')")),
+    # Materialized subscriptions feeds, filled and kept current by feed.py's triggers
+    (8, ('''CREATE TABLE IF NOT EXISTS feed(
+                user_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                popularity_score REAL NOT NULL,
+                PRIMARY KEY(user_id, post_id)) WITHOUT ROWID''',
+         'CREATE INDEX IF NOT EXISTS feed_user_idx ON feed(user_id, popularity_score, post_id)',
+         'CREATE INDEX IF NOT EXISTS feed_post_idx ON feed(post_id)')),
+    # Upload moderation jobs (see jobs.py)
+    (9, ('''CREATE TABLE IF NOT EXISTS moderation_jobs(
+                id INTEGER PRIMARY KEY,
+                login VARCHAR(30) COLLATE NOCASE NOT NULL,
+                state VARCHAR(8) NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker VARCHAR(100),
+                lease_until REAL,
+                content_key VARCHAR(64),
+                what VARCHAR(6),
+                file_path VARCHAR(300),
+                filename VARCHAR(260),
+                redirect VARCHAR(300),
+                data BLOB,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL)''',
+         'CREATE INDEX IF NOT EXISTS moderation_jobs_state_idx ON moderation_jobs(state, id)',
+         'CREATE INDEX IF NOT EXISTS moderation_jobs_login_idx ON moderation_jobs(login, state)')),
+    # Invalidation counters of the process caches shared through the database (see cache.Cache)
+    (10, ('''CREATE TABLE IF NOT EXISTS cache_versions(
+                 name VARCHAR(20) PRIMARY KEY,
+                 version INTEGER NOT NULL) WITHOUT ROWID''',)),
+    # Version of every published upload, put in its URLs (see main.upload_version)
+    (11, ('''CREATE TABLE IF NOT EXISTS uploads(
+                 path VARCHAR(300) PRIMARY KEY,
+                 version VARCHAR(16) NOT NULL) WITHOUT ROWID''',)),
+    # Renditions published with each upload, space separated (see main.upload_published)
+    (12, ("ALTER TABLE uploads ADD COLUMN widths VARCHAR(30) NOT NULL DEFAULT ''",
+          "ALTER TABLE uploads ADD COLUMN formats VARCHAR(30) NOT NULL DEFAULT ''")),
+    # When a queued job that failed an attempt may be claimed again (see jobs.retry)
+    (13, ('ALTER TABLE moderation_jobs ADD COLUMN retry_at REAL',)),
+    # Chores only one process at a time runs (see hold_lease), and legacy uploads the rendition
+    # backfill could not decode, so it does not try them again (see main.register_uploads)
+    (14, ('''CREATE TABLE IF NOT EXISTS leases(
+                 name VARCHAR(20) PRIMARY KEY,
+                 worker VARCHAR(100) NOT NULL,
+                 lease_until REAL NOT NULL) WITHOUT ROWID''',
+          'ALTER TABLE uploads ADD COLUMN undecodable BOOLEAN NOT NULL DEFAULT FALSE')),
+)
+
+
+def cache_version(name):
+    row = connect().execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_cache_version(name):
+    # The cache's new version, once every process is to drop what it holds
+    with connect() as conn:
+        return conn.execute('''INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                               ON CONFLICT (name) DO UPDATE SET version = version + 1
+                               RETURNING version''', (name,)).fetchall()[0][0]
+
+
+def hold_lease(name, worker, seconds):
+    # Whether `worker` now holds the lease on the chore `name` for `seconds`: taken if nobody
+    # holds it or it ran out, renewed if `worker` already holds it
+    now = time.time()
+    with connect() as conn:
+        return bool(conn.execute('''INSERT INTO leases (name, worker, lease_until) VALUES (?, ?, ?)
+                                    ON CONFLICT (name) DO UPDATE SET worker = excluded.worker, lease_until = excluded.lease_until
+                                    WHERE leases.worker = excluded.worker OR leases.lease_until < ?
+                                    RETURNING worker''', (name, worker, now + seconds, now)).fetchall())
+
+
+def drop_lease(name, worker):
+    with connect() as conn:
+        conn.execute('DELETE FROM leases WHERE name = ? AND worker = ?', (name, worker))
+
+
+def schema_version(conn):
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate():
+    conn = connect()
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, applied_at INTEGER NOT NULL)')
+    for version, steps in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        # IMMEDIATE so that concurrently starting workers apply each step exactly once
+        with transaction():
+            if version > schema_version(conn):
+                for step in steps:
+                    conn.execute(step)
+                conn.execute("INSERT INTO schema_version (version, applied_at) VALUES (?, strftime('%s', 'now'))", (version,))
+
+
+def decay_popularity():
+    # Re-applies the time decay to every rated row, in short batches so that votes
+    # are never blocked behind one long write transaction.
+    conn = connect()
+    for table in ('posts', 'comments'):
+        last_id = 0
+        while True:
+            ids = [row[0] for row in conn.execute(f'SELECT id FROM {table} WHERE id > ? AND rating <> 0 ORDER BY id LIMIT ?',
+                                                  (last_id, DECAY_BATCH))]
+            if not ids:
+                break
+            with conn:
+                conn.execute(f"UPDATE {table} SET popularity_score = {POPULARITY.format(rating='rating')} WHERE id BETWEEN ? AND ? AND rating <> 0",
+                             (ids[0], ids[-1]))
+            last_id = ids[-1]
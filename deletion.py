@@ -0,0 +1,94 @@
+import os
+import queue
+import secrets
+import shutil
+import threading
+
+import db
+
+# Deleting posts, comments and groups with everything that hangs off them. Each deletion is one
+# write transaction, so it either happens completely or not at all, and every statement reaches
+# its rows through an index (the *_idx indexes of migration 3 and the primary keys). Folders
+# are handed to a Janitor instead of being removed inside the request.
+
+# Rows under the posts selected by a `posts` WHERE clause (with the clause's parameters), in
+# the order they are deleted: children first
+POST_CASCADE = ('DELETE FROM likes_dislikes_comments WHERE comment_id IN (SELECT id FROM comments WHERE post_id IN (SELECT id FROM posts WHERE {where}))',
+                'DELETE FROM comments WHERE post_id IN (SELECT id FROM posts WHERE {where})',
+                'DELETE FROM likes_dislikes_posts WHERE post_id IN (SELECT id FROM posts WHERE {where})',
+                'DELETE FROM posts WHERE {where}')
+
+
+def _delete_posts(conn, where, params):
+    ids = [row[0] for row in conn.execute(f'SELECT id FROM posts WHERE {where}', params)]
+    if ids:
+        for sql in POST_CASCADE:
+            conn.execute(sql.format(where=where), params)
+    return ids
+
+
+def delete_post(post_id):
+    # True if the post existed
+    with db.transaction() as conn:
+        return bool(_delete_posts(conn, 'id = ?', (post_id,)))
+
+
+def delete_comment(comment_id):
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM likes_dislikes_comments WHERE comment_id = ?', (comment_id,))
+        conn.execute('DELETE FROM comments WHERE id = ?', (comment_id,))
+
+
+def delete_group(group_id):
+    # The group, its posts and subscriptions; returns (ids of the removed posts, ids of the
+    # users who were subscribed)
+    with db.transaction() as conn:
+        post_ids = _delete_posts(conn, 'uploader_group_id = ?', (group_id,))
+        subscribers = [row[0] for row in conn.execute('SELECT user_id FROM subscriptions WHERE group_id = ?', (group_id,))]
+        conn.execute('DELETE FROM subscriptions WHERE group_id = ?', (group_id,))
+        conn.execute('DELETE FROM groups WHERE id = ?', (group_id,))
+    return post_ids, subscribers
+
+
+class Janitor:
+    # Removes folders on a background thread. discard() only renames the folder to a hidden
+    # sibling ('.deleted-...'), which is immediate whatever its size, so the name is free at
+    # once for a new post (ids are reused) or group; the tree itself is deleted later.
+    # recover() finishes the removals a previous process did not get to.
+    PREFIX = '.deleted-'
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def discard(self, path):
+        if not path or not os.path.isdir(path):
+            return False
+        trash = os.path.join(os.path.dirname(path), self.PREFIX + secrets.token_hex(8))
+        try:
+            os.rename(path, trash)
+        except OSError:
+            trash = path
+        self.start()
+        self.queue.put(trash)
+        return True
+
+    def recover(self, *folders):
+        for folder in folders:
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    if name.startswith(self.PREFIX):
+                        self.start()
+                        self.queue.put(os.path.join(folder, name))
+
+    def run(self):
+        while True:
+            path = self.queue.get()
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,61 @@
+import db
+
+# Materialized home feeds (fan-out on write). Every subscription holds one feed row per post of
+# its group, copying the post's popularity_score, so a user's subscriptions feed is one range
+# read of feed_user_idx instead of a sort over every subscribed group's posts. The triggers
+# below keep the rows current as posts are created, deleted and re-scored (votes and the decay
+# pass) and as subscriptions come and go; each write costs one row per subscriber.
+# The table always exists (migration 8); the triggers only while the feature is enabled.
+
+TRIGGERS = {
+    'feed_post_insert': '''CREATE TRIGGER feed_post_insert AFTER INSERT ON posts BEGIN
+                               INSERT OR IGNORE INTO feed (user_id, post_id, popularity_score)
+                               SELECT user_id, new.id, new.popularity_score FROM subscriptions WHERE group_id = new.uploader_group_id;
+                           END''',
+    'feed_post_delete': '''CREATE TRIGGER feed_post_delete AFTER DELETE ON posts BEGIN
+                               DELETE FROM feed WHERE post_id = old.id;
+                           END''',
+    'feed_post_score': '''CREATE TRIGGER feed_post_score AFTER UPDATE OF popularity_score ON posts
+                          WHEN new.popularity_score IS NOT old.popularity_score BEGIN
+                              UPDATE feed SET popularity_score = new.popularity_score WHERE post_id = new.id;
+                          END''',
+    'feed_subscribe': '''CREATE TRIGGER feed_subscribe AFTER INSERT ON subscriptions BEGIN
+                             INSERT OR IGNORE INTO feed (user_id, post_id, popularity_score)
+                             SELECT new.user_id, id, popularity_score FROM posts WHERE uploader_group_id = new.group_id;
+                         END''',
+    'feed_unsubscribe': '''CREATE TRIGGER feed_unsubscribe AFTER DELETE ON subscriptions BEGIN
+                               DELETE FROM feed WHERE user_id = old.user_id
+                                                  AND post_id IN (SELECT id FROM posts WHERE uploader_group_id = old.group_id);
+                           END''',
+}
+
+
+def _installed(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'feed_%'")}
+
+
+def enable():
+    # Installs the triggers and refills the table if they were missing, as writes made
+    # without them were never fanned out
+    conn = db.connect()
+    if _installed(conn) == set(TRIGGERS):
+        return
+    with db.transaction():
+        for name, sql in TRIGGERS.items():
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute(sql)
+        conn.execute('DELETE FROM feed')
+        conn.execute('''INSERT INTO feed (user_id, post_id, popularity_score)
+                        SELECT subscriptions.user_id, posts.id, posts.popularity_score
+                        FROM subscriptions INNER JOIN posts ON posts.uploader_group_id = subscriptions.group_id''')
+
+
+def disable():
+    # Stops the fan-out and drops the rows, which would go stale from here on
+    conn = db.connect()
+    if not _installed(conn):
+        return
+    with conn:
+        for name in TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute('DELETE FROM feed')
@@ -0,0 +1,112 @@
+import io
+import math
+import re
+
+from PIL import Image, features
+
+# Downscale ratios (source pixels per output pixel) up to which LANCZOS is used. Past it the
+# image is first shrunk by an integer factor with Image.reduce (a cheap box average) and
+# finished with BICUBIC: at that scale LANCZOS costs more without visibly sharper output.
+LANCZOS_MAX_RATIO = 3
+REDUCING_GAP = 2.0
+
+# Widths of the renditions made for every converted upload, the largest being the full size
+# for avatars and banners. Nothing is upscaled: widths past the image's own make one
+# rendition at its width, named after the width it really has.
+RENDITIONS = {'ava': (96, 240, 500), 'banner': (384, 768), 'post': (320, 640, 896)}
+# Modern formats served through <picture>, best first; the JPEG stays as the fallback
+FORMATS = tuple(format for format in ('avif', 'webp') if features.check(format))
+RENDITION_SUFFIX = re.compile(r'-(\d+)\.(avif|webp)')
+ENCODING = {'jpeg': {'quality': 75}, 'webp': {'quality': 80, 'method': 4}, 'avif': {'quality': 55, 'speed': 8}}
+
+
+def geometry(width, height, what):
+    # Output size and the source box it is resampled from, for a 'post', 'ava' (500x500) or
+    # 'banner' (768x500). Posts keep their aspect ratio with the shorter side at 500 (square
+    # ones become 768x768); avatars and banners take the largest centred box of their aspect
+    # ratio, so the crop happens before resampling instead of after it.
+    if what == 'post':
+        if width == height:
+            size = (768, 768)
+        elif width < height:
+            size = (500, round((500 * height) / width))
+        else:
+            size = (round((500 * width) / height), 500)
+        return size, (0, 0, width, height)
+    size = (768, 500) if what == 'banner' else (500, 500)
+    if width * size[1] > height * size[0]:
+        crop = (height * size[0] / size[1], height)
+    else:
+        crop = (width, width * size[1] / size[0])
+    left, top = (width - crop[0]) / 2, (height - crop[1]) / 2
+    return size, (left, top, left + crop[0], top + crop[1])
+
+
+def decode(data, what, formats):
+    # The one full decode an upload gets: an RGB image, or None if it is not an intact image in
+    # one of `formats`. JPEGs are decoded in draft mode at the smallest 1/2, 1/4 or 1/8 scale
+    # that still covers the output, so a phone photo never gets decoded at full resolution.
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format is None or image.format.lower() not in formats:
+            return None
+        size, box = geometry(image.width, image.height, what)
+        scale = size[0] / (box[2] - box[0])
+        if scale < 1:
+            image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        image.load()  # reads every pixel, so truncated files fail here
+        return image.convert('RGB')
+    except Exception:
+        return None
+
+
+def convert(image, what):
+    size, box = geometry(image.width, image.height, what)
+    ratio = (box[2] - box[0]) / size[0]
+    if ratio <= 1:
+        return image.resize(size, Image.Resampling.BICUBIC, box)
+    if ratio <= LANCZOS_MAX_RATIO:
+        return image.resize(size, Image.Resampling.LANCZOS, box)
+    return image.resize(size, Image.Resampling.BICUBIC, box, reducing_gap=REDUCING_GAP)
+
+
+def _encode(image, format):
+    data = io.BytesIO()
+    image.save(data, format.upper(), **ENCODING[format])
+    return data.getvalue()
+
+
+def renditions(image, what):
+    # The renditions of a converted upload, as name suffix -> bytes: '-<width>.<format>'
+    files = {}
+    for width in sorted({min(width, image.width) for width in RENDITIONS[what]}):
+        rendition = image
+        if width < image.width:
+            rendition = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+        for format in FORMATS:
+            files[f'-{width}.{format}'] = _encode(rendition, format)
+    return files
+
+
+def encode(image, what):
+    # Every file published for a converted upload, as name suffix -> bytes: '.jpg' for the
+    # image itself, and its renditions
+    files = renditions(image, what)
+    files['.jpg'] = _encode(image, 'jpeg')
+    return files
+
+
+def published(suffixes):
+    # (widths, formats) of the renditions among the published name suffixes, smallest and best first
+    found = [RENDITION_SUFFIX.fullmatch(suffix) for suffix in suffixes]
+    formats = {match[2] for match in found if match}
+    return (tuple(sorted({int(match[1]) for match in found if match})),
+            tuple(format for format in ('avif', 'webp') if format in formats))
+
+
+def srcset(src, format, widths, version=''):
+    # srcset of the `format` renditions of the upload published at `src` ('.../name.jpg'),
+    # one per width in `widths`, with the upload's `version` in their URLs
+    base = src[:-len('.jpg')]
+    query = f'?v={version}' if version else ''
+    return ', '.join(f'{base}-{width}.{format}{query} {width}w' for width in widths)
@@ -0,0 +1,108 @@
+import json
+import time
+
+import db
+
+# Upload moderation jobs, kept in the moderation_jobs table (migration 9) so that they survive
+# restarts and any worker process can pick them up. A job is 'queued', then 'running' under a
+# lease held by the worker that claimed it, then 'done' or 'failed' with the status shown to
+# the uploader. A worker that dies leaves its lease to expire and the job is claimed again,
+# up to a number of attempts; an attempt that fails outright puts the job back in the queue
+# after a delay doubling with every attempt. The uploaded bytes stay in the row until the job
+# is finished.
+
+COLUMNS = 'id, login, attempts, content_key, what, file_path, filename, redirect, data'
+
+
+def create(login, content_key, what, file_path, filename, redirect, data, limit):
+    # Queues an upload; None if `login` already has `limit` jobs queued or running
+    with db.transaction() as conn:
+        active = conn.execute("SELECT COUNT(*) FROM moderation_jobs WHERE login = ? AND state IN ('queued', 'running')",
+                              (login,)).fetchone()[0]
+        if active >= limit:
+            return None
+        now = time.time()
+        return conn.execute('''INSERT INTO moderation_jobs (login, state, content_key, what, file_path, filename, redirect, data, created_at, updated_at)
+                               VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)''',
+                            (login, content_key, what, file_path, filename, redirect, data, now, now)).lastrowid
+
+
+def record(login, redirect, status):
+    # A job answered without moderation (known content, unreadable file, over the limit), so
+    # the wait page finds its status like any other
+    now = time.time()
+    with db.connect() as conn:
+        return conn.execute('''INSERT INTO moderation_jobs (login, state, redirect, result, created_at, updated_at)
+                               VALUES (?, ?, ?, ?, ?, ?)''',
+                            (login, 'failed' if status['error'] else 'done', redirect, json.dumps(status), now, now)).lastrowid
+
+
+def claim(worker, lease, max_attempts):
+    # The oldest queued job, or one whose lease ran out, now running under `worker` for `lease`
+    # seconds; None if there is nothing to do. Jobs out of attempts are failed on the way.
+    with db.transaction() as conn:
+        now = time.time()
+        conn.execute('''UPDATE moderation_jobs
+                        SET state = 'failed', data = NULL, updated_at = ?,
+                            result = json_object('error', json('true'), 'reason', 'BADFILE', 'redirect', redirect)
+                        WHERE state = 'running' AND lease_until < ? AND attempts >= ?''', (now, now, max_attempts))
+        return conn.execute(f'''UPDATE moderation_jobs
+                                SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                                WHERE id = (SELECT MIN(id) FROM (
+                                                SELECT MIN(id) AS id FROM moderation_jobs
+                                                WHERE state = 'queued' AND (retry_at IS NULL OR retry_at <= ?)
+                                                UNION ALL
+                                                SELECT MIN(id) FROM moderation_jobs WHERE state = 'running' AND lease_until < ?))
+                                RETURNING {COLUMNS}''', (worker, now + lease, now, now, now)).fetchone()
+
+
+def release(job_id, worker):
+    # Hands a claimed job back untouched, without using up an attempt
+    with db.connect() as conn:
+        conn.execute('''UPDATE moderation_jobs SET state = 'queued', worker = NULL, lease_until = NULL,
+                                                   attempts = attempts - 1, updated_at = ?
+                        WHERE id = ? AND state = 'running' AND worker = ?''', (time.time(), job_id, worker))
+
+
+def retry(job_id, worker, max_attempts, status, delay=0):
+    # Puts a job whose attempt failed back in the queue, to be claimed again no sooner than
+    # `delay` seconds doubled for every earlier attempt, or fails it with `status` once it is
+    # out of attempts; returns the new state, None if `worker` no longer holds the job
+    now = time.time()
+    with db.connect() as conn:
+        row = conn.execute('''UPDATE moderation_jobs
+                              SET state = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                                  result = CASE WHEN attempts < ? THEN NULL ELSE ? END,
+                                  data = CASE WHEN attempts < ? THEN data END,
+                                  retry_at = ? + ? * (1 << (attempts - 1)),
+                                  worker = NULL, lease_until = NULL, updated_at = ?
+                              WHERE id = ? AND state = 'running' AND worker = ?
+                              RETURNING state''',
+                           (max_attempts, max_attempts, json.dumps(status), max_attempts, now, delay, now,
+                            job_id, worker)).fetchone()
+    return row[0] if row else None
+
+
+def finish(job_id, worker, status):
+    # Stores the job's final status; False if `worker` lost the job (its lease ran out and
+    # another worker claimed it)
+    with db.connect() as conn:
+        return conn.execute('''UPDATE moderation_jobs
+                               SET state = ?, result = ?, data = NULL, worker = NULL, lease_until = NULL, updated_at = ?
+                               WHERE id = ? AND state = 'running' AND worker = ?''',
+                            ('failed' if status['error'] else 'done', json.dumps(status), time.time(), job_id, worker)).rowcount == 1
+
+
+def status(job_id):
+    # {'job', 'login', 'state', 'result'} of a job, or None if there is no such job
+    row = db.connect().execute('SELECT id, login, state, result FROM moderation_jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    return {'job': row[0], 'login': row[1], 'state': row[2], 'result': json.loads(row[3]) if row[3] else None}
+
+
+def purge(older_than):
+    # Forgets finished jobs last updated more than `older_than` seconds ago
+    with db.connect() as conn:
+        conn.execute("DELETE FROM moderation_jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+                     (time.time() - older_than,))
@@ -1,1617 +1,1619 @@
-import logging
-import os
-import re
-import secrets
-import shutil
-import sqlite3
-import time
-import warnings
-from datetime import datetime
-from threading import Thread
-
-from PIL import Image
-from argon2 import PasswordHasher
-from argon2.exceptions import *
-from flask import Flask, render_template, request, redirect, send_from_directory, url_for, session
-from flask_login import LoginManager, UserMixin, login_user, current_user, logout_user
-from flask_socketio import SocketIO
-from werkzeug.exceptions import HTTPException
-from werkzeug.utils import secure_filename
-
-warnings.filterwarnings('ignore', category=UserWarning)
-logging.getLogger('tensorflow').disabled = True
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from nsfw_detector import predict
-
-os.makedirs('model',exist_ok=True)
-
-if not os.path.exists('model/saved_model.h5'):
-    print("The model is missing! Please download the model first.")
-    print("https://github.com/GantMan/nsfw_model/releases/tag/1.2.0")
-    print("The folder /model should contain the file saved_model.h5, which is the model itself.")
-    exit(-1)
-
-model = predict.load_model('model/saved_model.h5')
-
-app = Flask(__name__)
-# app.config['REMEMBER_COOKIE_DURATION']=timedelta(days=10)
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
-app.secret_key = secrets.token_hex(32)
-UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-socketio = SocketIO(app)
-
-login_manager = LoginManager()
-login_manager.init_app(app)
-ph = PasswordHasher()
-
-active_threads = {}
-
-necessary_folders=['uploads','uploads/g','uploads/p','uploads/u','database']
-for nfolder in necessary_folders:
-    os.makedirs(nfolder, exist_ok=True)
-
-with sqlite3.connect('database/db.db') as conn:
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users(
-                       id INTEGER PRIMARY KEY,
-                       login VARCHAR(30) UNIQUE COLLATE NOCASE NOT NULL,
-                       email VARCHAR(89) UNIQUE COLLATE NOCASE NOT NULL,
-                       password VARCHAR(36))
-                   ''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS groups(
-                       id INTEGER PRIMARY KEY,
-                       group_name VARCHAR(20) UNIQUE COLLATE NOCASE NOT NULL)
-                    ''')
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS subscriptions(
-                       user_id INTEGER,
-                       group_id INTEGER,
-                       role VARCHAR(5) COLLATE NOCASE NOT NULL,
-                       FOREIGN KEY (user_id) REFERENCES users(id),
-                       FOREIGN KEY(group_id) REFERENCES groups(id),
-                       PRIMARY KEY(user_id,group_id))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS posts(
-                       id INTEGER PRIMARY KEY,
-                       uploader_group_id INTEGER NOT NULL,
-                       uploader_user_id INTEGER NOT NULL,
-                       upload_date VARCHAR(50) NOT NULL,
-                       title VARCHAR(100) NOT NULL,
-                       desc VARCHAR(4096),
-                       attach_img VARCHAR(250),
-                       rating INTEGER,
-                       FOREIGN KEY(uploader_group_id) REFERENCES groups(id),
-                       FOREIGN KEY(uploader_user_id) REFERENCES users(id))''')
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS likes_dislikes_posts(
-                       user_id INTEGER,
-                       post_id INTEGER,
-                       likeorno BOOLEAN NOT NULL,
-                       FOREIGN KEY(user_id) REFERENCES users(id),
-                       FOREIGN KEY(post_id) REFERENCES posts(id),
-                       PRIMARY KEY(user_id,post_id))''')
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS comments(
-                       id INTEGER PRIMARY KEY,
-                       desc VARCHAR(4096),
-                       upload_date VARCHAR(50) NOT NULL,
-                       user_id INTEGER,
-                       post_id INTEGER,
-                       rating INTEGER,
-                       FOREIGN KEY(user_id) REFERENCES users(id),
-                       FOREIGN KEY(post_id) REFERENCES posts(id))''')
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS likes_dislikes_comments(
-                       user_id INTEGER,
-                       comment_id INTEGER,
-                       likeorno BOOLEAN NOT NULL,
-                       FOREIGN KEY(user_id) REFERENCES users(id),
-                       FOREIGN KEY(comment_id) REFERENCES comments(id),
-                       PRIMARY KEY(user_id,comment_id))''')
-    cursor.execute('''INSERT OR IGNORE INTO users (login, email, password) VALUES (?, ?, ?)''', ('Anonymous','',''))
-
-
-def is_safe_folder(folder_name, base_dir, whatdo="exist"):
-    folder_name = folder_name.lower()
-    if re.match(r'^[a-zA-Z0-9_-]+$', folder_name) is None:
-        return False
-    base_dir = 'uploads/' + base_dir
-    if os.path.sep in folder_name or (os.path.altsep and os.path.altsep in folder_name):
-        return False
-    full_path = os.path.abspath(os.path.join(base_dir, folder_name))
-    base_dir = os.path.abspath(base_dir)
-    if not full_path.startswith(base_dir + os.path.sep):
-        return False
-    if whatdo == "exist":
-        return os.path.isdir(full_path)
-    elif whatdo == "create":
-        if os.path.isdir(full_path):
-            return False
-        os.makedirs(full_path, exist_ok=True)
-        return full_path
-    elif whatdo == "delete":
-        if not os.path.isdir(full_path):
-            return False
-        shutil.rmtree(full_path)
-        return full_path
-    elif whatdo == "safe":
-        return True
-    return None
-
-def img_conversion(image, what="ava"):
-    image = Image.open(image)
-    image = image.convert('RGB')
-    width, height = image.size
-    if what=='post':
-        if width==height:
-            new_size=(768,768)
-        else:
-            new_size = (500 if width<height else round((500*width)/height), 500 if width>height else round((500*height)/width))
-        image = image.resize(new_size, Image.Resampling.LANCZOS)
-        return image
-
-    new_size = (768 if what == "banner" else 500, 500)
-    if what == "banner":
-        if round((768 * height) / width) < 500:
-            new_size = (round((500 * width) / height), 500)
-        elif round((768 * height) / width) > 500:
-            new_size = (768, round((768 * height) / width))
-    else:
-        if width < height:
-            new_size = (500, round((500 * height) / width))
-        elif width > height:
-            new_size = (round((500 * width) / height), 500)
-    image = image.resize(new_size, Image.Resampling.LANCZOS)
-    width, height = image.size
-
-    if what == "banner":
-        left = (width - 768) / 2
-        right = (width + 768) / 2
-    else:
-        left = (width - 500) / 2
-        right = (width + 500) / 2
-    top = (height - 500) / 2
-    bottom = (height + 500) / 2
-    image = image.crop((left, top, right, bottom))
-    return image
-
-def verify_image(file):
-    try:
-        with Image.open(file) as image:
-            image.verify()
-            return image.format.lower() in ALLOWED_EXTENSIONS
-    except:
-        return False
-
-def img_THREAD(id,passedfirst,file_path,filename,redirect):
-    time.sleep(1) #Wait for loading page to load (ironic)
-    if not passedfirst:
-        #status = {"error": True,"reason":"BADFILE","redirect": redirect}
-        socketio.emit(f'done_{id}', {"error": True,"reason":"BADFILE","redirect": redirect})
-    else:
-        temp_filename=os.path.join('temp_uploads',file_path,filename)
-        what = 'ava' if filename == 'ava.jpg' else 'banner' if filename == 'banner.jpg' else 'post'
-        prediction=predict.classify(model, temp_filename)
-        print(prediction)
-        if round(prediction[temp_filename]['hentai']+prediction[temp_filename]['porn']+prediction[temp_filename]['sexy'],2) < 0.5:
-            image = img_conversion(temp_filename, what)
-            image.save(os.path.join('uploads',file_path,filename))
-            #status = {"error": False,"reason":None,"redirect":redirect}
-            socketio.emit(f'done_{id}',{"error":False,"redirect":redirect})
-        else:
-            #status = {"error": True,"reason":"NSFW","redirect":redirect}
-            socketio.emit(f'done_{id}', {"error": True,"reason":"NSFW","redirect":redirect})
-        shutil.rmtree(os.path.join('temp_uploads', file_path))
-    #active_threads[id]=status
-    active_threads.pop(id, None)
-
-def img_PROCESS(id,file,file_path,filename,redirect):
-    if id not in active_threads:
-        if file and '.' in secure_filename(file.filename) and secure_filename(file.filename).rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS and verify_image(file.stream):
-            os.makedirs(os.path.join('temp_uploads',file_path), exist_ok=True)
-            image = Image.open(file.stream)
-            image = image.convert('RGB')
-            filename='.'.join(filename.split('.')[:-1])+'.jpg'
-            image.save(os.path.join('temp_uploads',file_path,filename),"JPEG")
-            active_threads[current_user.login.lower()] = Thread(target=img_THREAD, args=(id,True,file_path,filename,redirect))
-            active_threads[current_user.login.lower()].start()
-        else:
-            active_threads[current_user.login.lower()] = Thread(target=img_THREAD,args=(id,False,file_path,filename,redirect))
-            active_threads[current_user.login.lower()].start()
-        return True
-    else:
-        return False
-
-def rating_count(post):
-    rating_post = post['rating'] if type(post) == dict else post
-    new_format = rating_post
-    if 1_000 <= abs(rating_post) < 1_000_000:
-        new_format = str(round(rating_post / 1_000, 1)) + 'k'
-    elif 1_000_000 <= abs(rating_post) < 1_000_000_000:
-        new_format = str(round(rating_post / 1_000_000, 1)) + 'm'
-    elif 1_000_000_000 <= abs(rating_post):
-        new_format = str(round(rating_post / 1_000_000_000, 1)) + 'b'
-    if type(post) == dict:
-        post['rating'] = new_format
-        return post
-    else:
-        return new_format
-
-class User(UserMixin):
-    def __init__(self, id_, login, email, password_hash):
-        self.id = id_
-        self.login = login
-        self.email = email
-        self.password_hash = password_hash
-
-    @staticmethod
-    def get(user_id):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                return User(*row)
-            return None
-
-    @staticmethod
-    def find_by_login(login):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE login = ?", (login,))
-            row = cursor.fetchone()
-            if row:
-                return User(*row)
-            return None
-
-    @staticmethod
-    def find_by_email(email):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-            row = cursor.fetchone()
-            if row:
-                return User(*row)
-            return None
-
-    def check_password(self, password):
-        try:
-            ph.verify(self.password_hash, password)
-            return True
-        except (InvalidHashError, VerifyMismatchError, VerificationError) as _:
-            return False
-
-    @classmethod
-    def create(cls, login, email, password_hash):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("INSERT INTO users (login, email, password) VALUES (?, ?, ?)",
-                               (login, email, password_hash))
-            except sqlite3.IntegrityError:
-                return None
-            conn.commit()
-        return cls.find_by_login(login)
-
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.get(user_id)
-
-@socketio.on('change_rating_com')
-def change_rating(data):
-    sid = request.sid
-    if current_user.is_authenticated and current_user.id!=1:
-        commentId = data.get('commentId', 0)
-        if commentId and commentId.isnumeric():
-            commentId = int(commentId)
-        else:
-            commentId = 0
-        what = data.get('what', 0)
-        clickedElementId = data.get('clickedElementId', None)
-        commentrating = None
-        if commentId and what and clickedElementId:
-            with sqlite3.connect('database/db.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute('''SELECT comments.id, desc, upload_date, u.login, post_id, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes
-                          FROM comments INNER JOIN users u
-                          ON comments.user_id = u.id
-                          WHERE comments.id = ?''', (commentId,))
-                row = cursor.fetchone()
-                if row:
-                    should_we_continue=True #To prevent exploit
-                    with sqlite3.connect('database/db.db') as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            '''SELECT likeorno FROM likes_dislikes_comments WHERE user_id = ? AND comment_id = ?''',
-                            (current_user.id, commentId))
-                        row1 = cursor.fetchone()
-                        if row1:
-                            likeorno = row1[0]
-                            if likeorno:
-                                if clickedElementId == "like-button" and what!=-1:
-                                    should_we_continue=False
-                                elif clickedElementId == "dislike-button" and what!=-2:
-                                    should_we_continue=False
-                            else:
-                                if clickedElementId == "like-button" and what!=2:
-                                    should_we_continue=False
-                                elif clickedElementId == "dislike-button" and what!=1:
-                                    should_we_continue=False
-                        else:
-                            if what<=-2 or what>=2:
-                                should_we_continue=False
-                            elif clickedElementId == "like-button" and what==-1:
-                                should_we_continue=False
-                            elif clickedElementId == "dislike-button" and what==1:
-                                should_we_continue=False
-                    if should_we_continue:
-                        temp_comment_rating = row[5]
-                        temp_comment_rating += what
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''UPDATE comments
-                                              SET rating = ?
-                                              WHERE id = ?;''', (temp_comment_rating, commentId))
-                            conn.commit()
-                        if clickedElementId == "like-button":
-                            if what >= 1:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        '''INSERT OR REPLACE into likes_dislikes_comments(user_id, comment_id, likeorno) VALUES (?, ?, ?)''',
-                                        (current_user.id, commentId, True))
-                                    conn.commit()
-                            else:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute('''DELETE
-                                                      FROM likes_dislikes_comments
-                                                      WHERE comment_id = ?
-                                                        and user_id = ?;''', (commentId, current_user.id))
-                                    conn.commit()
-                        elif clickedElementId == "dislike-button":
-                            if what <= -1:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        '''INSERT OR REPLACE into likes_dislikes_comments(user_id, comment_id, likeorno) VALUES (?, ?, ?)''',
-                                        (current_user.id, commentId, False))
-                                    conn.commit()
-                            else:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute('''DELETE
-                                                      FROM likes_dislikes_comments
-                                                      WHERE comment_id = ?
-                                                        and user_id = ?;''', (commentId, current_user.id))
-                                    conn.commit()
-                        commentrating = rating_count(temp_comment_rating)
-        if commentrating is not None:
-            socketio.emit(f'scs_change_rating_com',
-                          {"commentId": commentId, "new_rating": commentrating, "what": what, "clickedElementId": clickedElementId}, to=sid)
-    else:
-        None
-
-@socketio.on('change_rating')
-def change_rating(data):
-    sid=request.sid
-    if current_user.is_authenticated and current_user.id!=1:
-        postId = data.get('postId', 0)
-        if postId and postId.isnumeric():
-            postId = int(postId)
-        else:
-            postId = 0
-        what = data.get('what', 0)
-        clickedElementId = data.get('clickedElementId', None)
-        postrating = None
-        if postId and what and clickedElementId:
-            with sqlite3.connect('database/db.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute('''SELECT posts.id,
-                                         group_name,
-                                         u.login,
-                                         upload_date,
-                                         title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                      FROM (SELECT u2.login
-                                      FROM likes_dislikes_posts
-                                      INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                      WHERE post_id = posts.id AND likeorno = TRUE
-                                      ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                      FROM (SELECT u2.login
-                                      FROM likes_dislikes_posts
-                                      INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                      WHERE post_id = posts.id AND likeorno = FALSE
-                                      ORDER BY user_id)) AS dislikes
-                                  FROM posts INNER JOIN main.groups g
-                                  on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                                  WHERE posts.id = ?''', (postId,))
-                row = cursor.fetchone()
-                if row:
-                    should_we_continue=True #To prevent exploit
-                    with sqlite3.connect('database/db.db') as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            '''SELECT likeorno FROM likes_dislikes_posts WHERE user_id = ? AND post_id = ?''',
-                            (current_user.id, postId))
-                        row1 = cursor.fetchone()
-                        if row1:
-                            likeorno = row1[0]
-                            if likeorno:
-                                if clickedElementId == "like-button" and what!=-1:
-                                    should_we_continue=False
-                                elif clickedElementId == "dislike-button" and what!=-2:
-                                    should_we_continue=False
-                            else:
-                                if clickedElementId == "like-button" and what!=2:
-                                    should_we_continue=False
-                                elif clickedElementId == "dislike-button" and what!=1:
-                                    should_we_continue=False
-                        else:
-                            if what<=-2 or what>=2:
-                                should_we_continue=False
-                            elif clickedElementId == "like-button" and what==-1:
-                                should_we_continue=False
-                            elif clickedElementId == "dislike-button" and what==1:
-                                should_we_continue=False
-                    if should_we_continue:
-                        temp_post_rating = row[7]
-                        temp_post_rating += what
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''UPDATE posts
-                                              SET rating = ?
-                                              WHERE id = ?;''', (temp_post_rating, postId))
-                            conn.commit()
-                        if clickedElementId == "like-button":
-                            if what >= 1:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        '''INSERT OR REPLACE into likes_dislikes_posts(user_id, post_id, likeorno) VALUES (?, ?, ?)''',
-                                        (current_user.id, postId, True))
-                                    conn.commit()
-                            else:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute('''DELETE
-                                                      FROM likes_dislikes_posts
-                                                      WHERE post_id = ?
-                                                        and user_id = ?;''', (postId, current_user.id))
-                                    conn.commit()
-                        elif clickedElementId == "dislike-button":
-                            if what <= -1:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        '''INSERT OR REPLACE into likes_dislikes_posts(user_id, post_id, likeorno) VALUES (?, ?, ?)''',
-                                        (current_user.id, postId, False))
-                                    conn.commit()
-                            else:
-                                with sqlite3.connect('database/db.db') as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute('''DELETE
-                                                      FROM likes_dislikes_posts
-                                                      WHERE post_id = ?
-                                                        and user_id = ?;''', (postId, current_user.id))
-                                    conn.commit()
-                        postrating = rating_count(temp_post_rating)
-        if postrating is not None:
-            socketio.emit(f'scs_change_rating',
-                          {"postId": postId, "new_rating": postrating, "what": what, "clickedElementId": clickedElementId}, to=sid)
-    else:
-        None
-
-@app.route('/p/',methods=['GET'])
-def empty_post():
-    return redirect('/?filter=popular')
-
-@app.route('/u/',methods=['GET','POST'])
-def auth():
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-    what = request.args.get('w', 'signin').lower()
-    what = 'signin' if what not in ['signin','signup'] else what
-    if request.method == 'GET':
-        subs = {}
-        try:
-            with sqlite3.connect('database/db.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                                  FROM (SELECT group_name
-                                        FROM subscriptions
-                                                 INNER JOIN groups ON subscriptions.group_id = groups.id
-                                        WHERE user_id = ?
-                                        ORDER BY group_id)''', (current_user.id,))
-                row = cursor.fetchone()
-                if row[0]:
-                    subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-        except:
-            None
-        error_msg = session.pop('error_msg', '')
-        return render_template('auth.html', what=what, error=error_msg, login=current_user.login, subs=subs)
-    elif request.method == 'POST':
-        login = re.sub(r"\s+", '_', request.form.get('login', ''))
-        email = request.form.get('email', '')
-        password = request.form.get('password', '')
-        if 0<len(login)<=30 and len(password)>0 and login.lower()!='anonymous' and (len(password)>=8 and re.match(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&_-])(?=\S+$).{8,}$",password) is not None):
-            if what=='signup' and 0<len(email)<=89 and re.match(r'^[a-zA-Z0-9_-]+$',login) is not None and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None:
-                if 'avatar' in request.files:
-                    ava = request.files['avatar']
-                if is_safe_folder(login, 'u', 'create'):
-                    user = User.create(login, email, ph.hash(password))
-                    if user:
-                        login_user(user)
-                        if 'avatar' in request.files and ava.filename != '':
-                            if img_PROCESS(user.login.lower(), ava, os.path.join('u', user.login.lower()),'ava.jpg', f'/u/{user.login}'):
-                                session['wait'] = True
-                                return redirect('/loading')
-                        return redirect(f'/u/{user.login}')
-                    else:
-                        session['error_msg']='already'
-                        return redirect(url_for('auth',w=what))
-                session['error_msg'] = 'login'
-                return redirect(url_for('auth',w=what))
-            elif what=='signin':
-                if re.match(r'^[a-zA-Z0-9_-]+$', login) is not None:
-                    user = User.find_by_login(login)
-                elif re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', login) is not None:
-                    user = User.find_by_email(login)
-                else:
-                    session['error_msg']='login'
-                    return redirect(url_for('auth',w=what))
-                if user:
-                    if user.check_password(password):
-                        login_user(user)
-                        return redirect(f'/u/{user.login}')
-                    else:
-                        session['error_msg']='pass'
-                        return redirect(url_for('auth',w=what))
-                else:
-                    session['error_msg'] = 'who'
-                    return redirect(url_for('auth',w=what))
-            else:
-                session['error_msg']='email'
-                return redirect(url_for('auth',w=what))
-        else:
-            session['error_msg'] = 'both'
-            return redirect(url_for('auth',w=what))
-
-@app.route('/g/',methods=['GET','POST'])
-def new_group():
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-        return redirect('/u/')
-    if current_user.id==1:
-        return redirect('/u/')
-    if request.method == 'GET':
-        subs = {}
-        try:
-            with sqlite3.connect('database/db.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                                  FROM (SELECT group_name
-                                        FROM subscriptions
-                                                 INNER JOIN groups ON subscriptions.group_id = groups.id
-                                        WHERE user_id = ?
-                                        ORDER BY group_id)''', (current_user.id,))
-                row = cursor.fetchone()
-                if row[0]:
-                    subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-        except:
-            None
-        error_msg = session.pop('error_msg', '')
-        return render_template('new_group.html', error=error_msg, login=current_user.login, subs=subs)
-    elif request.method == 'POST':
-        group_name = request.form.get('group_name','')
-        gava = request.files['gava']
-        if group_name and 0<len(group_name)<20 and re.match(r'^[a-zA-Z0-9_-]+$', group_name) is not None:
-            if is_safe_folder(group_name, 'g', 'create'):
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    try:
-                        cursor.execute("INSERT INTO groups (group_name) VALUES (?)",
-                                       (group_name,))
-                    except sqlite3.IntegrityError:
-                        session['error_msg'] = 'already'
-                        return redirect('/g/')
-                    conn.commit()
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT id FROM groups WHERE group_name = ?", (group_name,))
-                    row = cursor.fetchone()
-                    group_id = row[0]
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("INSERT INTO subscriptions (user_id,group_id,role) VALUES (?,?,'creat')",
-                                       (current_user.id,group_id))
-                    conn.commit()
-                if gava.filename != '':
-                    if img_PROCESS(current_user.login.lower(),gava,os.path.join('g', group_name.lower()),'ava.jpg',f'/g/{group_name}'):
-                        session['wait'] = True
-                        return redirect('/loading')
-                return redirect(f'/g/{group_name}')
-            else:
-                session['error_msg'] = 'name'
-                return redirect('/g/')
-        else:
-            session['error_msg'] = 'name'
-            return redirect('/g/')
-
-@app.route('/p/<post>',methods=['GET','POST'])
-def posts(post):
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-    page = request.args.get('p', '1')
-    if not page.isnumeric():
-        page = '1'
-    page = abs(int(page))
-    if page <= 0:
-        page = 1
-    subs = {}
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                          FROM (SELECT group_name
-                                FROM subscriptions
-                                         INNER JOIN groups ON subscriptions.group_id = groups.id
-                                WHERE user_id = ?
-                                ORDER BY group_id)''', (current_user.id,))
-        row = cursor.fetchone()
-        if row[0]:
-            subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('creat', 'moder')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        mods_in_groups = dict(cursor.fetchall())
-    if is_safe_folder(post, 'p', "exist"):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes, uploader_group_id
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                              WHERE posts.id = ?''', (post,))
-            row = cursor.fetchone()
-            who_rem_in_this_post = mods_in_groups.get(row[1], '').lower().split(',')
-            singular_post=rating_count({'id': row[0], 'g': row[1], 'g_id': row[10], 'u': row[2], 'upload_date': '.'.join(row[3].split('.')[::-1]), 'title': row[4],
-                               'desc': row[5],
-                               'attach_img': row[6], 'rating': row[7],
-                               'liked_by': set(row[8].lower().split(',') if row[8] else []),
-                               'disliked_by': set(row[9].lower().split(',') if row[9] else []),
-                               'who_rem': set(who_rem_in_this_post + [row[2].lower()])})
-    else:
-        return redirect(url_for('error', e=404))
-    #Select comments
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT comments.id, desc, upload_date, u.login, post_id, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                          FROM comments INNER JOIN users u
-                          ON comments.user_id = u.id
-                          WHERE comments.post_id = ? ORDER BY popularity_score DESC''', (post,))
-        how_many_are_there_posts = len(cursor.fetchall())
-        cursor.execute('''SELECT comments.id, desc, upload_date, u.login, post_id, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_comments
-                                  INNER JOIN users u2 on likes_dislikes_comments.user_id = u2.id
-                                  WHERE comment_id = comments.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                          FROM comments INNER JOIN users u
-                          ON comments.user_id = u.id
-                          WHERE comments.post_id = ? ORDER BY popularity_score DESC LIMIT 5 OFFSET ?''', (post,5*(page-1)))
-        rows = cursor.fetchall()
-        temp_comments = {row[0]:
-                             {'id': row[0], 'desc': row[1], 'upload_date': '.'.join(row[2].split('.')[::-1]), 'u': row[3],
-                              'rating': row[5], 'liked_by': set(row[6].lower().split(',') if row[6] else []),
-                 'disliked_by': set(row[7].lower().split(',') if row[7] else []), 'who_rem': set(who_rem_in_this_post + [row[3].lower()])} for
-                         row in rows}
-        comments = {id: rating_count(comment.copy()) for id, comment in temp_comments.items()}
-    #Select current user's role in current group
-    current_role = 'unknown'
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT role
-                          FROM subscriptions
-                          WHERE user_id = ?
-                            AND group_id = ?''', (current_user.id, singular_post['g_id']))
-        row = cursor.fetchone()
-        if row:
-            current_role = row[0]
-    if request.method == 'GET':
-        return render_template('posts.html', login=current_user.login, subs=subs, post=singular_post, comments=comments.values(), page=page, total_pages=how_many_are_there_posts)
-    elif request.method == 'POST':
-        if current_user.is_anonymous:
-            login_user(load_user(1))
-            return redirect('/u/')
-        if current_user.id == 1:
-            return redirect('/u/')
-        if 'comment' in request.form:
-            if current_user.id == 1:
-                return redirect('/u/')
-            if current_role=='unknown':
-                return redirect(f'/p/{post}')
-            pdesc=request.form.get('comment','')
-            if pdesc and len(pdesc)<=4096:
-                date_today=datetime.today().strftime("%y.%m.%d")
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("INSERT INTO comments (desc,upload_date,user_id,post_id,rating) VALUES (?, ?, ?, ?, ?)",
-                                       (pdesc, date_today, current_user.id, post, 0))
-                    conn.commit()
-            return redirect(f'/p/{post}')
-        elif 'postId' in request.form:
-            what_post = request.form.get('postId', 0)
-            if what_post and what_post.isnumeric() and singular_post["id"]==int(what_post) and current_user.login.lower() in singular_post['who_rem']:
-                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
-                if is_safe_folder(what_post, 'p', 'delete'):
-                    with sqlite3.connect('database/db.db') as conn:
-                        # Likes, Dislikes
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_posts
-                                          WHERE post_id = ?;''',
-                                       (what_post,))
-                        conn.commit()
-                        # Posts
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM posts
-                                          WHERE id = ?;''', (what_post,))
-                        conn.commit()
-                        # Likes, Dislikes (comments)
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_comments
-                                          WHERE comment_id IN (SELECT id FROM comments WHERE post_id = ?);''',
-                                       (what_post,))
-                        conn.commit()
-                        # Comments
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE post_id = ?;''', (what_post,))
-                        conn.commit()
-                    return redirect('/?filter=popular')
-                else:
-                    return "Post can't be deleted."
-            else:
-                return redirect('/?filter=popular')
-        elif 'commentId' in request.form:
-            what_comment = request.form.get('commentId', 0)
-            if what_comment and what_comment.isnumeric() and current_user.login.lower() in comments.get(int(what_comment),{"who_rem": {}})['who_rem']:
-                # Risky. Will remove everything regarding a specific comment, including its likes/dislikes
-                with sqlite3.connect('database/db.db') as conn:
-                    # Likes, Dislikes
-                    cursor = conn.cursor()
-                    cursor.execute('''DELETE
-                                        FROM likes_dislikes_comments
-                                        WHERE comment_id = ?;''',
-                                    (what_comment,))
-                    conn.commit()
-                    # Comments
-                    cursor = conn.cursor()
-                    cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE id = ?;''', (what_comment,))
-                    conn.commit()
-            return redirect(f'/p/{post}')
-
-@app.route('/g/<group>',methods=['GET','POST'])
-def groups(group):
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-    page = request.args.get('p', '1')
-    if not page.isnumeric():
-        page = '1'
-    page = abs(int(page))
-    if page<=0:
-        page=1
-    subs = {}
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                          FROM (SELECT group_name
-                                FROM subscriptions
-                                         INNER JOIN groups ON subscriptions.group_id = groups.id
-                                WHERE user_id = ?
-                                ORDER BY group_id)''', (current_user.id,))
-        row = cursor.fetchone()
-        if row[0]:
-            subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('creat', 'moder')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        mods_in_groups = dict(cursor.fetchall())
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('user')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        users_in_groups = dict(cursor.fetchall())
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('moder')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        only_mods_in_groups = dict(cursor.fetchall())
-    if is_safe_folder(group, 'g', "exist"):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                              WHERE group_name = ? ORDER BY popularity_score DESC''', (group,))
-            how_many_are_there_posts = len(cursor.fetchall())
-            cursor.execute('''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                              WHERE group_name = ? ORDER BY popularity_score DESC LIMIT 5 OFFSET ?''', (group,5*(page-1)))
-            rows = cursor.fetchall()
-            temp_posts = { row[0]:
-                {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': '.'.join(row[3].split('.')[::-1]), 'title': row[4], 'desc': row[5],
-                 'attach_img': row[6], 'rating': row[7], 'liked_by': set(row[8].lower().split(',') if row[8] else []),
-                 'disliked_by': set(row[9].lower().split(',') if row[9] else []), 'who_rem': set(mods_in_groups.get(row[1],'').lower().split(',')+[row[2].lower()])} for row in rows}
-
-        posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
-    else:
-        return redirect(url_for('error', e=404))
-    current_group_id = None
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT id
-                          FROM groups
-                          WHERE group_name = ?''', (group,))
-        row = cursor.fetchone()
-        if row:
-            current_group_id = row[0]
-    if current_group_id is None:
-        return redirect(url_for('error'))
-    current_role='unknown'
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT role
-                                FROM subscriptions WHERE user_id=? AND group_id=?''', (current_user.id,current_group_id))
-        row = cursor.fetchone()
-        if row:
-            current_role=row[0]
-    subscribers=rating_count(len(set(mods_in_groups.get(group,'').lower().split(',')) | set(users_in_groups.get(group,'').lower().split(',') if users_in_groups.get(group,'') else {})))
-    if request.method == 'GET':
-        return render_template('groups.html', login=current_user.login, subs=subs, group=group, posts=posts.values(), role=current_role, subscribers=subscribers, usermods_users=set(users_in_groups.get(group,'').split(',') if users_in_groups.get(group,'') else {}),usermods_mods=set(only_mods_in_groups.get(group,'').split(',') if only_mods_in_groups.get(group,'') else {}),page=page,total_pages=how_many_are_there_posts)
-    elif request.method == 'POST':
-        if current_user.is_anonymous:
-            login_user(load_user(1))
-            return redirect('/u/')
-        if current_user.id == 1:
-            return redirect('/u/')
-        if 'sub' in request.form:
-            if current_role=='unknown':
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    try:
-                        cursor.execute("INSERT INTO subscriptions (user_id, group_id, role) VALUES (?, ?, 'user')",
-                                       (current_user.id, current_group_id))
-                    except sqlite3.IntegrityError:
-                        return redirect(url_for('error'))
-                    conn.commit()
-            elif current_role=='user' or current_role=='moder':
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''DELETE
-                                      FROM subscriptions
-                                      WHERE user_id = ?
-                                        and group_id = ?;''', (current_user.id, current_group_id))
-                    conn.commit()
-            elif current_role=='creat':
-                #Risky. Will delete everything regarding that group. Including info about likes, dislikes, comments, post, subscribers and group itself.
-                if is_safe_folder(group.lower(),'g','delete'):
-                    with sqlite3.connect('database/db.db') as conn:
-                        # Likes, Dislikes
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_posts
-                                          WHERE post_id IN (SELECT id FROM posts WHERE uploader_group_id=?);''', (current_group_id,))
-                        conn.commit()
-                        # Likes, Dislikes (comments)
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_comments
-                                          WHERE comment_id IN (SELECT id FROM comments WHERE post_id IN (SELECT id FROM posts WHERE uploader_group_id=?));''',
-                                       (current_group_id,))
-                        conn.commit()
-                        # Comments
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE post_id IN (SELECT id FROM posts WHERE uploader_group_id=?);''', (current_group_id,))
-                        conn.commit()
-                        # Posts (remove folders)
-                        cursor = conn.cursor()
-                        cursor.execute('''SELECT GROUP_CONCAT(id)
-                                          FROM posts
-                                          WHERE uploader_group_id = ?;''', (current_group_id,))
-                        posts_to_remove = cursor.fetchone()
-                        if posts_to_remove[0]:
-                            posts_to_remove = posts_to_remove[0].split(',')
-                        else:
-                            posts_to_remove = []
-                        for postr in posts_to_remove:
-                            is_safe_folder(postr,'p','delete')
-                        # Posts
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM posts
-                                          WHERE uploader_group_id=?;''', (current_group_id,))
-                        conn.commit()
-                        # Subscribers
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''DELETE
-                                              FROM subscriptions
-                                              WHERE group_id=?;''', (current_group_id,))
-                            conn.commit()
-                        # Group
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''DELETE
-                                              FROM groups
-                                              WHERE id=?;''', (current_group_id,))
-                            conn.commit()
-                    return redirect('/?filter=popular')
-                else:
-                    return "Group can't be deleted."
-
-            return redirect(f'/g/{group}')
-        elif 'title' in request.form and 'desc' in request.form and 'attach' in request.files:
-            if current_user.id == 1:
-                return redirect('/u/')
-            if current_role=='unknown':
-                return redirect(f'/g/{group}')
-            gtitle=request.form.get('title','')
-            gdesc=request.form.get('desc','')
-            gattach=request.files['attach']
-            gattach_filename=secure_filename(gattach.filename)
-            if gtitle and 0<len(gtitle)<=100 and len(gdesc)<=4096:
-                date_today=datetime.today().strftime("%y.%m.%d")
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("INSERT INTO posts (uploader_group_id,uploader_user_id,upload_date,title,desc,attach_img,rating) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                                       (current_group_id, current_user.id, date_today, gtitle, gdesc, gattach_filename[::-1].split('.',1)[1][::-1]+'.jpg' if gattach_filename else 'None', 0))
-                    conn.commit()
-                    cursor.execute("SELECT id FROM posts WHERE uploader_group_id=? AND uploader_user_id=? AND upload_date=? AND title=? AND desc=? AND attach_img=? AND rating=? ORDER BY id DESC LIMIT 1",
-                                   (current_group_id, current_user.id, date_today, gtitle, gdesc, gattach_filename[::-1].split('.',1)[1][::-1]+'.jpg' if gattach_filename else 'None', 0))
-                    row = cursor.fetchone()
-                    if row:
-                        post_id=row[0]
-                    else:
-                        return redirect(f'/g/{group}')
-                if is_safe_folder(str(post_id),'p','create'):
-                    if gattach_filename:
-                        if img_PROCESS(current_user.login.lower(), gattach, os.path.join('p', str(post_id)), gattach_filename, f'/p/{post_id}'):
-                            session['wait'] = True
-                            return redirect('/loading')
-                    return redirect(f'/p/{post_id}')
-                else:
-                    return redirect(f'/g/{group}')
-            else:
-                return redirect(f'/g/{group}')
-        elif 'postId' in request.form:
-            what_post = request.form.get('postId', 0)
-            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
-                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
-                if is_safe_folder(what_post, 'p', 'delete'):
-                    with sqlite3.connect('database/db.db') as conn:
-                        # Likes, Dislikes
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_posts
-                                          WHERE post_id = ?;''',
-                                       (what_post,))
-                        conn.commit()
-                        # Posts
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM posts
-                                          WHERE id = ?;''', (what_post,))
-                        conn.commit()
-                        # Likes, Dislikes (comments)
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_comments
-                                          WHERE comment_id IN (SELECT id FROM comments WHERE post_id = ?);''',
-                                       (what_post,))
-                        conn.commit()
-                        # Comments
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE post_id = ?;''', (what_post,))
-                        conn.commit()
-                    return redirect(f'/g/{group}')
-                else:
-                    return "Post can't be deleted."
-            else:
-                return redirect(f'/g/{group}')
-        elif 'banner' in request.files:
-            if current_role == 'moder' or current_role == 'creat':
-                file = request.files['banner']
-                if file.filename == '':
-                    return redirect(f'/g/{group}')
-                if img_PROCESS(current_user.login.lower(), file, os.path.join('g', group.lower()), 'banner.jpg',f'/g/{group}'):
-                    session['wait'] = True
-                    return redirect('/loading')
-                return redirect(f'/g/{group}')
-            else:
-                return redirect(f'/g/{group}')
-        elif 'avatar' in request.files:
-            if current_role == 'moder' or current_role == 'creat':
-                file = request.files['avatar']
-                if file.filename == '':
-                    return redirect(f'/g/{group}')
-                if img_PROCESS(current_user.login.lower(), file, os.path.join('g', group.lower()), 'ava.jpg',f'/g/{group}'):
-                    session['wait'] = True
-                    return redirect('/loading')
-                return redirect(f'/g/{group}')
-            else:
-                return redirect(f'/g/{group}')
-        elif 'usermod' in request.form:
-            if current_role == 'creat':
-                new_mods=set(request.form.getlist('usermods'))
-                new_mods={mod.lower() for mod in new_mods}
-                actual_mods = list(new_mods - set(only_mods_in_groups.get(group, '').lower().split(',')))
-                turn_to_users = list(set(only_mods_in_groups.get(group, '').lower().split(',')) - new_mods)
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        f"UPDATE subscriptions set role='moder' WHERE group_id IN (SELECT id FROM groups WHERE groups.group_name=?) AND role NOT IN ('moder','creat') AND user_id IN (SELECT id FROM users WHERE users.login IN ({', '.join('?' for _ in actual_mods)}))",
-                        [group] + actual_mods)
-                    conn.commit()
-                with sqlite3.connect('database/db.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        f"UPDATE subscriptions set role='user' WHERE group_id IN (SELECT id FROM groups WHERE groups.group_name=?) AND role NOT IN ('user','creat') AND user_id IN (SELECT id FROM users WHERE users.login IN ({', '.join('?' for _ in turn_to_users)}))",
-                        [group] + turn_to_users)
-                    conn.commit()
-            return redirect(f'/g/{group}')
-
-@app.route('/u/<login>', methods=['GET','POST'])
-def profile(login):
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-    if current_user.id==1 and login.lower()=='anonymous':
-        return redirect('/u/')
-
-    page = request.args.get('p','1')
-    if not page.isnumeric():
-        page='1'
-    page=abs(int(page))
-    if page<=0:
-        page=1
-    subs = {}
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                          FROM (SELECT group_name
-                                FROM subscriptions
-                                         INNER JOIN groups ON subscriptions.group_id = groups.id
-                                WHERE user_id = ?
-                                ORDER BY group_id)''', (current_user.id,))
-        row = cursor.fetchone()
-        if row[0]:
-            subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('creat', 'moder')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        mods_in_groups = dict(cursor.fetchall())
-    if is_safe_folder(login, 'u', "exist"):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                              WHERE u.login = ? ORDER BY popularity_score DESC''', (login,))
-            how_many_are_there_posts = len(cursor.fetchall())
-            cursor.execute('''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
-                              WHERE u.login = ? ORDER BY popularity_score DESC LIMIT 5 OFFSET ?''', (login,5*(page-1)))
-            rows = cursor.fetchall()
-            temp_posts = { row[0]:
-                {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': '.'.join(row[3].split('.')[::-1]), 'title': row[4], 'desc': row[5],
-                 'attach_img': row[6], 'rating': row[7], 'liked_by': set(row[8].lower().split(',') if row[8] else []),
-                 'disliked_by': set(row[9].lower().split(',') if row[9] else []), 'who_rem': set(mods_in_groups.get(row[1],'').lower().split(',')+[row[2].lower()])} for row in rows}
-
-        posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
-    else:
-        return redirect(url_for('error', e=404))
-    if request.method == 'GET':
-        error_msg = session.pop('error_msg','')
-        return render_template('profile.html', clogin=current_user.login, cemail=current_user.email, login=login, subs=subs, posts=posts.values(), error=error_msg, page=page, total_pages=how_many_are_there_posts)
-    elif request.method == 'POST':
-        if current_user.is_anonymous:
-            login_user(load_user(1))
-            return redirect('/u/')
-        if current_user.id == 1:
-            return redirect('/u/')
-        if 'email' in request.form:
-            email=request.form.get('email','')
-            new_pass=request.form.get('password','')
-            if new_pass:
-                if email and new_pass and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$',email) is not None and (len(new_pass)>=8 and re.match(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&_-])(?=\S+$).{8,}$",new_pass)):
-                    if current_user.id==1:
-                        return redirect('/u/')
-                    if not current_user.check_password(new_pass) and current_user.email!=email:
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            try:
-                                cursor.execute('''UPDATE users
-                                                  SET email = ?, password = ?
-                                                  WHERE id = ?;''', (email, ph.hash(new_pass),current_user.id))
-                            except sqlite3.IntegrityError:
-                                session['error_msg'] = 'both'
-                                return redirect(f'/u/{login}')
-                            conn.commit()
-                            login_user(load_user(current_user.id))
-                            return redirect(f'/u/{login}')
-                    elif current_user.email!=email:
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            try:
-                                cursor.execute('''UPDATE users
-                                                  SET email = ?
-                                                  WHERE id = ?;''', (email,current_user.id))
-                            except sqlite3.IntegrityError:
-                                session['error_msg'] = 'email'
-                                return redirect(f'/u/{login}')
-
-                            conn.commit()
-                            login_user(load_user(current_user.id))
-                            return redirect(f'/u/{login}')
-                    elif not current_user.check_password(new_pass):
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            try:
-                                cursor.execute('''UPDATE users
-                                                  SET password = ?
-                                                  WHERE id = ?;''', (ph.hash(new_pass),current_user.id))
-                            except sqlite3.IntegrityError:
-                                session['error_msg'] = 'pass'
-                                return redirect(f'/u/{login}')
-
-                            conn.commit()
-                            login_user(load_user(current_user.id))
-                            return redirect(f'/u/{login}')
-                    else:
-                        session['error_msg']=''
-                        return redirect(f'/u/{login}')
-
-                else:
-                    session['error_msg']='both'
-                    return redirect(f'/u/{login}')
-
-            else:
-                if email and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$',email) is not None:
-                    if current_user.id==1:
-                        return redirect('/u/')
-                    if current_user.email!=email:
-                        with sqlite3.connect('database/db.db') as conn:
-                            cursor = conn.cursor()
-                            try:
-                                cursor.execute('''UPDATE users
-                                                  SET email = ?
-                                                  WHERE id = ?;''', (email, current_user.id))
-                            except sqlite3.IntegrityError:
-                                session['error_msg'] = 'email'
-                                return redirect(f'/u/{login}')
-
-                            conn.commit()
-                            login_user(load_user(current_user.id))
-                            return redirect(f'/u/{login}')
-                    else:
-                        session['error_msg'] = ''
-                        return redirect(f'/u/{login}')
-
-                else:
-                    session['error_msg'] = 'email'
-                    return redirect(f'/u/{login}')
-
-        elif 'avatar' in request.files:
-            file = request.files['avatar']
-            if file.filename == '':
-                session['error_msg'] = 'ava'
-                return redirect(f'/u/{login}')
-
-            if img_PROCESS(current_user.login.lower(), file, os.path.join('u', current_user.login.lower()), 'ava.jpg',f'/u/{login}'):
-                session['wait'] = True
-                return redirect('/loading')
-            return redirect(f'/u/{login}')
-        elif 'logout' in request.form:
-            logout_user()
-            return redirect('/u/')
-        elif 'postId' in request.form:
-            what_post = request.form.get('postId', 0)
-            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
-                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
-                if is_safe_folder(what_post, 'p', 'delete'):
-                    with sqlite3.connect('database/db.db') as conn:
-                        # Likes, Dislikes
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_posts
-                                          WHERE post_id = ?;''',
-                                       (what_post,))
-                        conn.commit()
-                        # Posts
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM posts
-                                          WHERE id = ?;''', (what_post,))
-                        conn.commit()
-                        # Likes, Dislikes (comments)
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_comments
-                                          WHERE comment_id IN (SELECT id FROM comments WHERE post_id = ?);''',
-                                       (what_post,))
-                        conn.commit()
-                        # Comments
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE post_id = ?;''', (what_post,))
-                        conn.commit()
-                    return redirect(f'/u/{login}')
-                else:
-                    return redirect(url_for('error', e=404))
-            else:
-                return redirect(f'/u/{login}')
-        else:
-            return redirect(f'/u/{login}')
-
-@app.route('/', methods=['GET','POST'])
-def index():
-    query = request.args.get('q', '').lower().strip()
-    category = request.args.get('c','').lower().strip()
-    if category not in ['','users','posts','groups']:
-        category=''
-
-    page = request.args.get('p','1')
-    if not page.isnumeric():
-        page='1'
-    page=abs(int(page))
-    if page<=0:
-        page=1
-    filter = request.args.get('filter', '').lower()
-    subs = {}
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-        if filter == '':
-            return redirect('/?filter=popular')
-    else:
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                              FROM (SELECT group_name
-                                    FROM subscriptions
-                                             INNER JOIN groups ON subscriptions.group_id = groups.id
-                                    WHERE user_id = ?
-                                    ORDER BY group_id)''', (current_user.id,))
-            row = cursor.fetchone()
-            if row[0]:
-                subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-    with sqlite3.connect('database/db.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT groups.group_name,
-                                 GROUP_CONCAT(login) AS user_ids
-                          FROM groups
-                                   LEFT JOIN subscriptions
-                                             ON subscriptions.group_id = groups.id
-                                                 AND subscriptions.role IN ('creat', 'moder')
-                                   INNER JOIN users on subscriptions.user_id = users.id
-                          GROUP BY groups.group_name
-                          ORDER BY groups.group_name;""")
-        mods_in_groups = dict(cursor.fetchall())
-    search_users=tuple()
-    search_groups=tuple()
-    posts={}
-    how_many_are_there_posts = 0
-    if query!='' and (category=='' or category == 'users'):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            query=re.sub(r"\s+","",query)
-            cursor.execute("SELECT login FROM users WHERE login<>'Anonymous' AND login LIKE :search", {"search": f'%{query}%'})
-            how_many_are_there_posts = len(cursor.fetchall())
-            cursor.execute("SELECT login FROM users WHERE login<>'Anonymous' AND login LIKE :search LIMIT 5 OFFSET :offset", {"search": f'%{query}%', "offset": 5*(page-1)})
-            search_users = cursor.fetchall()
-    if query!='' and (category=='' or category=='groups'):
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            query=re.sub(r"\s+","",query)
-            cursor.execute('SELECT group_name FROM groups WHERE group_name LIKE :search', {"search": f'%{query}%'})
-            how_many_are_there_posts = len(cursor.fetchall())
-            cursor.execute('SELECT group_name FROM groups WHERE group_name LIKE :search LIMIT 5 OFFSET :offset', {"search": f'%{query}%', "offset": 5*(page-1)})
-            search_groups = cursor.fetchall()
-    if category=='' or category=='posts':
-        sql_command='''SELECT posts.id,
-                                     group_name,
-                                     u.login,
-                                     upload_date,
-                                     title, desc, attach_img, rating, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = TRUE
-                                  ORDER BY user_id)) as likes, (SELECT GROUP_CONCAT(login)
-                                  FROM (SELECT u2.login
-                                  FROM likes_dislikes_posts
-                                  INNER JOIN main.users u2 on likes_dislikes_posts.user_id = u2.id
-                                  WHERE post_id = posts.id AND likeorno = FALSE
-                                  ORDER BY user_id)) AS dislikes,
-                                  (rating * 1.0) / (julianday('now') -julianday('20' || REPLACE(upload_date,'.','-'))+1) AS popularity_score
-                              FROM posts INNER JOIN main.groups g
-                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id '''
-        if query!='':
-            sql_command+="WHERE title LIKE :search OR desc LIKE :search OR attach_img LIKE :search ORDER BY popularity_score DESC "
-        elif filter == '':
-            sql_command+=f'WHERE group_name IN ({", ".join("?" for _ in subs)}) ORDER BY popularity_score DESC '
-        elif filter == 'popular':
-            sql_command+='ORDER BY popularity_score DESC '
-        elif filter == 'latest':
-            sql_command+='ORDER BY upload_date DESC, rating DESC '
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            if filter == '' and query == '':
-                cursor.execute(sql_command, subs)
-            else:
-                if query=='':
-                    cursor.execute(sql_command)
-                else:
-                    cursor.execute(sql_command, {"search": f'%{query}%'})
-            rows = cursor.fetchall()
-            how_many_are_there_posts=len(rows)
-            sql_command+=f'LIMIT 5 OFFSET {5*(page-1)}'
-            if filter == '' and query == '':
-                cursor.execute(sql_command, subs)
-            else:
-                if query=='':
-                    cursor.execute(sql_command)
-                else:
-                    cursor.execute(sql_command, {"search": f'%{query}%'})
-            rows = cursor.fetchall()
-            temp_posts = { row[0]:
-                {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': '.'.join(row[3].split('.')[::-1]), 'title': row[4], 'desc': row[5],
-                 'attach_img': row[6], 'rating': row[7], 'liked_by': set(row[8].lower().split(',') if row[8] else []),
-                 'disliked_by': set(row[9].lower().split(',') if row[9] else []), 'who_rem': set(mods_in_groups.get(row[1],'').lower().split(',')+[row[2].lower()])} for row in rows}
-
-        posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
-
-    if request.method=='GET':
-        return render_template('home_with_style.html', login=current_user.login, filter=filter, subs=subs, posts=posts.values(), search_users=search_users,search_groups=search_groups, query=query, page=page, category=category, total_pages=how_many_are_there_posts)
-    elif request.method=='POST':
-        if current_user.is_anonymous:
-            login_user(load_user(1))
-            return redirect('/u/')
-        if current_user.id == 1:
-            return redirect('/u/')
-        if 'postId' in request.form:
-            what_post = request.form.get('postId',0)
-            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
-                #Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
-                if is_safe_folder(what_post, 'p', 'delete'):
-                    with sqlite3.connect('database/db.db') as conn:
-                        # Likes, Dislikes
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_posts
-                                          WHERE post_id = ?;''',
-                                       (what_post,))
-                        conn.commit()
-                        # Posts
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM posts
-                                          WHERE id = ?;''', (what_post,))
-                        conn.commit()
-                        # Likes, Dislikes (comments)
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM likes_dislikes_comments
-                                          WHERE comment_id IN (SELECT id FROM comments WHERE post_id = ?);''',
-                                       (what_post,))
-                        conn.commit()
-                        # Comments
-                        cursor = conn.cursor()
-                        cursor.execute('''DELETE
-                                          FROM comments
-                                          WHERE post_id = ?;''', (what_post,))
-                        conn.commit()
-                    return redirect('/?filter=popular')
-                else:
-                    return redirect(url_for('error'))
-            else:
-                return redirect('/?filter=popular')
-        else:
-            return redirect('/?filter=popular')
-
-@app.route('/uploads/<folder0>/<folder1>/<filename>')
-def serve_user_file(folder0,folder1,filename):
-    return send_from_directory(os.path.join(UPLOAD_FOLDER, folder0, folder1), filename)
-
-@app.route('/loading')
-def loading():
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-        return redirect('/?filter=popular')
-    if request.method == 'GET' and session.pop('wait',False):
-        return render_template('wait.html', login=current_user.login)
-    else:
-        return redirect('/?filter=popular')
-
-@app.route('/error')
-def error():
-    er=request.args.get('e','Error')
-    er_msg='Unexpected error!'
-    if str(er)=='404':
-        er_msg='This page does not exist!'
-    elif str(er)=='413':
-        er_msg="Image too large!\n(Max: 5MB)"
-    if current_user.is_anonymous:
-        login_user(load_user(1))
-    subs = {}
-    try:
-        with sqlite3.connect('database/db.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''SELECT GROUP_CONCAT(group_name)
-                              FROM (SELECT group_name
-                                    FROM subscriptions
-                                             INNER JOIN groups ON subscriptions.group_id = groups.id
-                                    WHERE user_id = ?
-                                    ORDER BY group_id)''', (current_user.id,))
-            row = cursor.fetchone()
-            if row[0]:
-                subs = sorted({sub for sub in row[0].split(',') if is_safe_folder(sub, 'g', 'exist')})
-    except:
-        None
-    return render_template('error.html', login=current_user.login, subs=subs, error=str(er), errormsg=er_msg)
-
-@app.errorhandler(HTTPException)
-def error_handler(e):
-    return redirect(url_for('error',e=e.code))
-
-if __name__ == '__main__':
+import base64
+import io
+import json
+import logging
+import mimetypes
+import os
+import platform
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+from argon2 import PasswordHasher
+from argon2.exceptions import *
+from flask import Flask, render_template, request, redirect, send_from_directory, url_for, session, jsonify, g
+from flask_login import LoginManager, UserMixin, login_user, current_user, logout_user
+from flask_socketio import SocketIO, join_room
+from markupsafe import Markup
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+import assets
+import cache
+import contentcache
+import db
+import deletion
+import feed
+import imaging
+import jobs
+import moderation
+import search
+import typeahead
+import votes
+
+log = logging.getLogger(__name__)
+
+MODEL_PATH = 'model/saved_model.h5'
+
+app = Flask(__name__)
+# app.config['REMEMBER_COOKIE_DURATION']=timedelta(days=10)
+app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
+# Write-behind vote buffering (see votes.VoteBuffer), off unless VOTE_BUFFER=1
+app.config['VOTE_BUFFER'] = os.environ.get('VOTE_BUFFER', '0') == '1'
+app.config['VOTE_BUFFER_INTERVAL'] = float(os.environ.get('VOTE_BUFFER_INTERVAL', '0.2'))
+app.config['VOTE_BUFFER_MAX_EVENTS'] = int(os.environ.get('VOTE_BUFFER_MAX_EVENTS', '500'))
+app.config['VOTE_BUFFER_MAX_STALENESS'] = float(os.environ.get('VOTE_BUFFER_MAX_STALENESS', '5'))
+# Seconds between uploads/ <-> database reconciliation passes (see reconcile_uploads), 0 disables it
+app.config['UPLOADS_RECONCILE_INTERVAL'] = float(os.environ.get('UPLOADS_RECONCILE_INTERVAL', '0'))
+# NSFW classification pool (see moderation.ModerationPool)
+app.config['MODERATION_WORKERS'] = int(os.environ.get('MODERATION_WORKERS', '1'))
+app.config['MODERATION_BATCH_SIZE'] = int(os.environ.get('MODERATION_BATCH_SIZE', '8'))
+app.config['MODERATION_BATCH_WAIT'] = float(os.environ.get('MODERATION_BATCH_WAIT', '0.05'))
+app.config['MODERATION_QUEUE_SIZE'] = int(os.environ.get('MODERATION_QUEUE_SIZE', '32'))
+# Start the workers and load the model at startup instead of on the first upload
+app.config['MODERATION_PRELOAD'] = os.environ.get('MODERATION_PRELOAD', '0') == '1'
+# 'spawn', or 'forkserver' to import TensorFlow once and fork every worker from that process
+app.config['MODERATION_START_METHOD'] = os.environ.get('MODERATION_START_METHOD', 'spawn')
+# Upload moderation jobs (see jobs.py): uploads one user may have waiting at a time, attempts
+# at classifying an upload before it is given up as unreadable, and seconds before a failed
+# attempt is retried, doubled with every attempt
+app.config['MODERATION_USER_JOBS'] = int(os.environ.get('MODERATION_USER_JOBS', '2'))
+app.config['MODERATION_JOB_ATTEMPTS'] = int(os.environ.get('MODERATION_JOB_ATTEMPTS', '3'))
+app.config['MODERATION_JOB_RETRY_DELAY'] = float(os.environ.get('MODERATION_JOB_RETRY_DELAY', '5'))
+# Socket.IO message queue shared by all worker processes (e.g. redis://localhost:6379/0), so
+# that events reach a client whichever process emits them. Without one, a job's events only
+# reach clients of the process that ran it; wait pages elsewhere learn its outcome by polling.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# Materialized subscriptions feeds (see feed.py): the default home feed becomes one indexed
+# range read, at the cost of one row per subscriber on every post write
+app.config['FEED_MATERIALIZED'] = os.environ.get('FEED_MATERIALIZED', '0') == '1'
+# Size bound of the content-addressed cache of verdicts and converted uploads (see contentcache)
+app.config['UPLOAD_CACHE_MAX_MB'] = int(os.environ.get('UPLOAD_CACHE_MAX_MB', '256'))
+# Memory budget of the rendered post card and comment fragments (see render_fragment)
+app.config['FRAGMENT_CACHE_MAX_MB'] = int(os.environ.get('FRAGMENT_CACHE_MAX_MB', '32'))
+# Shared page cache for logged out visitors (see serve_cached_page): seconds a page stays fresh
+# (0 disables the cache), then seconds it may still be served while it is rendered again
+app.config['PAGE_CACHE_TTL'] = float(os.environ.get('PAGE_CACHE_TTL', '5'))
+app.config['PAGE_CACHE_STALE'] = float(os.environ.get('PAGE_CACHE_STALE', '30'))
+# Who sends upload files (see serve_user_file): 'off' streams them from Flask, 'X-Accel-Redirect'
+# (nginx) or 'X-Sendfile' (Apache mod_xsendfile, lighttpd) hand them to the proxy. Only set
+# one of those when that proxy is in front of every request: without it the client gets an
+# empty response, and X-Sendfile shows it the file's path on disk.
+app.config['UPLOAD_SENDFILE'] = os.environ.get('UPLOAD_SENDFILE', 'off')
+# nginx internal location aliased to the uploads/ folder, for X-Accel-Redirect
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_uploads/')
+# Logins (comma separated) allowed to see internal endpoints such as /metrics/moderation
+app.config['ADMINS'] = {login.strip().lower() for login in os.environ.get('ADMINS', '').split(',') if login.strip()}
+app.secret_key = secrets.token_hex(32)
+UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
+# gzip/brotli copies of the text files in static/, made by create_app() (see assets.precompress)
+PRECOMPRESSED_FOLDER = os.path.join(app.root_path, 'cache', 'static')
+# How long browsers keep an upload fetched through a versioned URL (see upload_version)
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+RENDITION_NAME = re.compile(r'-\d+\.(?:avif|webp)$')
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+socketio = SocketIO(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+# for templates/macros.html
+app.jinja_env.globals.update(srcset=imaging.srcset,
+                             published_upload=lambda src: published_upload(src[len('/uploads/'):]),
+                             fragment=lambda kind, id, version, caller: render_fragment(kind, id, version, caller))
+
+login_manager = LoginManager()
+login_manager.init_app(app)
+ph = PasswordHasher()
+
+# Moderation jobs (see jobs.py). worker_id is the name this process claims jobs and leases
+# under (set by create_app), running_jobs holds job id -> (login, content key, kind, file_path, filename,
+# redirect, converted image) for its jobs in the moderation pool, and job_wakeup tells
+# jobs_THREAD there may be something to claim before its next poll.
+JOB_POLL_INTERVAL = 1
+JOB_RETENTION = 24 * 3600
+worker_id = None
+running_jobs = {}
+job_wakeup = threading.Event()
+
+necessary_folders=['model','uploads','uploads/g','uploads/p','uploads/u','database']
+
+POPULARITY_DECAY_INTERVAL = 15 * 60
+
+def popularity_THREAD():
+    while True:
+        socketio.sleep(POPULARITY_DECAY_INTERVAL)
+        try:
+            db.decay_popularity()
+        except sqlite3.Error:
+            log.exception('Decaying popularity scores failed')
+
+vote_buffer = None
+
+def cast_vote(kind, item_id, clicked, what):
+    # Cached pages turn stale once the vote is committed: right away here, with the next
+    # flush when buffered (see create_app)
+    if vote_buffer is not None:
+        return vote_buffer.vote(kind, item_id, current_user.id, clicked, what)
+    rating = votes.apply_vote(kind, item_id, current_user.id, clicked, what)
+    if rating is not None:
+        page_cache.expire()
+    return rating
+
+
+def safe_folder_path(folder_name, base_dir):
+    # Pure path validation, no filesystem access: the absolute path of uploads/<base_dir>/<folder_name>,
+    # or None if the name could escape that directory
+    folder_name = folder_name.lower()
+    if re.match(r'^[a-zA-Z0-9_-]+$', folder_name) is None:
+        return None
+    base_dir = 'uploads/' + base_dir
+    if os.path.sep in folder_name or (os.path.altsep and os.path.altsep in folder_name):
+        return None
+    full_path = os.path.abspath(os.path.join(base_dir, folder_name))
+    base_dir = os.path.abspath(base_dir)
+    if not full_path.startswith(base_dir + os.path.sep):
+        return None
+    return full_path
+
+def is_safe_folder(folder_name, base_dir, whatdo="exist"):
+    full_path = safe_folder_path(folder_name, base_dir)
+    if full_path is None:
+        return False
+    if whatdo == "exist":
+        return os.path.isdir(full_path)
+    elif whatdo == "create":
+        if os.path.isdir(full_path):
+            return False
+        os.makedirs(full_path, exist_ok=True)
+        return full_path
+    elif whatdo == "delete":
+        if not os.path.isdir(full_path):
+            return False
+        shutil.rmtree(full_path)
+        return full_path
+    elif whatdo == "safe":
+        return True
+    return None
+
+# Removes the folders of deleted posts and groups in the background (see deletion.Janitor)
+janitor = deletion.Janitor()
+
+def reconcile_uploads(grace=3600):
+    # Repairs drift between uploads/ and the tables: recreates folders of existing users, groups
+    # and posts, and removes folders whose row is gone. Folders younger than `grace` seconds are
+    # left alone, they may belong to a sign-up/group/post that is still being committed.
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        expected = {'u': {row[0].lower() for row in cursor.execute("SELECT login FROM users WHERE id <> 1")},
+                    'g': {row[0].lower() for row in cursor.execute('SELECT group_name FROM groups')},
+                    'p': {str(row[0]) for row in cursor.execute('SELECT id FROM posts')}}
+    for base_dir, names in expected.items():
+        on_disk = set(os.listdir(os.path.join('uploads', base_dir)))
+        for name in names - on_disk:
+            full_path = safe_folder_path(name, base_dir)
+            if full_path:
+                os.makedirs(full_path, exist_ok=True)
+        for name in on_disk - names:
+            full_path = safe_folder_path(name, base_dir)
+            if full_path and os.path.isdir(full_path) and time.time() - os.path.getmtime(full_path) > grace:
+                shutil.rmtree(full_path, ignore_errors=True)
+
+def reconcile_THREAD():
+    while True:
+        socketio.sleep(app.config['UPLOADS_RECONCILE_INTERVAL'])
+        try:
+            reconcile_uploads()
+        except (OSError, sqlite3.Error):
+            log.exception('Reconciling uploads failed')
+
+def upload_path(file_path, filename):
+    # An upload's path under uploads/ as recorded in the uploads table: '/' separated
+    return '/'.join(file_path.split(os.sep) + [filename])
+
+def published_upload_sql(path):
+    # A query column holding what published_upload() returns for the upload at `path` (an SQL
+    # expression), to be read with published_columns
+    return f"(SELECT version || '|' || widths || '|' || formats FROM uploads WHERE path = {path})"
+
+def published_columns(value):
+    if value is None:
+        return '', (), ()
+    version, widths, formats = value.split('|')
+    return version, tuple(int(width) for width in widths.split()), tuple(formats.split())
+
+def load_published_upload(path):
+    return published_columns(db.connect().execute(f'SELECT {published_upload_sql("?")}', (path,)).fetchone()[0])
+
+def published_upload(path):
+    # (version, rendition widths, rendition formats) of the upload at uploads/<path>, as
+    # recorded when it was published (see upload_published) and read from memory, so rendering
+    # a picture never touches the filesystem. The version is what pages put in its URLs
+    # (?v=...), '' if there is none; a rendition carries the version of its JPEG. Pages only
+    # list the renditions that exist: none for uploads whose renditions register_uploads has
+    # not made yet.
+    return uploads_cache.get(path, load_published_upload)
+
+def upload_version(path):
+    return published_upload(path)[0]
+
+# Columns of the post listings with the post's image and its group's and author's avatars as
+# published (see post_uploads): the post card fragments are keyed and rendered from the row
+POST_UPLOADS = ''.join(', ' + published_upload_sql(path) for path in ("'p/' || posts.id || '/' || posts.attach_img",
+                                                                       "'g/' || lower(group_name) || '/ava.jpg'",
+                                                                       "'u/' || lower(u.login) || '/ava.jpg'"))
+
+def post_uploads(row):
+    # {'image', 'g', 'u'} -> published_upload() of each, from a row ending with POST_UPLOADS
+    return dict(zip(('image', 'g', 'u'), map(published_columns, row[-3:])))
+
+def upload_published(path, key, suffixes):
+    # Records the upload just published at uploads/<path> from content `key`, as the files
+    # with the name `suffixes` (see imaging.encode)
+    widths, formats = imaging.published(suffixes)
+    with db.connect() as conn:
+        conn.execute('''INSERT INTO uploads (path, version, widths, formats) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (path) DO UPDATE SET version = excluded.version, widths = excluded.widths,
+                                                         formats = excluded.formats, undecodable = FALSE''',
+                     (path, key[:16], ' '.join(map(str, widths)), ' '.join(formats)))
+    uploads_cache.invalidate(path)
+
+def uploads_removed(*folders):
+    # Forgets the uploads under each uploads/<folder>/, whose folders are being discarded, in
+    # one statement however many there are (one range of the primary key per folder)
+    with db.connect() as conn:
+        paths = [row[0] for row in conn.execute('''DELETE FROM uploads WHERE path IN (
+                                                       SELECT uploads.path FROM json_each(?) AS folder INNER JOIN uploads
+                                                       ON uploads.path > folder.value || '/' AND uploads.path < folder.value || ?)
+                                                   RETURNING path''', (json.dumps(folders), '/\uffff')).fetchall()]
+    if paths:
+        uploads_cache.invalidate(*paths)
+
+# Seconds the upload backfill holds its lease for, renewed with every upload it registers
+REGISTER_UPLOADS_LEASE = 300
+
+def register_uploads():
+    # Records uploads published before the uploads table existed, versioned by their content,
+    # and makes the renditions of those published before renditions existed. Only the process
+    # holding the 'register_uploads' lease does it; the others leave it to that one.
+    if not db.hold_lease('register_uploads', worker_id, REGISTER_UPLOADS_LEASE):
+        return
+    try:
+        with db.connect() as conn:
+            known = {row[0]: row[1:] for row in conn.execute('SELECT path, version, widths, undecodable FROM uploads')}
+        for base_dir in ('u', 'g', 'p'):
+            folder = os.path.join('uploads', base_dir)
+            for name in os.listdir(folder) if os.path.isdir(folder) else ():
+                if name.startswith(deletion.Janitor.PREFIX) or not os.path.isdir(os.path.join(folder, name)):
+                    continue
+                for filename in os.listdir(os.path.join(folder, name)):
+                    path = f'{base_dir}/{name}/{filename}'
+                    if not filename.endswith('.jpg'):
+                        continue
+                    if path in known and (known[path][1] or known[path][2] or not imaging.FORMATS):
+                        continue
+                    if not db.hold_lease('register_uploads', worker_id, REGISTER_UPLOADS_LEASE):
+                        return
+                    try:
+                        register_upload(path, os.path.join(folder, name, filename), known.get(path, (None,))[0])
+                    except (OSError, sqlite3.Error):
+                        log.exception('Could not register upload %s', path)
+    finally:
+        db.drop_lease('register_uploads', worker_id)
+
+def register_upload(path, file_path, version):
+    # Makes the renditions of the upload at uploads/<path> and records them, or records that it
+    # cannot be decoded, unless the upload was replaced since `version` (None for one not
+    # recorded yet) was read
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    key = contentcache.digest(data)
+    if version not in (None, key[:16]):
+        return
+    what = upload_kind(os.path.basename(file_path))
+    image = imaging.decode(data, what, {'jpeg'})
+    files = imaging.renditions(image, what) if image else {}
+    publish_files(file_path[:-len('.jpg')], files)
+    widths, formats = imaging.published(files)
+    with db.connect() as conn:
+        conn.execute('''INSERT INTO uploads (path, version, widths, formats, undecodable) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (path) DO UPDATE SET widths = excluded.widths, formats = excluded.formats,
+                                                         undecodable = excluded.undecodable
+                        WHERE uploads.version = excluded.version''',
+                     (path, key[:16], ' '.join(map(str, widths)), ' '.join(formats), image is None))
+    uploads_cache.invalidate(path)
+
+def user_room(login):
+    # Socket.IO room of every connection of a signed in user (see socket_connect)
+    return f'u/{login.lower()}'
+
+def notify(login, event, data):
+    # Sends an event to the user's open pages only. Broadcasting would cost one send per
+    # connected client for every event (see benchmarks/fanout.py).
+    socketio.emit(event, data, to=user_room(login))
+
+def job_event(job_id, login, state, result=None):
+    # Tells the uploader's wait page how the job is going: 'queued', 'running', 'retrying',
+    # then 'done' or 'failed' with the status to act on
+    notify(login, 'job', {'job': job_id, 'state': state, 'result': result})
+
+def upload_done(job_id, login, status):
+    if jobs.finish(job_id, worker_id, status):
+        job_event(job_id, login, 'failed' if status['error'] else 'done', status)
+
+def img_SAVE(key, image, what, file_path, filename):
+    # Encodes a converted upload judged safe with all its renditions, keeps them in the content
+    # cache and publishes each file with one rename, the JPEG last
+    target = os.path.join('uploads', file_path, filename[:-len('.jpg')])
+    files = imaging.encode(image, what)
+    upload_cache.put(key, False, what, files)
+    suffixes = upload_cache.copy_to(key, what, target)
+    if suffixes is None:
+        publish_files(target, files)
+        suffixes = files
+    upload_published(upload_path(file_path, filename), key, suffixes)
+
+def publish_files(target, files):
+    # Writes each file as `target` + its suffix with one rename, the JPEG last
+    for suffix, data in sorted(files.items(), key=lambda file: file[0] == '.jpg'):
+        contentcache.write_file(target + suffix, data)
+
+def img_RESULT(job_id, prediction):
+    # Called from the moderation pool's collector thread once the job's upload is classified
+    job_wakeup.set()
+    upload = running_jobs.pop(job_id, None)
+    if upload is None:
+        return
+    login, key, what, file_path, filename, redirect, image = upload
+    if prediction is None:
+        # Crashed or timed out worker
+        retry_job(job_id, login, redirect)
+        return
+    if not moderation.is_nsfw(prediction):
+        img_SAVE(key, image, what, file_path, filename)
+        status = {"error": False, "redirect": redirect}
+    else:
+        upload_cache.put(key, True)
+        status = {"error": True, "reason": "NSFW", "redirect": redirect}
+    upload_done(job_id, login, status)
+
+def upload_kind(filename):
+    return 'ava' if filename == 'ava.jpg' else 'banner' if filename == 'banner.jpg' else 'post'
+
+moderation_pool = moderation.ModerationPool(MODEL_PATH, img_RESULT, app.config['MODERATION_WORKERS'],
+                                            app.config['MODERATION_BATCH_SIZE'], app.config['MODERATION_BATCH_WAIT'],
+                                            app.config['MODERATION_QUEUE_SIZE'],
+                                            start_method=app.config['MODERATION_START_METHOD'])
+upload_cache = contentcache.ContentCache(os.path.join('cache', 'uploads'), app.config['UPLOAD_CACHE_MAX_MB'] * 1024 * 1024)
+
+def img_PROCESS(login,file,file_path,filename,redirect):
+    # Takes an upload in and returns the id of its moderation job, which the wait page follows.
+    # Content with a verdict already is answered at once; the rest is queued for jobs_THREAD.
+    if file and '.' in secure_filename(file.filename) and secure_filename(file.filename).rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS:
+        data = file.stream.read()
+        key = contentcache.digest(data)
+        filename='.'.join(filename.split('.')[:-1])+'.jpg'
+        what = upload_kind(filename)
+        # Content seen before already has a verdict, and maybe this very conversion
+        cached = upload_cache.get(key, what)
+        if cached is not None:
+            nsfw, converted = cached
+            if nsfw:
+                return jobs.record(login, redirect, {"error": True, "reason": "NSFW", "redirect": redirect})
+            suffixes = None
+            if converted:
+                suffixes = upload_cache.copy_to(key, what, os.path.join('uploads', file_path, filename[:-len('.jpg')]))
+            if suffixes is not None:
+                upload_published(upload_path(file_path, filename), key, suffixes)
+            else:
+                image = imaging.decode(data, what, ALLOWED_EXTENSIONS)
+                if image is None:
+                    return jobs.record(login, redirect, {"error": True, "reason": "BADFILE", "redirect": redirect})
+                img_SAVE(key, imaging.convert(image, what), what, file_path, filename)
+            return jobs.record(login, redirect, {"error": False, "redirect": redirect})
+        job_id = jobs.create(login, key, what, file_path, filename, redirect, data, app.config['MODERATION_USER_JOBS'])
+        if job_id is None:
+            return jobs.record(login, redirect, {"error": True, "reason": "LIMIT", "redirect": redirect})
+        job_wakeup.set()
+        return job_id
+    return jobs.record(login, redirect, {"error": True, "reason": "BADFILE", "redirect": redirect})
+
+def retry_job(job_id, login, redirect):
+    # Queues a job whose attempt failed again, after MODERATION_JOB_RETRY_DELAY doubled for
+    # every earlier attempt, or fails it once MODERATION_JOB_ATTEMPTS are used up
+    status = {"error": True, "reason": "BADFILE", "redirect": redirect}
+    state = jobs.retry(job_id, worker_id, app.config['MODERATION_JOB_ATTEMPTS'], status,
+                       app.config['MODERATION_JOB_RETRY_DELAY'])
+    if state == 'queued':
+        job_event(job_id, login, 'retrying')
+    elif state == 'failed':
+        job_event(job_id, login, state, status)
+
+def run_job(job):
+    # Prepares a claimed job and hands it to the moderation pool; False if the pool had no
+    # room after all and the job went back to the queue
+    job_id, login, attempts, key, what, file_path, filename, redirect, data = job
+    job_event(job_id, login, 'running')
+    image = imaging.decode(data, what, ALLOWED_EXTENSIONS)
+    if image is None:
+        upload_done(job_id, login, {"error": True, "reason": "BADFILE", "redirect": redirect})
+        return True
+    # Take both the model input and the converted image from this decode now, so only the
+    # small converted copy is held while the upload waits for its verdict
+    pixels = moderation.model_input(image)
+    running_jobs[job_id] = (login, key, what, file_path, filename, redirect, imaging.convert(image, what))
+    if not moderation_pool.submit(job_id, pixels):
+        running_jobs.pop(job_id, None)
+        jobs.release(job_id, worker_id)
+        job_event(job_id, login, 'queued')
+        return False
+    return True
+
+def jobs_THREAD():
+    # Feeds the moderation pool from the job table whenever it has room: uploads queued by any
+    # process, and the jobs of a process that stopped or crashed once their lease runs out.
+    # A lease outlives the pool's own timeout, so a live process answers its jobs first.
+    # Nothing stops the thread: a job whose attempt raised is retried later (see retry_job), and
+    # one that could not even be put back is claimed again once its lease runs out.
+    lease = 2 * moderation_pool.job_timeout
+    purged = 0
+    while True:
+        job_wakeup.clear()
+        job = None
+        try:
+            if time.monotonic() - purged > 3600:
+                jobs.purge(JOB_RETENTION)
+                purged = time.monotonic()
+            if moderation_pool.has_room():
+                job = jobs.claim(worker_id, lease, app.config['MODERATION_JOB_ATTEMPTS'])
+            if job is not None and run_job(job):
+                continue
+        except Exception:
+            if job is None:
+                log.exception('Claiming a moderation job failed')
+            else:
+                log.exception('Moderation job %s failed', job[0])
+                running_jobs.pop(job[0], None)
+                try:
+                    retry_job(job[0], job[1], job[7])
+                except Exception:
+                    log.exception('Moderation job %s could not be put back, it waits for its lease to run out', job[0])
+        job_wakeup.wait(JOB_POLL_INTERVAL)
+
+def date_format(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%d.%m.%y')
+
+def rating_count(post):
+    rating_post = post['rating'] if type(post) == dict else post
+    new_format = rating_post
+    if 1_000 <= abs(rating_post) < 1_000_000:
+        new_format = str(round(rating_post / 1_000, 1)) + 'k'
+    elif 1_000_000 <= abs(rating_post) < 1_000_000_000:
+        new_format = str(round(rating_post / 1_000_000, 1)) + 'm'
+    elif 1_000_000_000 <= abs(rating_post):
+        new_format = str(round(rating_post / 1_000_000_000, 1)) + 'b'
+    if type(post) == dict:
+        post['rating'] = new_format
+        return post
+    else:
+        return new_format
+
+PAGE_SIZE = 5
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token, length):
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if type(values) != list or len(values) != length or not all(type(value) in (int, float, str) for value in values):
+        return None
+    return values
+
+def keyset_page(cursor, sql, conditions, params, keys, key_columns, after='', before='', descending=True):
+    # Seeks straight to the requested page with a (key...) row value comparison instead of OFFSET,
+    # so page N costs the same as page 1. Fetches one extra row to know if there is another page.
+    backwards = False
+    bound = decode_cursor(after, len(keys))
+    if bound is None:
+        bound = decode_cursor(before, len(keys))
+        backwards = bound is not None
+    conditions = list(conditions)
+    params = list(params)
+    if bound is not None:
+        conditions.append(f"({', '.join(keys)}) {'<' if descending != backwards else '>'} ({', '.join('?' for _ in keys)})")
+        params += bound
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)
+    sql += ' ORDER BY ' + ', '.join(f"{key} {'DESC' if descending != backwards else 'ASC'}" for key in keys)
+    sql += f' LIMIT {PAGE_SIZE + 1}'
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+    has_prev = more if backwards else bound is not None
+    has_next = True if backwards else more
+    prev_page = encode_cursor([rows[0][i] for i in key_columns]) if rows and has_prev else ''
+    next_page = encode_cursor([rows[-1][i] for i in key_columns]) if rows and has_next else ''
+    return rows, prev_page, next_page
+
+def user_votes(what, ids):
+    # Current user's vote on each of the listed posts/comments: 'like', 'dislike', or absent if none
+    if not ids or current_user.id == 1:
+        return {}
+    table, column = ('likes_dislikes_posts', 'post_id') if what == 'post' else ('likes_dislikes_comments', 'comment_id')
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''SELECT {column}, likeorno
+                          FROM {table}
+                          WHERE user_id = ?
+                            AND {column} IN ({', '.join('?' for _ in ids)})''', [current_user.id] + list(ids))
+        return {row[0]: 'like' if row[1] else 'dislike' for row in cursor.fetchall()}
+
+subscriptions_cache = cache.Cache('subscriptions', 10000, 300, shared=True)
+# Shared, as delete permissions are checked against it (see group_moderators)
+roles_cache = cache.Cache('roles', 10000, 300, shared=True)
+# path under uploads/ -> (version, rendition widths, rendition formats) of the published upload (see published_upload)
+uploads_cache = cache.Cache('uploads', 100000, 3600, shared=True)
+fragments = cache.FragmentCache(app.config['FRAGMENT_CACHE_MAX_MB'] * 1024 * 1024)
+
+def render_fragment(kind, id, version, caller):
+    # {% call fragment(kind, id, version) %} in templates: the block's HTML for item `id`,
+    # rendered only when `version` (everything the block shows) differs from the cached one
+    return Markup(fragments.get((kind, id), version, lambda: str(caller())))
+
+def remove_post(post_id):
+    # Deletes the post with its votes and comments in one transaction; its folder goes to the
+    # janitor. False if there was no such post.
+    if not deletion.delete_post(post_id):
+        return False
+    posts_removed([post_id])
+    janitor.discard(safe_folder_path(str(post_id), 'p'))
+    return True
+
+def posts_removed(post_ids, *folders):
+    # Drops what is cached of deleted posts, and the upload versions of their folders and of
+    # any other discarded `folders`, with one invalidation of each cache for all of them
+    fragments.invalidate(*[(kind, int(post_id)) for post_id in post_ids for kind in ('post-g', 'post-u')])
+    uploads_removed(*[f'p/{int(post_id)}' for post_id in post_ids], *folders)
+    page_cache.invalidate()
+
+# Pages every logged out visitor (the Anonymous user) sees identically: the feeds, groups, posts
+PAGE_CACHE_ENDPOINTS = {'index', 'groups', 'posts'}
+page_cache = cache.PageCache('pages', 1000, app.config['PAGE_CACHE_TTL'], app.config['PAGE_CACHE_STALE'])
+
+def page_cache_key():
+    if app.config['PAGE_CACHE_TTL'] <= 0 or request.method != 'GET' or request.endpoint not in PAGE_CACHE_ENDPOINTS:
+        return None
+    if not (current_user.is_anonymous or current_user.id == 1):
+        return None
+    return request.full_path
+
+@app.teardown_appcontext
+def release_db(exception):
+    # The connection the request (or Socket.IO event) used goes back to the pool
+    db.release()
+
+def browse_as_guest():
+    # Logged out visitors browse as the Anonymous user (id 1). A page cached for every logged
+    # out visitor (see page_cache_key) is rendered as that user for this request only, without
+    # signing the visitor in: the response must not set a session cookie that a shared cache
+    # would then hand to everyone.
+    if page_cache_key() is None:
+        login_user(load_user(1))
+    else:
+        g._login_user = load_user(1)  # what current_user reads, as login_user sets it
+
+@app.before_request
+def serve_cached_page():
+    key = page_cache_key()
+    if key is None:
+        return None
+    page_cache.sync()
+    g.page_generation = page_cache.generation
+    page, state = page_cache.get(key)
+    if page is None:
+        return None
+    if state == 'stale' and page_cache.claim_refresh(key):
+        socketio.start_background_task(refresh_page, key)
+    g.page_cached = True
+    return app.response_class(page[0], mimetype=page[1])
+
+@app.after_request
+def store_cached_page(response):
+    # Also tells browsers and proxies how long the page may be reused; Vary: Cookie keeps the
+    # pages of logged in users out of shared caches. A response setting a cookie (the session
+    # saved after this hook included) is the visitor's own and is neither stored nor shared.
+    key = page_cache_key()
+    if key is None or response.status_code != 200 or 'page_generation' not in g:
+        return response
+    if session.modified or 'Set-Cookie' in response.headers:
+        return response
+    if not g.get('page_cached'):
+        page_cache.put(key, (response.get_data(), response.mimetype), g.page_generation)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = int(app.config['PAGE_CACHE_TTL'])
+    response.headers['Cache-Control'] += f", stale-while-revalidate={int(app.config['PAGE_CACHE_STALE'])}"
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def refresh_page(key):
+    # Renders a stale page again in the background, as a logged out visitor: the page's view
+    # is called directly, in a request context of its own
+    try:
+        with app.test_request_context(key):
+            generation = page_cache.generation
+            response = app.make_response(app.view_functions[request.endpoint](**request.view_args))
+            if response.status_code == 200:
+                page_cache.put(key, (response.get_data(), response.mimetype), generation)
+    except Exception:
+        log.exception('Refreshing cached page %s failed', key)
+    finally:
+        page_cache.refreshed(key)
+
+# Logins and group names for search completion (see search_complete), filled by create_app()
+user_names = typeahead.PrefixIndex()
+group_names = typeahead.PrefixIndex()
+COMPLETIONS = 8
+
+def load_names():
+    with db.connect() as conn:
+        user_names.build(row[0] for row in conn.execute("SELECT login FROM users WHERE login <> 'Anonymous'"))
+        group_names.build(row[0] for row in conn.execute('SELECT group_name FROM groups'))
+
+def completions(prefix):
+    prefix = prefix.strip()
+    return {'users': user_names.complete(prefix, COMPLETIONS), 'groups': group_names.complete(prefix, COMPLETIONS)}
+
+def load_subscriptions(user_id):
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT group_name
+                          FROM subscriptions
+                                   INNER JOIN groups ON subscriptions.group_id = groups.id
+                          WHERE user_id = ?''', (user_id,))
+        return tuple(sorted({row[0] for row in cursor.fetchall()}))
+
+def user_subscriptions(user_id):
+    return subscriptions_cache.get(user_id, load_subscriptions)
+
+def load_roles(group):
+    roles = {'creat': [], 'moder': [], 'user': []}
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT role, login
+                          FROM subscriptions
+                                   INNER JOIN users ON subscriptions.user_id = users.id
+                          WHERE group_id = (SELECT id FROM groups WHERE group_name = ?)
+                          ORDER BY user_id''', (group,))
+        for row in cursor.fetchall():
+            roles.setdefault(row[0].lower(), []).append(row[1])
+    return {role: tuple(logins) for role, logins in roles.items()}
+
+def group_roles(group):
+    return roles_cache.get(group.lower(), load_roles)
+
+def group_moderators(group):
+    roles = group_roles(group)
+    return {login.lower() for login in roles['creat'] + roles['moder']}
+
+class User(UserMixin):
+    def __init__(self, id_, login, email, password_hash):
+        self.id = id_
+        self.login = login
+        self.email = email
+        self.password_hash = password_hash
+
+    @staticmethod
+    def get(user_id):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+            if row:
+                return User(*row)
+            return None
+
+    @staticmethod
+    def find_by_login(login):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE login = ?", (login,))
+            row = cursor.fetchone()
+            if row:
+                return User(*row)
+            return None
+
+    @staticmethod
+    def find_by_email(email):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+            row = cursor.fetchone()
+            if row:
+                return User(*row)
+            return None
+
+    def check_password(self, password):
+        try:
+            ph.verify(self.password_hash, password)
+            return True
+        except (InvalidHashError, VerifyMismatchError, VerificationError) as _:
+            return False
+
+    @classmethod
+    def create(cls, login, email, password_hash):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO users (login, email, password) VALUES (?, ?, ?)",
+                               (login, email, password_hash))
+            except sqlite3.IntegrityError:
+                return None
+            conn.commit()
+        user_names.add(login)
+        return cls.find_by_login(login)
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    return User.get(user_id)
+
+@socketio.on('connect')
+def socket_connect():
+    # Signed in users get a room of their own for notify(); the shared guest account does not
+    if current_user.is_authenticated and current_user.id!=1:
+        join_room(user_room(current_user.login))
+
+@socketio.on('job_status')
+def socket_job_status(job_id):
+    # State of one of the user's moderation jobs, as the event's ack. The wait page asks on
+    # connect (the job may have finished before) and then every few seconds, which also covers
+    # events emitted by another worker process when there is no SOCKETIO_MESSAGE_QUEUE.
+    if current_user.is_authenticated and str(job_id).isnumeric():
+        job = jobs.status(int(job_id))
+        if job and job.pop('login').lower() == current_user.login.lower():
+            return job
+    return None
+
+@socketio.on('change_rating_com')
+def change_rating(data):
+    sid = request.sid
+    if current_user.is_authenticated and current_user.id!=1:
+        commentId = data.get('commentId', 0)
+        if commentId and commentId.isnumeric():
+            commentId = int(commentId)
+        else:
+            commentId = 0
+        what = data.get('what', 0)
+        clickedElementId = data.get('clickedElementId', None)
+        commentrating = None
+        if commentId and what and clickedElementId:
+            new_rating = cast_vote('comment', commentId, clickedElementId, what)
+            if new_rating is not None:
+                commentrating = rating_count(new_rating)
+        if commentrating is not None:
+            socketio.emit(f'scs_change_rating_com',
+                          {"commentId": commentId, "new_rating": commentrating, "what": what, "clickedElementId": clickedElementId}, to=sid)
+    else:
+        None
+
+@socketio.on('change_rating')
+def change_rating(data):
+    sid=request.sid
+    if current_user.is_authenticated and current_user.id!=1:
+        postId = data.get('postId', 0)
+        if postId and postId.isnumeric():
+            postId = int(postId)
+        else:
+            postId = 0
+        what = data.get('what', 0)
+        clickedElementId = data.get('clickedElementId', None)
+        postrating = None
+        if postId and what and clickedElementId:
+            new_rating = cast_vote('post', postId, clickedElementId, what)
+            if new_rating is not None:
+                postrating = rating_count(new_rating)
+        if postrating is not None:
+            socketio.emit(f'scs_change_rating',
+                          {"postId": postId, "new_rating": postrating, "what": what, "clickedElementId": clickedElementId}, to=sid)
+    else:
+        None
+
+@app.route('/p/',methods=['GET'])
+def empty_post():
+    return redirect('/?filter=popular')
+
+@app.route('/u/',methods=['GET','POST'])
+def auth():
+    if current_user.is_anonymous:
+        login_user(load_user(1))
+    what = request.args.get('w', 'signin').lower()
+    what = 'signin' if what not in ['signin','signup'] else what
+    if request.method == 'GET':
+        subs = {}
+        try:
+            subs = user_subscriptions(current_user.id)
+        except:
+            None
+        error_msg = session.pop('error_msg', '')
+        return render_template('auth.html', what=what, error=error_msg, login=current_user.login, subs=subs)
+    elif request.method == 'POST':
+        login = re.sub(r"\s+", '_', request.form.get('login', ''))
+        email = request.form.get('email', '')
+        password = request.form.get('password', '')
+        if 0<len(login)<=30 and len(password)>0 and login.lower()!='anonymous' and (len(password)>=8 and re.match(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&_-])(?=\S+$).{8,}$",password) is not None):
+            if what=='signup' and 0<len(email)<=89 and re.match(r'^[a-zA-Z0-9_-]+$',login) is not None and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None:
+                if 'avatar' in request.files:
+                    ava = request.files['avatar']
+                if is_safe_folder(login, 'u', 'create'):
+                    user = User.create(login, email, ph.hash(password))
+                    if user:
+                        login_user(user)
+                        if 'avatar' in request.files and ava.filename != '':
+                            session['wait'] = img_PROCESS(user.login.lower(), ava, os.path.join('u', user.login.lower()),'ava.jpg', f'/u/{user.login}')
+                            return redirect('/loading')
+                        return redirect(f'/u/{user.login}')
+                    else:
+                        session['error_msg']='already'
+                        return redirect(url_for('auth',w=what))
+                session['error_msg'] = 'login'
+                return redirect(url_for('auth',w=what))
+            elif what=='signin':
+                if re.match(r'^[a-zA-Z0-9_-]+$', login) is not None:
+                    user = User.find_by_login(login)
+                elif re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', login) is not None:
+                    user = User.find_by_email(login)
+                else:
+                    session['error_msg']='login'
+                    return redirect(url_for('auth',w=what))
+                if user:
+                    if user.check_password(password):
+                        login_user(user)
+                        return redirect(f'/u/{user.login}')
+                    else:
+                        session['error_msg']='pass'
+                        return redirect(url_for('auth',w=what))
+                else:
+                    session['error_msg'] = 'who'
+                    return redirect(url_for('auth',w=what))
+            else:
+                session['error_msg']='email'
+                return redirect(url_for('auth',w=what))
+        else:
+            session['error_msg'] = 'both'
+            return redirect(url_for('auth',w=what))
+
+@app.route('/g/',methods=['GET','POST'])
+def new_group():
+    if current_user.is_anonymous:
+        login_user(load_user(1))
+        return redirect('/u/')
+    if current_user.id==1:
+        return redirect('/u/')
+    if request.method == 'GET':
+        subs = {}
+        try:
+            subs = user_subscriptions(current_user.id)
+        except:
+            None
+        error_msg = session.pop('error_msg', '')
+        return render_template('new_group.html', error=error_msg, login=current_user.login, subs=subs)
+    elif request.method == 'POST':
+        group_name = request.form.get('group_name','')
+        gava = request.files['gava']
+        if group_name and 0<len(group_name)<20 and re.match(r'^[a-zA-Z0-9_-]+$', group_name) is not None:
+            if is_safe_folder(group_name, 'g', 'create'):
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute("INSERT INTO groups (group_name) VALUES (?)",
+                                       (group_name,))
+                    except sqlite3.IntegrityError:
+                        session['error_msg'] = 'already'
+                        return redirect('/g/')
+                    conn.commit()
+                group_names.add(group_name)
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT id FROM groups WHERE group_name = ?", (group_name,))
+                    row = cursor.fetchone()
+                    group_id = row[0]
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("INSERT INTO subscriptions (user_id,group_id,role) VALUES (?,?,'creat')",
+                                       (current_user.id,group_id))
+                    conn.commit()
+                subscriptions_cache.invalidate(current_user.id)
+                roles_cache.invalidate(group_name.lower())
+                if gava.filename != '':
+                    session['wait'] = img_PROCESS(current_user.login.lower(),gava,os.path.join('g', group_name.lower()),'ava.jpg',f'/g/{group_name}')
+                    return redirect('/loading')
+                return redirect(f'/g/{group_name}')
+            else:
+                session['error_msg'] = 'name'
+                return redirect('/g/')
+        else:
+            session['error_msg'] = 'name'
+            return redirect('/g/')
+
+@app.route('/p/<post>',methods=['GET','POST'])
+def posts(post):
+    if current_user.is_anonymous:
+        browse_as_guest()
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+    subs = user_subscriptions(current_user.id)
+    if post.isnumeric():
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT posts.id,
+                                     group_name,
+                                     u.login,
+                                     upload_date,
+                                     title, desc, attach_img, rating, posts.likes, posts.dislikes, uploader_group_id
+                              FROM posts INNER JOIN main.groups g
+                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id
+                              WHERE posts.id = ?''', (post,))
+            row = cursor.fetchone()
+            if row is None:
+                return redirect(url_for('error', e=404))
+            who_rem_in_this_post = group_moderators(row[1])
+            singular_post=rating_count({'id': row[0], 'g': row[1], 'g_id': row[10], 'u': row[2], 'upload_date': date_format(row[3]), 'title': row[4],
+                               'desc': row[5],
+                               'attach_img': row[6], 'rating': row[7],
+                               'likes': row[8], 'dislikes': row[9],
+                               'vote': user_votes('post', [row[0]]).get(row[0]),
+                               'who_rem': who_rem_in_this_post | {row[2].lower()}})
+    else:
+        return redirect(url_for('error', e=404))
+    #Select comments
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        rows, prev_page, next_page = keyset_page(cursor, '''SELECT comments.id, desc, upload_date, u.login, post_id, rating, comments.likes, comments.dislikes,
+                                  comments.popularity_score, ''' + published_upload_sql("'u/' || lower(u.login) || '/ava.jpg'") + '''
+                          FROM comments INNER JOIN users u
+                          ON comments.user_id = u.id''',
+                                                  ['comments.post_id = ?'], [post],
+                                                  ('comments.popularity_score', 'comments.id'), (8, 0), after, before)
+        my_votes = user_votes('comment', [row[0] for row in rows])
+        temp_comments = {row[0]:
+                             {'id': row[0], 'desc': row[1], 'upload_date': date_format(row[2]), 'u': row[3],
+                              'rating': row[5], 'likes': row[6], 'ava_upload': published_columns(row[9]),
+                 'dislikes': row[7], 'vote': my_votes.get(row[0]), 'who_rem': who_rem_in_this_post | {row[3].lower()}} for
+                         row in rows}
+        comments = {id: rating_count(comment.copy()) for id, comment in temp_comments.items()}
+    #Select current user's role in current group
+    current_role = 'unknown'
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT role
+                          FROM subscriptions
+                          WHERE user_id = ?
+                            AND group_id = ?''', (current_user.id, singular_post['g_id']))
+        row = cursor.fetchone()
+        if row:
+            current_role = row[0]
+    if request.method == 'GET':
+        return render_template('posts.html', login=current_user.login, subs=subs, post=singular_post, comments=comments.values(), prev_page=prev_page, next_page=next_page)
+    elif request.method == 'POST':
+        if current_user.is_anonymous:
+            login_user(load_user(1))
+            return redirect('/u/')
+        if current_user.id == 1:
+            return redirect('/u/')
+        if 'comment' in request.form:
+            if current_user.id == 1:
+                return redirect('/u/')
+            if current_role=='unknown':
+                return redirect(f'/p/{post}')
+            pdesc=request.form.get('comment','')
+            if pdesc and len(pdesc)<=4096:
+                date_now=int(time.time())
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("INSERT INTO comments (desc,upload_date,user_id,post_id,rating) VALUES (?, ?, ?, ?, ?)",
+                                       (pdesc, date_now, current_user.id, post, 0))
+                    conn.commit()
+                page_cache.invalidate()
+            return redirect(f'/p/{post}')
+        elif 'postId' in request.form:
+            what_post = request.form.get('postId', 0)
+            if what_post and what_post.isnumeric() and singular_post["id"]==int(what_post) and current_user.login.lower() in singular_post['who_rem']:
+                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
+                if remove_post(int(what_post)):
+                    return redirect('/?filter=popular')
+                else:
+                    return "Post can't be deleted."
+            else:
+                return redirect('/?filter=popular')
+        elif 'commentId' in request.form:
+            what_comment = request.form.get('commentId', 0)
+            if what_comment and what_comment.isnumeric() and current_user.login.lower() in comments.get(int(what_comment),{"who_rem": {}})['who_rem']:
+                # Removes the comment with its likes/dislikes
+                deletion.delete_comment(int(what_comment))
+                fragments.invalidate(('comment', int(what_comment)))
+                page_cache.invalidate()
+            return redirect(f'/p/{post}')
+
+@app.route('/g/<group>',methods=['GET','POST'])
+def groups(group):
+    if current_user.is_anonymous:
+        browse_as_guest()
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+    subs = user_subscriptions(current_user.id)
+    current_group_id = None
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT id
+                          FROM groups
+                          WHERE group_name = ?''', (group,))
+        row = cursor.fetchone()
+        if row:
+            current_group_id = row[0]
+    if current_group_id is None:
+        return redirect(url_for('error', e=404))
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        rows, prev_page, next_page = keyset_page(cursor, '''SELECT posts.id,
+                                 group_name,
+                                 u.login,
+                                 upload_date,
+                                 title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                              posts.popularity_score''' + POST_UPLOADS + '''
+                          FROM posts INNER JOIN main.groups g
+                          on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id''',
+                                                 ['posts.uploader_group_id = ?'], [current_group_id],
+                                                 ('posts.popularity_score', 'posts.id'), (10, 0), after, before)
+        my_votes = user_votes('post', [row[0] for row in rows])
+        temp_posts = { row[0]:
+            {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': date_format(row[3]), 'title': row[4], 'desc': row[5],
+             'attach_img': row[6], 'rating': row[7], 'likes': row[8],
+             'dislikes': row[9], 'vote': my_votes.get(row[0]), 'who_rem': group_moderators(row[1]) | {row[2].lower()},
+             'uploads': post_uploads(row)} for row in rows}
+    posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
+    current_role='unknown'
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT role
+                                FROM subscriptions WHERE user_id=? AND group_id=?''', (current_user.id,current_group_id))
+        row = cursor.fetchone()
+        if row:
+            current_role=row[0]
+    roles = group_roles(group)
+    subscribers=rating_count(len(roles['creat']) + len(roles['moder']) + len(roles['user']))
+    if request.method == 'GET':
+        return render_template('groups.html', login=current_user.login, subs=subs, group=group, posts=posts.values(), role=current_role, subscribers=subscribers, usermods_users=set(roles['user']),usermods_mods=set(roles['moder']),prev_page=prev_page,next_page=next_page)
+    elif request.method == 'POST':
+        if current_user.is_anonymous:
+            login_user(load_user(1))
+            return redirect('/u/')
+        if current_user.id == 1:
+            return redirect('/u/')
+        if 'sub' in request.form:
+            if current_role=='unknown':
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute("INSERT INTO subscriptions (user_id, group_id, role) VALUES (?, ?, 'user')",
+                                       (current_user.id, current_group_id))
+                    except sqlite3.IntegrityError:
+                        return redirect(url_for('error'))
+                    conn.commit()
+                subscriptions_cache.invalidate(current_user.id)
+                roles_cache.invalidate(group.lower())
+            elif current_role=='user' or current_role=='moder':
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''DELETE
+                                      FROM subscriptions
+                                      WHERE user_id = ?
+                                        and group_id = ?;''', (current_user.id, current_group_id))
+                    conn.commit()
+                subscriptions_cache.invalidate(current_user.id)
+                roles_cache.invalidate(group.lower())
+            elif current_role=='creat':
+                #Risky. Will delete everything regarding that group. Including info about likes, dislikes, comments, post, subscribers and group itself.
+                if is_safe_folder(group.lower(),'g','safe'):
+                    post_ids, subscribers_to_remove = deletion.delete_group(current_group_id)
+                    janitor.discard(safe_folder_path(group.lower(), 'g'))
+                    for post_id in post_ids:
+                        janitor.discard(safe_folder_path(str(post_id), 'p'))
+                    posts_removed(post_ids, f'g/{group.lower()}')
+                    subscriptions_cache.invalidate(*subscribers_to_remove)
+                    roles_cache.invalidate(group.lower())
+                    group_names.remove(group)
+                    return redirect('/?filter=popular')
+                else:
+                    return "Group can't be deleted."
+
+            return redirect(f'/g/{group}')
+        elif 'title' in request.form and 'desc' in request.form and 'attach' in request.files:
+            if current_user.id == 1:
+                return redirect('/u/')
+            if current_role=='unknown':
+                return redirect(f'/g/{group}')
+            gtitle=request.form.get('title','')
+            gdesc=request.form.get('desc','')
+            gattach=request.files['attach']
+            gattach_filename=secure_filename(gattach.filename)
+            if gtitle and 0<len(gtitle)<=100 and len(gdesc)<=4096:
+                date_now=int(time.time())
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("INSERT INTO posts (uploader_group_id,uploader_user_id,upload_date,title,desc,attach_img,rating) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       (current_group_id, current_user.id, date_now, gtitle, gdesc, gattach_filename[::-1].split('.',1)[1][::-1]+'.jpg' if gattach_filename else 'None', 0))
+                    conn.commit()
+                    page_cache.invalidate()
+                    cursor.execute("SELECT id FROM posts WHERE uploader_group_id=? AND uploader_user_id=? AND upload_date=? AND title=? AND desc=? AND attach_img=? AND rating=? ORDER BY id DESC LIMIT 1",
+                                   (current_group_id, current_user.id, date_now, gtitle, gdesc, gattach_filename[::-1].split('.',1)[1][::-1]+'.jpg' if gattach_filename else 'None', 0))
+                    row = cursor.fetchone()
+                    if row:
+                        post_id=row[0]
+                    else:
+                        return redirect(f'/g/{group}')
+                if is_safe_folder(str(post_id),'p','create'):
+                    if gattach_filename:
+                        session['wait'] = img_PROCESS(current_user.login.lower(), gattach, os.path.join('p', str(post_id)), gattach_filename, f'/p/{post_id}')
+                        return redirect('/loading')
+                    return redirect(f'/p/{post_id}')
+                else:
+                    return redirect(f'/g/{group}')
+            else:
+                return redirect(f'/g/{group}')
+        elif 'postId' in request.form:
+            what_post = request.form.get('postId', 0)
+            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
+                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
+                if remove_post(int(what_post)):
+                    return redirect(f'/g/{group}')
+                else:
+                    return "Post can't be deleted."
+            else:
+                return redirect(f'/g/{group}')
+        elif 'banner' in request.files:
+            if current_role == 'moder' or current_role == 'creat':
+                file = request.files['banner']
+                if file.filename == '':
+                    return redirect(f'/g/{group}')
+                session['wait'] = img_PROCESS(current_user.login.lower(), file, os.path.join('g', group.lower()), 'banner.jpg',f'/g/{group}')
+                return redirect('/loading')
+            else:
+                return redirect(f'/g/{group}')
+        elif 'avatar' in request.files:
+            if current_role == 'moder' or current_role == 'creat':
+                file = request.files['avatar']
+                if file.filename == '':
+                    return redirect(f'/g/{group}')
+                session['wait'] = img_PROCESS(current_user.login.lower(), file, os.path.join('g', group.lower()), 'ava.jpg',f'/g/{group}')
+                return redirect('/loading')
+            else:
+                return redirect(f'/g/{group}')
+        elif 'usermod' in request.form:
+            if current_role == 'creat':
+                new_mods=set(request.form.getlist('usermods'))
+                new_mods={mod.lower() for mod in new_mods}
+                actual_mods = list(new_mods - {mod.lower() for mod in roles['moder']})
+                turn_to_users = list({mod.lower() for mod in roles['moder']} - new_mods)
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        f"UPDATE subscriptions set role='moder' WHERE group_id IN (SELECT id FROM groups WHERE groups.group_name=?) AND role NOT IN ('moder','creat') AND user_id IN (SELECT id FROM users WHERE users.login IN ({', '.join('?' for _ in actual_mods)}))",
+                        [group] + actual_mods)
+                    conn.commit()
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        f"UPDATE subscriptions set role='user' WHERE group_id IN (SELECT id FROM groups WHERE groups.group_name=?) AND role NOT IN ('user','creat') AND user_id IN (SELECT id FROM users WHERE users.login IN ({', '.join('?' for _ in turn_to_users)}))",
+                        [group] + turn_to_users)
+                    conn.commit()
+                roles_cache.invalidate(group.lower())
+            return redirect(f'/g/{group}')
+
+@app.route('/u/<login>', methods=['GET','POST'])
+def profile(login):
+    if current_user.is_anonymous:
+        login_user(load_user(1))
+    if current_user.id==1 and login.lower()=='anonymous':
+        return redirect('/u/')
+
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+    subs = user_subscriptions(current_user.id)
+    with db.connect() as conn:
+        profile_user = conn.execute('SELECT id FROM users WHERE login = ? AND id <> 1', (login,)).fetchone()
+    if profile_user is None:
+        return redirect(url_for('error', e=404))
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        rows, prev_page, next_page = keyset_page(cursor, '''SELECT posts.id,
+                                 group_name,
+                                 u.login,
+                                 upload_date,
+                                 title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                              posts.popularity_score''' + POST_UPLOADS + '''
+                          FROM posts INNER JOIN main.groups g
+                          on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id''',
+                                                 ['posts.uploader_user_id = ?'], [profile_user[0]],
+                                                 ('posts.popularity_score', 'posts.id'), (10, 0), after, before)
+        my_votes = user_votes('post', [row[0] for row in rows])
+        temp_posts = { row[0]:
+            {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': date_format(row[3]), 'title': row[4], 'desc': row[5],
+             'attach_img': row[6], 'rating': row[7], 'likes': row[8],
+             'dislikes': row[9], 'vote': my_votes.get(row[0]), 'who_rem': group_moderators(row[1]) | {row[2].lower()},
+             'uploads': post_uploads(row)} for row in rows}
+    posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
+    if request.method == 'GET':
+        error_msg = session.pop('error_msg','')
+        return render_template('profile.html', clogin=current_user.login, cemail=current_user.email, login=login, subs=subs, posts=posts.values(), error=error_msg, prev_page=prev_page, next_page=next_page)
+    elif request.method == 'POST':
+        if current_user.is_anonymous:
+            login_user(load_user(1))
+            return redirect('/u/')
+        if current_user.id == 1:
+            return redirect('/u/')
+        if 'email' in request.form:
+            email=request.form.get('email','')
+            new_pass=request.form.get('password','')
+            if new_pass:
+                if email and new_pass and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$',email) is not None and (len(new_pass)>=8 and re.match(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&_-])(?=\S+$).{8,}$",new_pass)):
+                    if current_user.id==1:
+                        return redirect('/u/')
+                    if not current_user.check_password(new_pass) and current_user.email!=email:
+                        with db.connect() as conn:
+                            cursor = conn.cursor()
+                            try:
+                                cursor.execute('''UPDATE users
+                                                  SET email = ?, password = ?
+                                                  WHERE id = ?;''', (email, ph.hash(new_pass),current_user.id))
+                            except sqlite3.IntegrityError:
+                                session['error_msg'] = 'both'
+                                return redirect(f'/u/{login}')
+                            conn.commit()
+                            login_user(load_user(current_user.id))
+                            return redirect(f'/u/{login}')
+                    elif current_user.email!=email:
+                        with db.connect() as conn:
+                            cursor = conn.cursor()
+                            try:
+                                cursor.execute('''UPDATE users
+                                                  SET email = ?
+                                                  WHERE id = ?;''', (email,current_user.id))
+                            except sqlite3.IntegrityError:
+                                session['error_msg'] = 'email'
+                                return redirect(f'/u/{login}')
+
+                            conn.commit()
+                            login_user(load_user(current_user.id))
+                            return redirect(f'/u/{login}')
+                    elif not current_user.check_password(new_pass):
+                        with db.connect() as conn:
+                            cursor = conn.cursor()
+                            try:
+                                cursor.execute('''UPDATE users
+                                                  SET password = ?
+                                                  WHERE id = ?;''', (ph.hash(new_pass),current_user.id))
+                            except sqlite3.IntegrityError:
+                                session['error_msg'] = 'pass'
+                                return redirect(f'/u/{login}')
+
+                            conn.commit()
+                            login_user(load_user(current_user.id))
+                            return redirect(f'/u/{login}')
+                    else:
+                        session['error_msg']=''
+                        return redirect(f'/u/{login}')
+
+                else:
+                    session['error_msg']='both'
+                    return redirect(f'/u/{login}')
+
+            else:
+                if email and re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$',email) is not None:
+                    if current_user.id==1:
+                        return redirect('/u/')
+                    if current_user.email!=email:
+                        with db.connect() as conn:
+                            cursor = conn.cursor()
+                            try:
+                                cursor.execute('''UPDATE users
+                                                  SET email = ?
+                                                  WHERE id = ?;''', (email, current_user.id))
+                            except sqlite3.IntegrityError:
+                                session['error_msg'] = 'email'
+                                return redirect(f'/u/{login}')
+
+                            conn.commit()
+                            login_user(load_user(current_user.id))
+                            return redirect(f'/u/{login}')
+                    else:
+                        session['error_msg'] = ''
+                        return redirect(f'/u/{login}')
+
+                else:
+                    session['error_msg'] = 'email'
+                    return redirect(f'/u/{login}')
+
+        elif 'avatar' in request.files:
+            file = request.files['avatar']
+            if file.filename == '':
+                session['error_msg'] = 'ava'
+                return redirect(f'/u/{login}')
+
+            session['wait'] = img_PROCESS(current_user.login.lower(), file, os.path.join('u', current_user.login.lower()), 'ava.jpg',f'/u/{login}')
+            return redirect('/loading')
+        elif 'logout' in request.form:
+            logout_user()
+            return redirect('/u/')
+        elif 'postId' in request.form:
+            what_post = request.form.get('postId', 0)
+            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
+                # Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
+                if remove_post(int(what_post)):
+                    return redirect(f'/u/{login}')
+                else:
+                    return redirect(url_for('error', e=404))
+            else:
+                return redirect(f'/u/{login}')
+        else:
+            return redirect(f'/u/{login}')
+
+@app.route('/', methods=['GET','POST'])
+def index():
+    query = request.args.get('q', '').lower().strip()
+    category = request.args.get('c','').lower().strip()
+    if category not in ['','users','posts','groups']:
+        category=''
+
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+    filter = request.args.get('filter', '').lower()
+    subs = {}
+    if current_user.is_anonymous:
+        browse_as_guest()
+        if filter == '':
+            return redirect('/?filter=popular')
+    else:
+        subs = user_subscriptions(current_user.id)
+    search_users=tuple()
+    search_groups=tuple()
+    posts={}
+    prev_page = next_page = ''
+    if query!='' and (category=='' or category == 'users'):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            match = search.match_query(query, prefix='all')
+            if match is not None:
+                search_users, prev_page, next_page = keyset_page(cursor, 'SELECT login FROM users', ["login<>'Anonymous'", 'id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)'], [match],
+                                                                 ('login',), (0,), after, before, descending=False)
+    if query!='' and (category=='' or category=='groups'):
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            match = search.match_query(query, prefix='all')
+            if match is not None:
+                search_groups, prev_page, next_page = keyset_page(cursor, 'SELECT group_name FROM groups', ['id IN (SELECT rowid FROM groups_fts WHERE groups_fts MATCH ?)'], [match],
+                                                                  ('group_name',), (0,), after, before, descending=False)
+    if category=='' or category=='posts':
+        sql_command='''SELECT posts.id,
+                                     group_name,
+                                     u.login,
+                                     upload_date,
+                                     title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                                  posts.popularity_score''' + POST_UPLOADS + '''
+                              FROM posts INNER JOIN main.groups g
+                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id'''
+        conditions, params = [], []
+        keys, key_columns = ('posts.popularity_score', 'posts.id'), (10, 0)
+        if query!='':
+            # Only the matching rows are read, best ranked first (see search.POST_RELEVANCE)
+            sql_command='''SELECT posts.id,
+                                     group_name,
+                                     u.login,
+                                     upload_date,
+                                     posts.title, posts.desc, posts.attach_img, rating, posts.likes, posts.dislikes,
+                                  posts.popularity_score, ''' + search.POST_RELEVANCE + ''' AS relevance''' + POST_UPLOADS + '''
+                              FROM posts_fts INNER JOIN posts on posts.id = posts_fts.rowid INNER JOIN main.groups g
+                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id'''
+            conditions, params = ['posts_fts MATCH ?'], [search.match_query(query) or '""']  # '""' matches nothing
+            keys, key_columns = ('relevance', 'posts.id'), (11, 0)
+        elif filter == '' and app.config['FEED_MATERIALIZED']:
+            # The user's own feed rows, already in popularity order (see feed.py)
+            sql_command='''SELECT posts.id,
+                                     group_name,
+                                     u.login,
+                                     upload_date,
+                                     title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                                  posts.popularity_score''' + POST_UPLOADS + '''
+                              FROM feed INNER JOIN posts on posts.id = feed.post_id INNER JOIN main.groups g
+                              on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id'''
+            conditions, params = ['feed.user_id = ?'], [current_user.id]
+            keys = ('feed.popularity_score', 'feed.post_id')
+        elif filter == '':
+            conditions, params = [f'group_name IN ({", ".join("?" for _ in subs)})'], list(subs)
+        elif filter == 'latest':
+            keys, key_columns = ('posts.upload_date', 'posts.id'), (3, 0)
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            rows, prev_page, next_page = keyset_page(cursor, sql_command, conditions, params, keys, key_columns, after, before)
+            my_votes = user_votes('post', [row[0] for row in rows])
+            temp_posts = { row[0]:
+                {'id': row[0], 'g': row[1], 'u': row[2], 'upload_date': date_format(row[3]), 'title': row[4], 'desc': row[5],
+                 'attach_img': row[6], 'rating': row[7], 'likes': row[8],
+                 'dislikes': row[9], 'vote': my_votes.get(row[0]), 'who_rem': group_moderators(row[1]) | {row[2].lower()},
+                 'uploads': post_uploads(row)} for row in rows}
+
+        posts = {id: rating_count(post.copy()) for id,post in temp_posts.items()}
+
+    if request.method=='GET':
+        return render_template('home_with_style.html', login=current_user.login, filter=filter, subs=subs, posts=posts.values(), search_users=search_users,search_groups=search_groups, query=query, category=category, prev_page=prev_page, next_page=next_page)
+    elif request.method=='POST':
+        if current_user.is_anonymous:
+            login_user(load_user(1))
+            return redirect('/u/')
+        if current_user.id == 1:
+            return redirect('/u/')
+        if 'postId' in request.form:
+            what_post = request.form.get('postId',0)
+            if what_post and what_post.isnumeric() and current_user.login.lower() in posts.get(int(what_post),{"who_rem": {}})['who_rem']:
+                #Risky. Will remove everything regarding a specific post, including its likes/dislikes and comments
+                if remove_post(int(what_post)):
+                    return redirect('/?filter=popular')
+                else:
+                    return redirect(url_for('error'))
+            else:
+                return redirect('/?filter=popular')
+        else:
+            return redirect('/?filter=popular')
+
+@app.route('/uploads/<folder0>/<folder1>/<filename>')
+def serve_user_file(folder0,folder1,filename):
+    # A URL carrying the current version never changes content, so it is cached for good;
+    # without one (or with an outdated one) the browser revalidates every time, and
+    # If-None-Match gets a 304 while the file is unchanged.
+    path = f'{folder0}/{folder1}/{filename}'
+    version = upload_version(f'{folder0}/{folder1}/{RENDITION_NAME.sub(".jpg", filename)}')
+    current = version != '' and request.args.get('v') == version
+    sendfile = sendfile_mode()
+    if sendfile:
+        response = offload_file(sendfile, path)
+    else:
+        response = send_from_directory(UPLOAD_FOLDER, path, max_age=UPLOAD_MAX_AGE if current else None)
+    if current:
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOAD_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def sendfile_mode():
+    # The header to hand upload files to the proxy with, or None to send them ourselves. Only
+    # the configuration decides: a request header asking for X-Sendfile would have any client
+    # learn where the uploads are on disk.
+    mode = app.config['UPLOAD_SENDFILE']
+    return mode if mode.lower() in ('x-accel-redirect', 'x-sendfile') else None
+
+def offload_file(header, path):
+    # An empty response telling the proxy to send uploads/<path> itself: only the path is
+    # checked here, the proxy reads the file and answers conditional and range requests
+    full_path = safe_join(UPLOAD_FOLDER, path)
+    if full_path is None:
+        return redirect(url_for('error', e=404))
+    response = app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if header.lower() == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'] + quote(path)
+    else:
+        response.headers['X-Sendfile'] = full_path
+    return response
+
+def serve_static_file(filename):
+    # Flask's static view, but with precompressed copies for clients that accept them
+    return assets.send_precompressed(app.static_folder, PRECOMPRESSED_FOLDER, filename,
+                                     max_age=app.get_send_file_max_age(filename))
+
+app.view_functions['static'] = serve_static_file
+
+@app.route('/search/complete')
+def search_complete():
+    # Typeahead for the search box: logins and group names starting with ?q=, from memory
+    return jsonify(completions(request.args.get('q', '')))
+
+@socketio.on('complete')
+def socket_complete(prefix):
+    # Same as /search/complete for clients already connected; the answer is the event's ack
+    return completions(str(prefix))
+
+def is_admin():
+    return current_user.is_authenticated and current_user.id != 1 and current_user.login.lower() in app.config['ADMINS']
+
+@app.route('/metrics/moderation')
+def moderation_metrics():
+    if not is_admin():
+        return redirect(url_for('error', e=404))
+    return jsonify(moderation_pool.metrics())
+
+@app.route('/loading')
+def loading():
+    if current_user.is_anonymous:
+        login_user(load_user(1))
+        return redirect('/?filter=popular')
+    job = session.pop('wait', None)
+    if request.method == 'GET' and job:
+        return render_template('wait.html', job=job)
+    else:
+        return redirect('/?filter=popular')
+
+@app.route('/error')
+def error():
+    er=request.args.get('e','Error')
+    er_msg='Unexpected error!'
+    if str(er)=='404':
+        er_msg='This page does not exist!'
+    elif str(er)=='413':
+        er_msg="Image too large!\n(Max: 5MB)"
+    if current_user.is_anonymous:
+        login_user(load_user(1))
+    subs = {}
+    try:
+        subs = user_subscriptions(current_user.id)
+    except:
+        None
+    return render_template('error.html', login=current_user.login, subs=subs, error=str(er), errormsg=er_msg)
+
+@app.errorhandler(HTTPException)
+def error_handler(e):
+    return redirect(url_for('error',e=e.code))
+
+started = False
+
+def create_app():
+    # Everything the serving process does once before taking requests. Importing this module
+    # stays cheap and side-effect free: spawned moderation workers import it again, and
+    # TensorFlow is only loaded once the pool starts (first upload, or MODERATION_PRELOAD).
+    # For a WSGI server, point it at main:create_app().
+    global started, vote_buffer, worker_id
+    if started:
+        return app
+    started = True
+    for nfolder in necessary_folders:
+        os.makedirs(nfolder, exist_ok=True)
+    janitor.recover(*(os.path.join('uploads', base_dir) for base_dir in ('g', 'p', 'u')))
+    if not os.path.exists(MODEL_PATH):
+        print("The model is missing! Please download the model first.")
+        print("https://github.com/GantMan/nsfw_model/releases/tag/1.2.0")
+        print("The folder /model should contain the file saved_model.h5, which is the model itself.")
+        exit(-1)
+    db.migrate()
+    if app.config['FEED_MATERIALIZED']:
+        feed.enable()
+    else:
+        feed.disable()
+    assets.precompress(app.static_folder, PRECOMPRESSED_FOLDER)
+    worker_id = f'{platform.node()}-{os.getpid()}-{secrets.token_hex(4)}'
+    socketio.start_background_task(load_names)
+    socketio.start_background_task(register_uploads)
+    socketio.start_background_task(popularity_THREAD)
+    if app.config['UPLOADS_RECONCILE_INTERVAL'] > 0:
+        socketio.start_background_task(reconcile_THREAD)
+    if app.config['VOTE_BUFFER']:
+        vote_buffer = votes.VoteBuffer(os.path.join('database', 'votes.journal'), app.config['VOTE_BUFFER_INTERVAL'],
+                                       app.config['VOTE_BUFFER_MAX_EVENTS'], app.config['VOTE_BUFFER_MAX_STALENESS'],
+                                       on_commit=page_cache.expire)
+    if app.config['MODERATION_PRELOAD']:
+        moderation_pool.start()
+    socketio.start_background_task(jobs_THREAD)
+    return app
+
+if __name__ == '__main__':
+    create_app()
     socketio.run(app, allow_unsafe_werkzeug=True)
\ No newline at end of file
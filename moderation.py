@@ -0,0 +1,204 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import warnings
+from collections import deque
+
+from PIL import Image
+
+IMAGE_DIM = 224  # nsfw_detector.predict.IMAGE_DIM, the network's input size
+NSFW_CATEGORIES = ('hentai', 'porn', 'sexy')
+SAMPLES = 1000  # latency samples kept per metric
+
+log = logging.getLogger(__name__)
+
+# Inherited by the workers (and the fork server), which import TensorFlow
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+
+def is_nsfw(prediction):
+    return round(sum(prediction[category] for category in NSFW_CATEGORIES), 2) >= 0.5
+
+
+def model_input(image):
+    # The network input for a decoded RGB image, prepared in the web process so that workers
+    # receive IMAGE_DIM x IMAGE_DIM raw pixels instead of a file. Squashed with nearest
+    # neighbour sampling, as predict.classify's keras loader does.
+    return image.resize((IMAGE_DIM, IMAGE_DIM), Image.Resampling.NEAREST).tobytes()
+
+
+def _worker(model_path, jobs, results, batch_size, batch_wait):
+    # Runs in its own process and owns one copy of the model. Takes a job, then keeps
+    # collecting for up to `batch_wait` seconds so a burst of uploads shares one forward pass.
+    warnings.filterwarnings('ignore', category=UserWarning)
+    logging.getLogger('tensorflow').disabled = True
+    import numpy as np
+    from nsfw_detector import predict
+    model = predict.load_model(model_path)
+    results.put(('ready', os.getpid()))
+    while True:
+        batch = [jobs.get()]
+        deadline = time.monotonic() + batch_wait
+        while len(batch) < batch_size:
+            try:
+                batch.append(jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        started = time.time()
+        images = [np.frombuffer(pixels, dtype=np.uint8).reshape(IMAGE_DIM, IMAGE_DIM, 3) for _, pixels, _ in batch]
+        try:
+            predictions = predict.classify_nd(model, np.stack(images).astype(np.float32) / 255)
+        except Exception:
+            # Classify one by one, so a single bad image does not fail the whole batch
+            log.exception('Moderation batch of %d failed, retrying its images one by one', len(batch))
+            predictions = []
+            for image in images:
+                try:
+                    predictions.append(predict.classify_nd(model, image[np.newaxis].astype(np.float32) / 255)[0])
+                except Exception:
+                    log.exception('Image could not be classified')
+                    predictions.append(None)
+        finished = time.time()
+        results.put(('done', [(sequence, prediction, enqueued, started, finished, len(batch))
+                              for (sequence, _, enqueued), prediction in zip(batch, predictions)]))
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ModerationPool:
+    # NSFW classification in `workers` separate processes, fed through one shared job queue.
+    # At most `queue_size` images may wait at a time; submit() refuses more, so a burst of
+    # uploads is turned away instead of piling up behind the model. Results come back on a
+    # collector thread in this process and are handed to on_result(job_id, prediction),
+    # prediction being None when the image could not be classified or no answer came within
+    # `job_timeout` seconds.
+    # With start_method 'forkserver' (not on Windows) TensorFlow is imported once, in the fork
+    # server, and every worker (including replacements) is forked from it with the library
+    # already in shared memory. The weights are still loaded per worker: the TensorFlow runtime
+    # does not survive a fork once a model has been loaded.
+
+    def __init__(self, model_path, on_result, workers=1, batch_size=8, batch_wait=0.05, queue_size=32,
+                 job_timeout=120, start_method='spawn'):
+        self.model_path = model_path
+        self.on_result = on_result
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self.context.set_forkserver_preload(['nsfw_detector.predict'])
+        self.lock = threading.Lock()
+        self.processes = []
+        self.jobs = self.results = None
+        # sequence number -> (job_id, submit time) of every job not answered yet
+        self.outstanding = {}
+        self.sequence = 0
+        self.counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'restarts': 0}
+        self.queue_wait = deque(maxlen=SAMPLES)
+        self.inference = deque(maxlen=SAMPLES)
+        self.batch_sizes = deque(maxlen=SAMPLES)
+
+    def start(self):
+        # Only ever call this from the web process: spawned workers import the app's main
+        # module again and must not start a pool of their own. submit() starts it if needed.
+        with self.lock:
+            if self.jobs is not None:
+                return
+            self.jobs = self.context.Queue()
+            self.results = self.context.Queue()
+            for _ in range(self.workers):
+                self._spawn()
+        threading.Thread(target=self.collect, daemon=True).start()
+
+    def _spawn(self):
+        process = self.context.Process(target=_worker, daemon=True,
+                                       args=(self.model_path, self.jobs, self.results, self.batch_size, self.batch_wait))
+        process.start()
+        self.processes.append(process)
+
+    def submit(self, job_id, pixels):
+        self.start()
+        with self.lock:
+            if len(self.outstanding) >= self.queue_size:
+                self.counters['rejected'] += 1
+                return False
+            self.sequence += 1
+            enqueued = time.time()
+            self.outstanding[self.sequence] = (job_id, enqueued)
+            self.counters['submitted'] += 1
+            self.jobs.put((self.sequence, pixels, enqueued))
+        return True
+
+    def has_room(self):
+        # Whether submit() would take another job right now
+        with self.lock:
+            return len(self.outstanding) < self.queue_size
+
+    def collect(self):
+        checked = time.monotonic()
+        while True:
+            if time.monotonic() - checked >= 1:
+                self._replace_dead()
+                self._expire()
+                checked = time.monotonic()
+            try:
+                message = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            if message[0] != 'done':
+                continue
+            for sequence, prediction, enqueued, started, finished, batch_len in message[1]:
+                with self.lock:
+                    job = self.outstanding.pop(sequence, None)
+                    if job is None:
+                        continue  # already given up on
+                    self.counters['completed' if prediction is not None else 'failed'] += 1
+                    self.queue_wait.append(started - enqueued)
+                    self.inference.append(finished - started)
+                    self.batch_sizes.append(batch_len)
+                self._answer(job[0], prediction)
+
+    def _answer(self, job_id, prediction):
+        try:
+            self.on_result(job_id, prediction)
+        except Exception:
+            log.exception('Handling the result of moderation job %s failed', job_id)
+
+    def _expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [sequence for sequence, (_, enqueued) in self.outstanding.items()
+                       if now - enqueued > self.job_timeout]
+            jobs = [self.outstanding.pop(sequence)[0] for sequence in expired]
+            self.counters['failed'] += len(jobs)
+        for job_id in jobs:
+            self._answer(job_id, None)
+
+    def _replace_dead(self):
+        # A crashed worker takes its current batch with it; those jobs fail by timeout,
+        # but the pool keeps its size.
+        with self.lock:
+            for process in [process for process in self.processes if not process.is_alive()]:
+                self.processes.remove(process)
+                self.counters['restarts'] += 1
+                self._spawn()
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.counters, workers=sum(process.is_alive() for process in self.processes),
+                         queue_depth=len(self.outstanding), queue_size=self.queue_size)
+            for name, samples in (('queue_wait', self.queue_wait), ('inference', self.inference)):
+                stats[name] = {'p50': _percentile(samples, 0.5), 'p95': _percentile(samples, 0.95),
+                               'max': max(samples, default=None)}
+            stats['avg_batch'] = sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else None
+        return stats
@@ -0,0 +1,25 @@
+import re
+
+# Full-text search over the FTS5 indexes created by db migration 7. posts_fts, users_fts and
+# groups_fts are external-content tables: they store only the index, the text stays in posts,
+# users and groups, and triggers keep the two in step.
+
+# bm25() column weights of posts_fts (title, desc, attach_img)
+POST_WEIGHTS = (4.0, 1.0, 0.5)
+# Post relevance, higher first: BM25 scaled by popularity. The factor runs from 0 to 2 and is
+# 1 at zero popularity, so the text match decides and popularity orders similar matches.
+POST_RELEVANCE = (f"-bm25(posts_fts, {', '.join(map(str, POST_WEIGHTS))})"
+                  " * (1 + posts.popularity_score / (ABS(posts.popularity_score) + 1))")
+
+TERM = re.compile(r'\w+')
+
+
+def match_query(text, prefix='last'):
+    # FTS5 MATCH expression finding every word of `text`, or None if it has none. Words are
+    # quoted, so user input never reaches the query syntax. prefix='last' makes the last word a
+    # prefix (it may still be being typed), prefix='all' every word.
+    terms = TERM.findall(text.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' + ('*' if prefix == 'all' or i == len(terms) - 1 else '')
+                    for i, term in enumerate(terms))
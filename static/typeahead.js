@@ -0,0 +1,44 @@
+// Completions for the header search box: matching users and groups (see /search/complete)
+// listed under the box as links while typing.
+document.querySelectorAll('.search-bar input[name="q"]').forEach(input => {
+    const list = document.createElement('ul');
+    list.className = 'typeahead list-unstyled';
+    input.parentElement.appendChild(list);
+    input.setAttribute('autocomplete', 'off');
+    let pending = null;
+
+    function show(completions) {
+        list.replaceChildren();
+        for (const [kind, names] of [['u', completions.users], ['g', completions.groups]]) {
+            for (const name of names) {
+                const item = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = `/${kind}/${encodeURIComponent(name)}`;
+                link.textContent = `${kind}/${name}`;
+                item.appendChild(link);
+                list.appendChild(item);
+            }
+        }
+        list.style.display = list.children.length ? 'block' : 'none';
+    }
+
+    input.addEventListener('input', async () => {
+        if (pending) {
+            pending.abort();
+        }
+        const prefix = input.value.trim();
+        if (!prefix) {
+            show({users: [], groups: []});
+            return;
+        }
+        pending = new AbortController();
+        try {
+            const response = await fetch(`/search/complete?q=${encodeURIComponent(prefix)}`, {signal: pending.signal});
+            show(await response.json());
+        } catch (err) {
+            // superseded by the next keystroke, or offline: keep the box usable without them
+        }
+    });
+    input.addEventListener('blur', () => setTimeout(() => list.style.display = 'none', 200));
+    input.addEventListener('focus', () => list.style.display = list.children.length ? 'block' : 'none');
+});
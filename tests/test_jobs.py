@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import jobs
+
+# The moderation job queue against a throwaway database, with time moved by hand
+
+
+@pytest.fixture
+def clock(monkeypatch, tmp_path):
+    db.close()
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'db.db'))
+    db.migrate()
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    yield now
+    db.close()
+
+
+def create(login='alice', limit=5):
+    return jobs.create(login, 'key', 'post', 'p/1', 'a.jpg', '/p/1', b'data', limit)
+
+
+def test_claims_oldest_first(clock):
+    first, second = create(), create()
+    assert jobs.claim('w1', 30, 3)[0] == first
+    assert jobs.claim('w2', 30, 3)[0] == second
+    assert jobs.claim('w3', 30, 3) is None
+    assert jobs.status(first)['state'] == 'running'
+
+
+def test_limit_per_login(clock):
+    assert create(limit=2) and create(limit=2)
+    assert create(limit=2) is None
+    assert create('bob', limit=2)
+
+
+def test_expired_lease_is_claimed_again(clock):
+    job = create()
+    jobs.claim('w1', 30, 3)
+    clock[0] += 29
+    assert jobs.claim('w2', 30, 3) is None
+    clock[0] += 2
+    row = jobs.claim('w2', 30, 3)
+    assert row[0] == job and row[2] == 2
+    # The first worker lost it and can no longer finish or retry it
+    assert not jobs.finish(job, 'w1', {'error': False})
+    assert jobs.retry(job, 'w1', 3, {'error': True}) is None
+    assert jobs.finish(job, 'w2', {'error': False})
+    assert jobs.status(job)['state'] == 'done'
+
+
+def test_expired_lease_out_of_attempts_fails(clock):
+    job = create()
+    for _ in range(2):
+        jobs.claim('w', 30, 2)
+        clock[0] += 31
+    assert jobs.claim('w', 30, 2) is None
+    assert jobs.status(job) == {'job': job, 'login': 'alice', 'state': 'failed',
+                                'result': {'error': True, 'reason': 'BADFILE', 'redirect': '/p/1'}}
+
+
+def test_retry_waits_a_doubling_delay(clock):
+    job = create()
+    jobs.claim('w', 30, 3)
+    assert jobs.retry(job, 'w', 3, {'error': True}, delay=10) == 'queued'
+    clock[0] += 9
+    assert jobs.claim('w', 30, 3) is None
+    clock[0] += 1
+    assert jobs.claim('w', 30, 3)[0] == job
+    assert jobs.retry(job, 'w', 3, {'error': True}, delay=10) == 'queued'
+    clock[0] += 19
+    assert jobs.claim('w', 30, 3) is None
+    clock[0] += 1
+    assert jobs.claim('w', 30, 3)[0] == job
+    assert jobs.retry(job, 'w', 3, {'error': True, 'reason': 'X'}, delay=10) == 'failed'
+    assert jobs.status(job)['result'] == {'error': True, 'reason': 'X'}
+
+
+def test_release_gives_the_attempt_back(clock):
+    job = create()
+    jobs.claim('w1', 30, 1)
+    jobs.release(job, 'w1')
+    assert jobs.claim('w2', 30, 1)[0] == job
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import main
+
+# Legacy 'yy.mm.dd' dates, written in local time, must still show the same day once migration 2
+# made them timestamps, in any time zone.
+
+
+@pytest.fixture
+def legacy_db(monkeypatch, tmp_path):
+    # A database at migration 1 holding a post and a comment with legacy dates
+    db.close()
+    migrations = db.MIGRATIONS
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'db.db'))
+    monkeypatch.setattr(db, 'MIGRATIONS', migrations[:1])
+    db.migrate()
+    with db.connect() as conn:
+        conn.execute("INSERT INTO groups (group_name) VALUES ('cats')")
+        conn.execute("INSERT INTO posts (uploader_group_id, uploader_user_id, upload_date, title, rating) VALUES (1, 1, '24.03.05', 't', 0)")
+        conn.execute("INSERT INTO comments (desc, upload_date, user_id, post_id, rating) VALUES ('c', '24.12.31', 1, 1, 0)")
+    monkeypatch.setattr(db, 'MIGRATIONS', migrations)
+    yield db.connect()
+    db.close()
+
+
+@pytest.fixture
+def zone(request):
+    saved = os.environ.get('TZ')
+    os.environ['TZ'] = request.param
+    time.tzset()
+    yield
+    if saved is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = saved
+    time.tzset()
+
+
+@pytest.mark.parametrize('zone', ['UTC', 'America/New_York', 'Asia/Tokyo'], indirect=True)
+def test_legacy_dates_keep_their_day(zone, legacy_db):
+    db.migrate()
+    assert main.date_format(legacy_db.execute('SELECT upload_date FROM posts').fetchone()[0]) == '05.03.24'
+    assert main.date_format(legacy_db.execute('SELECT upload_date FROM comments').fetchone()[0]) == '31.12.24'
@@ -0,0 +1,125 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import main
+
+# The listings' queries, as keyset_page() builds them, must read through the indexes of the
+# migrations: one index range scan per page, and no sort of the whole result. Checked with
+# EXPLAIN QUERY PLAN against an empty in-memory database with every migration applied.
+
+POSTS = '''SELECT posts.id, group_name, u.login, upload_date, title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                  posts.popularity_score''' + main.POST_UPLOADS + '''
+           FROM posts INNER JOIN main.groups g
+           on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id'''
+FEED = '''SELECT posts.id, group_name, u.login, upload_date, title, desc, attach_img, rating, posts.likes, posts.dislikes,
+                 posts.popularity_score''' + main.POST_UPLOADS + '''
+          FROM feed INNER JOIN posts on posts.id = feed.post_id INNER JOIN main.groups g
+          on posts.uploader_group_id = g.id INNER JOIN main.users u on u.id = posts.uploader_user_id'''
+COMMENTS = '''SELECT comments.id, desc, upload_date, u.login, post_id, rating, comments.likes, comments.dislikes,
+                     comments.popularity_score, ''' + main.published_upload_sql("'u/' || lower(u.login) || '/ava.jpg'") + '''
+              FROM comments INNER JOIN users u
+              ON comments.user_id = u.id'''
+SECOND_PAGE = main.encode_cursor([0.5, 10])
+
+
+class PlanCursor:
+    # Stands in for the cursor keyset_page() runs its query on, and keeps the query's plan
+    def __init__(self, conn):
+        self.conn = conn
+        self.plan = []
+
+    def execute(self, sql, params=()):
+        self.plan = [row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+    def fetchall(self):
+        return []
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    db.close()
+    monkeypatch.setattr(db, 'DB_PATH', ':memory:')
+    db.migrate()
+    yield db.connect()
+    db.close()
+
+
+def page_plan(conn, sql, conditions, params, keys, after=''):
+    cursor = PlanCursor(conn)
+    main.keyset_page(cursor, sql, conditions, params, keys, (0,) * len(keys), after)
+    return cursor.plan
+
+
+def plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def uses(plan, index):
+    return any(f'INDEX {index} ' in step or step.endswith(f'INDEX {index}') for step in plan)
+
+
+def sorts(plan):
+    return any('TEMP B-TREE' in step for step in plan)
+
+
+@pytest.mark.parametrize('after', ['', SECOND_PAGE])
+@pytest.mark.parametrize('condition, keys, index', [
+    ('posts.uploader_group_id = ?', ('posts.popularity_score', 'posts.id'), 'posts_group_popularity_idx'),
+    ('posts.uploader_user_id = ?', ('posts.popularity_score', 'posts.id'), 'posts_user_popularity_idx'),
+    (None, ('posts.popularity_score', 'posts.id'), 'posts_popularity_idx'),
+    (None, ('posts.upload_date', 'posts.id'), 'posts_latest_idx'),
+])
+def test_post_listings(conn, condition, keys, index, after):
+    steps = page_plan(conn, POSTS, [condition] if condition else [], [1] if condition else [], keys, after)
+    assert uses(steps, index), steps
+    assert not sorts(steps), steps
+
+
+@pytest.mark.parametrize('after', ['', SECOND_PAGE])
+def test_comments(conn, after):
+    steps = page_plan(conn, COMMENTS, ['comments.post_id = ?'], [1], ('comments.popularity_score', 'comments.id'), after)
+    assert uses(steps, 'comments_popularity_idx'), steps
+    assert not sorts(steps), steps
+
+
+def test_listed_uploads(conn):
+    # The versions of the uploads a post card shows come with its row, one primary key lookup each
+    steps = page_plan(conn, POSTS, [], [], ('posts.popularity_score', 'posts.id'))
+    assert [step for step in steps if 'uploads' in step] == ['SEARCH uploads USING PRIMARY KEY (path=?)'] * 3, steps
+    steps = page_plan(conn, COMMENTS, ['comments.post_id = ?'], [1], ('comments.popularity_score', 'comments.id'))
+    assert [step for step in steps if 'uploads' in step] == ['SEARCH uploads USING PRIMARY KEY (path=?)'], steps
+
+
+def test_materialized_feed(conn):
+    steps = page_plan(conn, FEED, ['feed.user_id = ?'], [2], ('feed.popularity_score', 'feed.post_id'))
+    assert uses(steps, 'feed_user_idx'), steps
+    assert not sorts(steps), steps
+
+
+def test_subscriptions_feed(conn):
+    # Without FEED_MATERIALIZED the home feed reads each subscribed group's posts through
+    # posts_group_popularity_idx, but merging several groups into one popularity order still
+    # takes a sort of their posts: no single index is ordered by popularity within a set of
+    # groups. FEED_MATERIALIZED (feed.py) is the sort-free version, see test_materialized_feed.
+    steps = page_plan(conn, POSTS, ['group_name IN (?, ?, ?)'], ['a', 'b', 'c'], ('posts.popularity_score', 'posts.id'))
+    assert uses(steps, 'posts_group_popularity_idx'), steps
+    assert sorts(steps), 'the subscriptions feed no longer sorts: update the comment above'
+
+
+def test_viewer_votes(conn):
+    steps = plan(conn, 'SELECT post_id, likeorno FROM likes_dislikes_posts WHERE user_id = ? AND post_id IN (?, ?)', (2, 1, 3))
+    assert uses(steps, 'sqlite_autoindex_likes_dislikes_posts_1'), steps
+
+
+def test_group_roles(conn):
+    steps = plan(conn, '''SELECT role, login
+                          FROM subscriptions
+                                   INNER JOIN users ON subscriptions.user_id = users.id
+                          WHERE group_id = (SELECT id FROM groups WHERE group_name = ?)
+                          ORDER BY user_id''', ('cats',))
+    assert uses(steps, 'subscriptions_group_idx'), steps
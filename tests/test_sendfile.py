@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contentcache
+import db
+import main
+
+# The headers serve_user_file answers with in every UPLOAD_SENDFILE mode, against a throwaway
+# uploads folder and database (versions come from the uploads table), without a proxy.
+
+DATA = b'\xff\xd8 not really a jpeg'
+
+
+@pytest.fixture
+def uploads(monkeypatch, tmp_path):
+    db.close()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'db.db'))
+    db.migrate()
+    folder = str(tmp_path / 'uploads')
+    os.makedirs(os.path.join(folder, 'u', 'alice'))
+    with open(os.path.join(folder, 'u', 'alice', 'ava.jpg'), 'wb') as file:
+        file.write(DATA)
+    monkeypatch.setattr(main, 'UPLOAD_FOLDER', folder)
+    main.upload_published('u/alice/ava.jpg', contentcache.digest(DATA), ['.jpg'])
+    yield folder
+    main.uploads_cache.invalidate('u/alice/ava.jpg')
+    db.close()
+
+
+@pytest.fixture
+def get(monkeypatch, uploads):
+    client = main.app.test_client()
+
+    def get(mode, url, **headers):
+        monkeypatch.setitem(main.app.config, 'UPLOAD_SENDFILE', mode)
+        return client.get(url, headers=headers)
+    return get
+
+
+def offloaded(response):
+    return 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers
+
+
+def test_off_streams_the_file(get):
+    response = get('off', '/uploads/u/alice/ava.jpg')
+    assert response.data == DATA and not offloaded(response)
+
+
+def test_off_ignores_the_request_header(get):
+    response = get('off', '/uploads/u/alice/ava.jpg', **{'X-Sendfile-Type': 'X-Sendfile'})
+    assert response.data == DATA and not offloaded(response)
+
+
+def test_unknown_mode_streams_the_file(get):
+    response = get('auto', '/uploads/u/alice/ava.jpg', **{'X-Sendfile-Type': 'X-Accel-Redirect'})
+    assert response.data == DATA and not offloaded(response)
+
+
+def test_accel_redirect_to_the_internal_location(get):
+    response = get('X-Accel-Redirect', '/uploads/u/alice/ava.jpg')
+    assert response.headers.get('X-Accel-Redirect') == main.app.config['UPLOAD_ACCEL_PREFIX'] + 'u/alice/ava.jpg'
+    assert response.data == b'' and response.mimetype == 'image/jpeg'
+
+
+def test_sendfile_absolute_path(get, uploads):
+    response = get('X-Sendfile', '/uploads/u/alice/ava.jpg')
+    assert response.headers.get('X-Sendfile') == os.path.join(uploads, 'u/alice/ava.jpg')
+    assert response.data == b''
+
+
+def test_offloaded_versions(get):
+    response = get('X-Accel-Redirect', f"/uploads/u/alice/ava.jpg?v={main.upload_version('u/alice/ava.jpg')}")
+    assert response.cache_control.immutable and response.cache_control.max_age == main.UPLOAD_MAX_AGE
+    response = get('X-Accel-Redirect', '/uploads/u/alice/ava.jpg?v=old')
+    assert response.cache_control.no_cache and not response.cache_control.immutable
+
+
+@pytest.mark.parametrize('mode', ['X-Accel-Redirect', 'X-Sendfile'])
+def test_path_outside_uploads_refused(get, mode):
+    assert not offloaded(get(mode, '/uploads/u/../..%2Fmain.py'))
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import votes
+
+# Votes against a throwaway database holding one post (id 1) and one comment (id 1) voted on by
+# user 2.
+
+
+@pytest.fixture
+def conn(monkeypatch, tmp_path):
+    db.close()
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'db.db'))
+    db.migrate()
+    with db.connect() as conn:
+        conn.execute("INSERT INTO users (login, email, password) VALUES ('alice', 'alice@example.com', '')")
+        conn.execute("INSERT INTO groups (group_name) VALUES ('cats')")
+        conn.execute("INSERT INTO posts (uploader_group_id, uploader_user_id, upload_date, title, rating) VALUES (1, 2, 0, 't', 0)")
+        conn.execute("INSERT INTO comments (desc, upload_date, user_id, post_id, rating) VALUES ('c', 0, 2, 1, 0)")
+    yield conn
+    db.close()
+
+
+def counters(conn, table='posts'):
+    return conn.execute(f'SELECT rating, likes, dislikes FROM {table} WHERE id = 1').fetchone()
+
+
+def test_like_then_dislike(conn):
+    assert votes.apply_vote('post', 1, 2, 'like-button', 1) == 1
+    assert counters(conn) == (1, 1, 0)
+    assert votes.apply_vote('post', 1, 2, 'dislike-button', -2) == -1
+    assert counters(conn) == (-1, 0, 1)
+    assert votes.apply_vote('post', 1, 2, 'dislike-button', 1) == 0
+    assert counters(conn) == (0, 0, 0)
+    assert conn.execute('SELECT COUNT(*) FROM likes_dislikes_posts').fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('clicked, what', [('like-button', 2), ('like-button', -1), ('dislike-button', 1),
+                                           ('like-button', '1'), ('like-button', True), ('share-button', 1)])
+def test_invalid_click_writes_nothing(conn, clicked, what):
+    assert votes.apply_vote('post', 1, 2, clicked, what) is None
+    assert counters(conn) == (0, 0, 0)
+    assert conn.execute('SELECT COUNT(*) FROM likes_dislikes_posts').fetchone()[0] == 0
+
+
+def test_stale_client_is_refused(conn):
+    # A second tab still showing no vote sends +1 again: it would count the like twice
+    assert votes.apply_vote('comment', 1, 2, 'like-button', 1) == 1
+    assert votes.apply_vote('comment', 1, 2, 'like-button', 1) is None
+    assert counters(conn, 'comments') == (1, 1, 0)
+
+
+def test_missing_item(conn):
+    assert votes.apply_vote('post', 2, 2, 'like-button', 1) is None
+    assert conn.execute('SELECT COUNT(*) FROM likes_dislikes_posts').fetchone()[0] == 0
+
+
+# VoteBuffer: the interval is long enough that only the tests flush
+
+
+@pytest.fixture
+def journal(conn, tmp_path):
+    return str(tmp_path / 'votes.journal')
+
+
+@pytest.fixture
+def start(journal):
+    buffers = []
+
+    def start(**kwargs):
+        buffers.append(votes.VoteBuffer(journal, interval=3600, max_events=1000, fsync=False, **kwargs))
+        return buffers[-1]
+    yield start
+    for buffer in buffers:
+        buffer.journal.close()
+        buffer.owner.close()
+
+
+def dead_journal(tmp_path, flushing, journaled, pid=999999):
+    # What a process killed mid-flush leaves behind: the batch being flushed, the clicks
+    # acknowledged after it (the last one torn), and its lock, free now
+    stem = tmp_path / f'votes-{pid}'
+    with open(f'{stem}.journal.flushing', 'w', encoding='utf-8') as file:
+        file.writelines(line + '\n' for line in flushing)
+    with open(f'{stem}.journal', 'w', encoding='utf-8') as file:
+        file.writelines(line + '\n' for line in journaled)
+        file.write('["post", 1, ')
+    open(f'{stem}.lock', 'w').close()
+
+
+def test_replays_a_dead_process_journal(conn, tmp_path, start):
+    dead_journal(tmp_path, ['["post", 1, 2, true]', '["comment", 1, 2, true]'],
+                 ['["comment", 1, 2, false]', '["comment", 1, 1, false]'])
+    start()
+    assert counters(conn) == (1, 1, 0)
+    assert counters(conn, 'comments') == (-2, 0, 2)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('votes-999999')]
+
+
+def test_replaying_twice_changes_nothing(conn, tmp_path, start):
+    # A process that dies after committing a replay, before removing the journal, leaves it to
+    # be replayed again
+    lines = ['["post", 1, 2, false]', '["comment", 1, 2, true]']
+    dead_journal(tmp_path, lines, [])
+    buffer = start()
+    dead_journal(tmp_path, lines, [])
+    buffer.recover()
+    assert counters(conn) == (-1, 0, 1)
+    assert counters(conn, 'comments') == (1, 1, 0)
+
+
+def test_keeps_a_live_process_journal(conn, tmp_path, start):
+    buffer = start()
+    assert buffer.vote('post', 1, 2, 'like-button', 1) == 1
+    other = tmp_path / f'votes-{os.getpid()}.journal'
+    buffer.recover()
+    assert os.path.getsize(other) > 0
+    assert counters(conn) == (0, 0, 0)
+
+
+def test_flush_commits_the_final_states(conn, start):
+    commits = []
+    buffer = start(on_commit=lambda: commits.append(1))
+    assert buffer.vote('post', 1, 2, 'like-button', 1) == 1
+    assert buffer.vote('post', 1, 2, 'dislike-button', -2) == -1
+    assert buffer.vote('comment', 1, 2, 'like-button', 1) == 1
+    assert buffer.vote('comment', 1, 2, 'like-button', 1) is None
+    assert counters(conn) == (0, 0, 0)
+    buffer.flush()
+    assert counters(conn) == (-1, 0, 1)
+    assert counters(conn, 'comments') == (1, 1, 0)
+    assert commits == [1]
+    assert os.path.getsize(buffer.journal_path) == 0
+
+
+def test_failed_flush_keeps_the_batch(conn, start, monkeypatch):
+    commits = []
+    buffer = start(on_commit=lambda: commits.append(1))
+    buffer.vote('post', 1, 2, 'like-button', 1)
+
+    def fail(conn, states):
+        raise sqlite3.OperationalError('database is locked')
+    write_states = votes.write_states
+    monkeypatch.setattr(votes, 'write_states', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        buffer.flush()
+    assert commits == [] and counters(conn) == (0, 0, 0)
+    assert not os.path.exists(buffer.journal_path + '.flushing')
+    # The batch is pending again, underneath clicks made since
+    assert buffer.vote('comment', 1, 2, 'dislike-button', -1) == -1
+    assert buffer.vote('post', 1, 2, 'like-button', -1) == 0
+    with open(buffer.journal_path, encoding='utf-8') as file:
+        assert len(file.readlines()) == 3
+    monkeypatch.setattr(votes, 'write_states', write_states)
+    buffer.flush()
+    assert counters(conn) == (0, 0, 0)
+    assert counters(conn, 'comments') == (-1, 0, 1)
+    assert commits == [1]
@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger(__name__)
+
+# item kind -> (item table, vote table, vote table's item column)
+TABLES = {'post': ('posts', 'likes_dislikes_posts', 'post_id'),
+          'comment': ('comments', 'likes_dislikes_comments', 'comment_id')}
+# vote state: True liked, False disliked, None no vote
+VALUE = {True: 1, False: -1, None: 0}
+
+
+def next_vote(vote, clicked):
+    if clicked == 'like-button':
+        return None if vote is True else True
+    elif clicked == 'dislike-button':
+        return None if vote is False else False
+    raise ValueError(clicked)
+
+
+def apply_vote(kind, item_id, user_id, clicked, what):
+    # Applies one click in a single write transaction and returns the item's new rating,
+    # or None when the click is invalid. `what` is the rating change the client expects;
+    # a mismatch means its view of the vote is stale (or forged), so nothing is written.
+    table, votes_table, column = TABLES[kind]
+    if clicked not in ('like-button', 'dislike-button') or type(what) != int:
+        return None
+    with db.transaction() as conn:
+        row = conn.execute(f'SELECT likeorno FROM {votes_table} WHERE user_id = ? AND {column} = ?',
+                           (user_id, item_id)).fetchone()
+        old = bool(row[0]) if row else None
+        new = next_vote(old, clicked)
+        delta = VALUE[new] - VALUE[old]
+        if delta != what:
+            return None
+        updated = conn.execute(f'''UPDATE {table}
+                                   SET rating = rating + ?,
+                                       likes = likes + ?,
+                                       dislikes = dislikes + ?,
+                                       popularity_score = {db.POPULARITY.format(rating='rating + ?')}
+                                   WHERE id = ?''',
+                               (delta, (new is True) - (old is True), (new is False) - (old is False), delta, item_id))
+        if updated.rowcount != 1:
+            return None
+        if new is None:
+            conn.execute(f'DELETE FROM {votes_table} WHERE user_id = ? AND {column} = ?', (user_id, item_id))
+        else:
+            conn.execute(f'INSERT OR REPLACE INTO {votes_table} (user_id, {column}, likeorno) VALUES (?, ?, ?)',
+                         (user_id, item_id, new))
+        return conn.execute(f'SELECT rating FROM {table} WHERE id = ?', (item_id,)).fetchone()[0]
+
+
+def _read_state(conn, kind, item_id, user_id):
+    table, votes_table, column = TABLES[kind]
+    row = conn.execute(f'SELECT likeorno FROM {votes_table} WHERE user_id = ? AND {column} = ?',
+                       (user_id, item_id)).fetchone()
+    return bool(row[0]) if row else None
+
+
+def _lock(file, wait):
+    # Exclusive lock on an open file until it is closed; False if another process holds it and
+    # `wait` is False
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def write_states(conn, states):
+    # Brings each (kind, user_id, item_id) -> vote state to its final value inside the caller's
+    # transaction. Deltas are taken against what is stored right now, so writing the same
+    # states twice changes nothing (journal replay relies on this).
+    items = {}
+    for (kind, user_id, item_id), new in states.items():
+        table, votes_table, column = TABLES[kind]
+        old = _read_state(conn, kind, item_id, user_id)
+        if old == new:
+            continue
+        if new is None:
+            conn.execute(f'DELETE FROM {votes_table} WHERE user_id = ? AND {column} = ?', (user_id, item_id))
+        else:
+            conn.execute(f'INSERT OR REPLACE INTO {votes_table} (user_id, {column}, likeorno) VALUES (?, ?, ?)',
+                         (user_id, item_id, new))
+        delta = items.setdefault((kind, item_id), [0, 0, 0])
+        delta[0] += VALUE[new] - VALUE[old]
+        delta[1] += (new is True) - (old is True)
+        delta[2] += (new is False) - (old is False)
+    for (kind, item_id), (rating, likes, dislikes) in items.items():
+        conn.execute(f'''UPDATE {TABLES[kind][0]}
+                         SET rating = rating + ?,
+                             likes = likes + ?,
+                             dislikes = dislikes + ?,
+                             popularity_score = {db.POPULARITY.format(rating='rating + ?')}
+                         WHERE id = ?''', (rating, likes, dislikes, rating, item_id))
+
+
+class VoteBuffer:
+    # Write-behind queue for votes. A click is validated against the buffered state, journaled,
+    # and answered at once with the projected rating. The final state of each (user, item)
+    # reaches the database in one transaction every `interval` seconds, or sooner once
+    # `max_events` clicks are waiting. If flushing falls more than `max_staleness` seconds
+    # behind, clicks flush synchronously until it catches up.
+    # Every process journals to a file of its own, `journal_path` with its pid added
+    # (database/votes-<pid>.journal), and holds a lock on a matching .lock file while it runs.
+    # A journal whose lock is free belongs to a process that is gone, and is replayed by the
+    # next buffer to start. `on_commit` is called after every batch reaches the database.
+
+    def __init__(self, journal_path, interval=0.2, max_events=500, max_staleness=5.0, fsync=True, on_commit=None):
+        self.base, self.suffix = os.path.splitext(journal_path)
+        self.journal_path = f'{self.base}-{os.getpid()}{self.suffix}'
+        self.interval = interval
+        self.max_events = max_events
+        self.max_staleness = max_staleness
+        self.fsync = fsync
+        self.on_commit = on_commit
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # key -> final vote state; `flushing` is the batch currently being committed
+        self.pending, self.flushing = {}, {}
+        # (kind, item_id) -> rating change not yet committed
+        self.pending_deltas, self.flushing_deltas = {}, {}
+        self.events = 0
+        self.oldest = None
+        # Starting buffers take turns, so a journal is never replayed twice or claimed by its
+        # new owner while another process replays it
+        with open(self.base + '.lock', 'a') as startup:
+            _lock(startup, wait=True)
+            self.recover()
+            self.owner = open(f'{self.base}-{os.getpid()}.lock', 'a')
+            _lock(self.owner, wait=False)
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def recover(self):
+        # Replays the journals of processes that are gone: for each, the batch that was being
+        # flushed, then the clicks acknowledged after it. Journals of live processes stay theirs.
+        folder, prefix = os.path.split(self.base)
+        folder = folder or '.'
+        stems = set()
+        for name in os.listdir(folder):
+            stem = name[:-len('.flushing')] if name.endswith('.flushing') else name
+            if stem.endswith(self.suffix) and (stem == prefix + self.suffix or stem.startswith(prefix + '-')):
+                stems.add(os.path.join(folder, stem[:-len(self.suffix)]))
+        for stem in sorted(stems):
+            lock = None
+            # (the journal of a single process buffer from before per-process journals has
+            # no lock of its own: base + '.lock' is the startup lock, held right now)
+            if stem != self.base and os.path.exists(stem + '.lock'):
+                lock = open(stem + '.lock', 'a')
+                if not _lock(lock, wait=False):
+                    lock.close()
+                    continue
+            paths = (stem + self.suffix + '.flushing', stem + self.suffix)
+            states = {}
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                with open(path, encoding='utf-8') as journal:
+                    for line in journal:
+                        try:
+                            kind, item_id, user_id, state = json.loads(line)
+                        except ValueError:
+                            break  # torn last line, that click was never acknowledged
+                        states[(kind, user_id, item_id)] = state
+            if states:
+                with db.transaction() as conn:
+                    write_states(conn, states)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            if lock is not None:
+                lock.close()
+                os.remove(stem + '.lock')
+
+    def state(self, conn, kind, item_id, user_id):
+        key = (kind, user_id, item_id)
+        if key in self.pending:
+            return self.pending[key]
+        if key in self.flushing:
+            return self.flushing[key]
+        return _read_state(conn, kind, item_id, user_id)
+
+    def vote(self, kind, item_id, user_id, clicked, what):
+        if clicked not in ('like-button', 'dislike-button') or type(what) != int:
+            return None
+        if self.oldest is not None and time.monotonic() - self.oldest > self.max_staleness:
+            self.flush()
+        conn = db.connect()
+        with self.lock:
+            row = conn.execute(f'SELECT rating FROM {TABLES[kind][0]} WHERE id = ?', (item_id,)).fetchone()
+            if row is None:
+                return None
+            old = self.state(conn, kind, item_id, user_id)
+            new = next_vote(old, clicked)
+            delta = VALUE[new] - VALUE[old]
+            if delta != what:
+                return None
+            self.journal.write(json.dumps([kind, item_id, user_id, new]) + '\n')
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+            self.pending[(kind, user_id, item_id)] = new
+            self.pending_deltas[(kind, item_id)] = self.pending_deltas.get((kind, item_id), 0) + delta
+            self.events += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.events >= self.max_events:
+                self.wakeup.set()
+            return row[0] + self.pending_deltas[(kind, item_id)] + self.flushing_deltas.get((kind, item_id), 0)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                self.flushing, self.pending = self.pending, {}
+                self.flushing_deltas, self.pending_deltas = self.pending_deltas, {}
+                self.events, self.oldest = 0, None
+                self.journal.close()
+                os.replace(self.journal_path, self.journal_path + '.flushing')
+                self.journal = open(self.journal_path, 'a', encoding='utf-8')
+            try:
+                with db.transaction() as conn:
+                    write_states(conn, self.flushing)
+                    # Commit and retire the batch together, so a click never counts its deltas twice
+                    with self.lock:
+                        conn.commit()
+                        self.flushing, self.flushing_deltas = {}, {}
+            except:
+                # Keep the batch: put it back underneath anything clicked since
+                with self.lock:
+                    self.pending = {**self.flushing, **self.pending}
+                    for key, delta in self.flushing_deltas.items():
+                        self.pending_deltas[key] = self.pending_deltas.get(key, 0) + delta
+                    self.flushing, self.flushing_deltas = {}, {}
+                    self.oldest = self.oldest or time.monotonic()
+                    self.journal.close()
+                    with open(self.journal_path + '.flushing', 'a', encoding='utf-8') as failed, \
+                            open(self.journal_path, encoding='utf-8') as newer:
+                        failed.write(newer.read())
+                    os.replace(self.journal_path + '.flushing', self.journal_path)
+                    self.journal = open(self.journal_path, 'a', encoding='utf-8')
+                raise
+            os.remove(self.journal_path + '.flushing')
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Flushing buffered votes failed, they stay pending')